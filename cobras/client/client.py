@@ -93,6 +93,7 @@ async def subscribeHandler(connection, **args):
     resumeFromLastPosition = args['resumeFromLastPosition']
     resumeFromLastPositionId = args['resumeFromLastPositionId']
     batchSize = args['batchSize']
+    resume = args.get('resume', False)
 
     return await connection.subscribe(
         channel,
@@ -104,6 +105,7 @@ async def subscribeHandler(connection, **args):
         resumeFromLastPosition,
         resumeFromLastPositionId,
         batchSize,
+        resume,
     )
 
 
@@ -119,10 +121,13 @@ async def subscribeClient(
     resumeFromLastPosition=False,
     resumeFromLastPositionId=None,
     batchSize=1,
+    subscriptionId=None,
+    resume=False,
 ):
     subscribeHandlerPartial = functools.partial(
         subscribeHandler,
         channel=channel,
+        subscription_id=subscriptionId or channel,
         position=position,
         fsqlFilter=fsqlFilter,
         messageHandlerClass=messageHandlerClass,
@@ -130,6 +135,7 @@ async def subscribeClient(
         resumeFromLastPosition=resumeFromLastPosition,
         resumeFromLastPositionId=resumeFromLastPositionId,
         batchSize=batchSize,
+        resume=resume,
     )
 
     ret = await client(url, credentials, subscribeHandlerPartial, waitTime)
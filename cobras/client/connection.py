@@ -16,6 +16,9 @@ import websockets
 from cobras.common.auth_hash import computeHash
 from cobras.common.task_cleanup import addTaskCleanup
 
+# Actions whose responses depend on the publish ack mode
+PUBLISH_ACTIONS = ('rtm/publish', 'rtm/publish_batch')
+
 
 class AuthException(Exception):
     pass
@@ -39,13 +42,22 @@ class Connection(object):
     '''FIXME: leaking queues
     '''
 
-    def __init__(self, url, creds):
+    def __init__(self, url, creds, publishAck=None):
         self.url = url
         self.creds = creds
         self.idIterator = itertools.count()
         self.connectionId = None
         self.serverVersion = 'na'
 
+        # Publish acknowledgement mode, such as
+        # {"mode": "cumulative", "count": 100, "interval_ms": 50}
+        self.publishAck = publishAck
+        self.publishAckMode = (publishAck or {}).get('mode', 'all')
+
+        # Id of the last publish acknowledged with a cumulative ack
+        self.publishAckId = None
+        self.awaitedPublishIds = set()
+
         # different queues per action kind or instances
         self.queues = collections.defaultdict(asyncio.Queue)
 
@@ -76,6 +88,9 @@ class Connection(object):
             "body": {"data": {"role": role}, "method": "role_secret"},
         }
 
+        if self.publishAck is not None:
+            handshake['body']['data']['publish_ack'] = self.publishAck
+
         response = await self.send(handshake)
 
         self.serverVersion = response['body']['data']['version']
@@ -112,6 +127,11 @@ class Connection(object):
                 if action == 'rtm/subscription':
                     actionId = action + '::' + data['body']['subscription_id']
 
+                # Response to a publish made without waiting for a response
+                if action in PUBLISH_ACTIONS and msgId not in self.awaitedPublishIds:
+                    self.handlePublishAck(data)
+                    continue
+
                 q = self.getQueue(actionId)
 
                 await q.put(data)
@@ -127,6 +147,23 @@ class Connection(object):
             if len(self.queues) != 0:
                 logging.warning(f'connection has pending queues: {self.queues}')
 
+    def handlePublishAck(self, data):
+        body = data.get('body', {})
+        if data['action'].endswith('/ok'):
+            self.publishAckId = data['id']
+
+            # Partial failures
+            errors = body.get('errors') or [
+                result
+                for result in body.get('results', [])
+                if 'error' in result or 'errors' in result
+            ]
+            if errors:
+                logging.warning(f'publish {data["id"]} partly failed: {errors}')
+        else:
+            error = body.get('error')
+            logging.warning(f'publish {data["id"]} failed: {error}')
+
     def getQueue(self, action):
         q = self.queues[action]
         return q
@@ -180,12 +217,21 @@ class Connection(object):
         # Compute the action id
         actionId = self.computeDefaultActionId(pdu)
 
+        isPublish = pdu['action'] in PUBLISH_ACTIONS
+        if isPublish:
+            self.awaitedPublishIds.add(pdu['id'])
+
         data = json.dumps(pdu)
         logging.info(f"client > {data}")
         await self.websocket.send(data)
 
         # get the response
-        data = await self.getActionResponse(actionId)
+        try:
+            data = await self.getActionResponse(actionId)
+        finally:
+            if isPublish:
+                self.awaitedPublishIds.discard(pdu['id'])
+
         logging.info(f"client < {data}")
 
         # validate response
@@ -205,8 +251,12 @@ class Connection(object):
         resumeFromLastPosition=False,
         resumeFromLastPositionId=None,
         batchSize=1,
+        resume=False,
     ):
-
+        '''With resume, the server saves the position of the subscription
+        and restarts from it when subscribing again with the same
+        subscription id.
+        '''
         if resumeFromLastPosition:
             try:
                 position = await self.read(resumeFromLastPositionId)
@@ -231,6 +281,9 @@ class Connection(object):
             },
         }
 
+        if resume:
+            pdu['body']['resume'] = True
+
         if position is not None:
             pdu['body']['position'] = position
 
@@ -272,12 +325,52 @@ class Connection(object):
 
         self.subscriptions.remove(subscriptionId)
 
-    async def publish(self, channel, msg):
+    async def sendWithoutResponse(self, pdu):
+        # Set the message id
+        pdu["id"] = next(self.idIterator)
+
+        data = json.dumps(pdu)
+        logging.info(f"client > {data}")
+        await self.websocket.send(data)
+
+    async def publish(self, channel, msg, ack=True):
+        '''With ack=False, or when the connection uses a 'none' or 'cumulative'
+        publish ack mode, we do not wait for a response.
+        '''
         pdu = {"action": "rtm/publish", "body": {"channel": channel, "message": msg}}
-        await self.send(pdu)
 
-    async def write(self, channel, msg):
+        if ack and self.publishAckMode == 'all':
+            await self.send(pdu)
+            return
+
+        if not ack:
+            pdu['body']['ack'] = False
+
+        await self.sendWithoutResponse(pdu)
+
+    async def publishBatch(self, entries):
+        '''entries is a list of {"channel": channel, "message": msg} dicts
+        ("channels" can be used instead of "channel").
+        Returns one result per entry, with the stream id of each channel
+        the message was published to, or an error. None is returned when the
+        publish ack mode of the connection is not 'all'.
+        '''
+        pdu = {"action": "rtm/publish_batch", "body": {"messages": entries}}
+
+        # Without a response when the publish ack mode is 'none' or
+        # 'cumulative', failures are logged when they come back
+        if self.publishAckMode != 'all':
+            await self.sendWithoutResponse(pdu)
+            return None
+
+        data = await self.send(pdu)
+
+        return data['body']['results']
+
+    async def write(self, channel, msg, ttl=None):
         pdu = {"action": "rtm/write", "body": {"channel": channel, "message": msg}}
+        if ttl is not None:
+            pdu['body']['ttl'] = ttl
         await self.send(pdu)
 
     async def read(self, channel, position=None):
@@ -291,6 +384,34 @@ class Connection(object):
         pdu = {"action": "rtm/delete", "body": {"channel": channel}}
         await self.send(pdu)
 
+    async def mread(self, channels):
+        '''Returns a dict of channel -> message (None for missing channels)'''
+        pdu = {"action": "rtm/mread", "body": {"channels": channels}}
+        data = await self.send(pdu)
+
+        return data['body']['messages']
+
+    async def mwrite(self, messages, ttl=None):
+        '''messages is a dict of channel -> message.
+        Returns a dict of channel -> error for the writes which failed.
+        '''
+        entries = [
+            {"channel": channel, "message": msg} for channel, msg in messages.items()
+        ]
+        pdu = {"action": "rtm/mwrite", "body": {"messages": entries}}
+        if ttl is not None:
+            pdu['body']['ttl'] = ttl
+        data = await self.send(pdu)
+
+        return data['body'].get('errors', {})
+
+    async def mdelete(self, channels):
+        '''Returns a dict of channel -> error for the deletes which failed'''
+        pdu = {"action": "rtm/mdelete", "body": {"channels": channels}}
+        data = await self.send(pdu)
+
+        return data['body'].get('errors', {})
+
     async def adminCloseConnection(self, connectionId):
         pdu = {
             "action": "admin/close_connection",
@@ -307,6 +428,30 @@ class Connection(object):
         except Exception as e:
             raise ValueError(f'rpc/admin/get_connections_count failure {e}')
 
+    async def adminGetConsumerLag(self, count=10):
+        '''The subscriptions with the largest lags on the server node'''
+        pdu = {"action": "admin/get_consumer_lag", "body": {"count": count}}
+        data = await self.send(pdu)
+
+        return data['body'].get('subscriptions', [])
+
+    async def adminGetSlowCallbacks(self):
+        '''The last callbacks which blocked the event loop of the server node'''
+        pdu = {"action": "admin/get_slow_callbacks", "body": {}}
+        data = await self.send(pdu)
+
+        return data['body']
+
+    async def adminProfile(self, duration=5, mode='sampler', top=20):
+        '''Profile the server node, returns collapsed stacks and top functions'''
+        pdu = {
+            "action": "admin/profile",
+            "body": {"duration": duration, "mode": mode, "top": top},
+        }
+        data = await self.send(pdu)
+
+        return data['body']
+
     async def close(self):
         subscriptions = copy.copy(self.subscriptions)
         for subscription in subscriptions:
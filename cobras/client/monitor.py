@@ -29,6 +29,12 @@ def getDefaultMonitorUrl(host=None, port=None):
     return f'ws://{host}:{port}/v2?appkey={STATS_APPKEY}'
 
 
+def mergeMetric(metric, a, b):
+    '''Values are summed up across nodes, roles and channels, except for
+    maximums such as lag_max_ms'''
+    return max(a, b) if metric.endswith('_max_ms') else a + b
+
+
 def writeJson(data):
     '''JSON Pretty printer'''
 
@@ -48,6 +54,7 @@ class MessageHandlerClass:
         self.showNodes = args['show_nodes']
         self.showRoles = args['show_roles']
         self.showChannels = args['show_channels']
+        self.showLatencies = args['show_latencies']
         self.showSumarry = args['show_summary']
         self.subscribers = args['subscribers']
         self.system = args['system']
@@ -68,6 +75,8 @@ class MessageHandlerClass:
         self.allChannelMetrics = {}
         self.channels = set()
 
+        self.latencies = {}
+
     async def on_init(self):
         pass
 
@@ -99,8 +108,10 @@ class MessageHandlerClass:
                     if skip:
                         continue
 
-                s = sum(cobraData[key].values())
-                self.metrics[key] += s
+                s = 0
+                for val in cobraData[key].values():
+                    s = mergeMetric(key, s, val)
+                self.metrics[key] = mergeMetric(key, self.metrics[key], s)
 
                 s = self.humanReadableSize(key, s)
 
@@ -113,6 +124,10 @@ class MessageHandlerClass:
             if channelData is not None:
                 self.updateChannelMetrics(channelData)
 
+            latencies = data['data'].get('latencies')
+            if latencies is not None:
+                self.updateLatencyMetrics(latencies)
+
             # System stats
             for metric in data['data']['system'].keys():
                 val = data['data']['system'][metric]
@@ -165,6 +180,9 @@ class MessageHandlerClass:
         if self.showChannels:
             self.displayChannelMetrics()
 
+        if self.showLatencies:
+            self.displayLatencyMetrics()
+
         self.resetMetrics()
         return ActionFlow.STOP if self.once else ActionFlow.CONTINUE
 
@@ -178,7 +196,7 @@ class MessageHandlerClass:
                 metricByRole = collections.defaultdict(int)
 
             for role, val in metricData.items():
-                metricByRole[role] += val
+                metricByRole[role] = mergeMetric(metric, metricByRole[role], val)
 
                 if self.roleFilter is not None:
                     if self.roleFilter in role:
@@ -223,7 +241,9 @@ class MessageHandlerClass:
                 metricByChannel = collections.defaultdict(int)
 
             for channel, val in metricData.items():
-                metricByChannel[channel] += val
+                metricByChannel[channel] = mergeMetric(
+                    metric, metricByChannel[channel], val
+                )
 
                 if self.channelFilter is not None:
                     if self.channelFilter in channel:
@@ -264,6 +284,38 @@ class MessageHandlerClass:
         print()
         print(tabulate.tabulate(rows, tablefmt="simple", headers="firstrow"))
 
+    def updateLatencyMetrics(self, latencies):
+        '''Percentiles cannot be merged, the worst node is kept'''
+        for kind, series in latencies.items():
+            for name, stats in series.items():
+                key = (kind, name)
+
+                if self.metricFilter is not None:
+                    if self.metricFilter not in name:
+                        continue
+
+                merged = self.latencies.get(key)
+                if merged is None:
+                    self.latencies[key] = dict(stats)
+                    continue
+
+                for metric, val in stats.items():
+                    if metric == 'count':
+                        merged[metric] += val
+                    else:
+                        merged[metric] = max(merged[metric], val)
+
+    def displayLatencyMetrics(self):
+        '''Latencies in ms of the last second, per action and redis command'''
+        metrics = ['count', 'p50', 'p90', 'p99', 'max']
+        rows = [['Latencies (ms)'] + metrics]
+
+        for (kind, name), stats in sorted(self.latencies.items()):
+            rows.append([f'{kind} {name}'] + [stats.get(m, 0) for m in metrics])
+
+        print()
+        print(tabulate.tabulate(rows, tablefmt="simple", headers="firstrow"))
+
 
 def runMonitor(
     url,
@@ -280,6 +332,7 @@ def runMonitor(
     system,
     once,
     retry=True,
+    showLatencies=True,
 ):
     position = None
 
@@ -303,6 +356,7 @@ def runMonitor(
                 'show_nodes': showNodes,
                 'show_roles': showRoles,
                 'show_channels': showChannels,
+                'show_latencies': showLatencies,
                 'show_summary': showSumarry,
                 'subscribers': subscribers,
                 'system': system,
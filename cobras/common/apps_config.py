@@ -22,6 +22,16 @@ ADMIN_APPKEY = '_admin'
 PUBSUB_APPKEY = '_pubsub'
 PULSAR_APPKEY = '_pulsar'
 
+# Server keys live outside of the {appkey}::{channel} namespace of the apps,
+# under a prefix which cannot be an appkey
+CHECKPOINT_KEY_PREFIX = '_checkpoint'
+RESERVED_APPKEYS = (CHECKPOINT_KEY_PREFIX,)
+
+KV_BACKEND_STREAM = 'stream'
+KV_BACKEND_HASH = 'hash'
+KV_BACKEND_STRING = 'string'
+KV_BACKENDS = (KV_BACKEND_STREAM, KV_BACKEND_HASH, KV_BACKEND_STRING)
+
 
 class AppsConfig:
     def __init__(self, path: str) -> None:
@@ -45,6 +55,9 @@ class AppsConfig:
             raise ValueError(f'No apps present in config file')
 
         for app in self.apps:
+            if app in RESERVED_APPKEYS:
+                raise ValueError(f'app "{app}" is a reserved name')
+
             for roleName, role in self.apps[app]['roles'].items():
                 if not isinstance(role, dict):
                     raise ValueError(f'role "{roleName}" is not a dict')
@@ -52,6 +65,14 @@ class AppsConfig:
                 if role.get('secret') is None:
                     raise ValueError(f'role "{roleName}" is missing a secret')
 
+            redisUrls = self.apps[app].get('redis_urls')
+            if redisUrls is not None and not isinstance(redisUrls, str):
+                raise ValueError(f'app "{app}" redis_urls is not a string')
+
+            kvBackend = self.apps[app].get('kv_backend', KV_BACKEND_STREAM)
+            if kvBackend not in KV_BACKENDS:
+                raise ValueError(f'app "{app}" has an invalid kv_backend {kvBackend}')
+
     def isAppKeyValid(self, appkey: str) -> bool:
         return self.apps.get(appkey) is not None
 
@@ -96,6 +117,50 @@ class AppsConfig:
     def getBatchPublishSize(self):
         return self.data.get('batch_publish_size', -1)
 
+    def getBatchPublishLingerMs(self):
+        return self.data.get('batch_publish_linger_ms', 1)
+
+    def getRedisPoolSize(self, appkey: str) -> int:
+        '''Max number of redis connections used for KV operations by an app'''
+        defaultSize = self.data.get('redis_pool_size', 8)
+        return self.apps.get(appkey, {}).get('redis_pool_size', defaultSize)
+
+    def getRedisUrls(self, appkey: str):
+        '''None for apps using the redis urls given on the command line'''
+        return self.apps.get(appkey, {}).get('redis_urls')
+
+    def getRedisPassword(self, appkey: str):
+        return self.apps.get(appkey, {}).get('redis_password')
+
+    def isRedisCluster(self, appkey: str) -> bool:
+        return self.apps.get(appkey, {}).get('redis_cluster', False)
+
+    def getKvBackend(self, appkey: str) -> str:
+        return self.apps.get(appkey, {}).get('kv_backend', KV_BACKEND_STREAM)
+
+    def getReadCacheSize(self) -> int:
+        return self.data.get('read_cache_size', 10000)
+
+    def getReadCacheTtlMs(self, appkey: str) -> int:
+        '''0 disables the read cache for an app'''
+        return self.apps.get(appkey, {}).get('read_cache_ttl_ms', 0)
+
+    def getCheckpointIntervalMs(self) -> int:
+        '''How often the positions of durable subscriptions are saved'''
+        return self.data.get('checkpoint_interval_ms', 1000)
+
+    def getChannelStatsTopK(self) -> int:
+        '''How many channels are reported in the stats, per metric'''
+        return self.data.get('channel_stats_top_k', 100)
+
+    def getSlowCallbackMs(self) -> int:
+        '''How long the event loop can be blocked before its stack is logged'''
+        return self.data.get('slow_callback_ms', 500)
+
+    def getSubscriberQueueSize(self) -> int:
+        '''How many messages a subscriber can fall behind before being dropped'''
+        return self.data.get('subscriber_queue_size', 1000)
+
     def getChannelMaxLength(self):
         return self.data.get('channel_max_length', 1000)
 
@@ -0,0 +1,94 @@
+'''Counters of a fixed set of metrics per key, stored in preallocated lists
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Each key (a role for example) is interned once to the offset of its
+counters, so that counting a message is a single dict lookup followed by
+list increments. Counters are never reset: the values of the last
+period are computed by endPeriod, as the difference with a snapshot of
+the previous period, and stored in place.
+
+Lists are used rather than array.array, whose increments are slower in
+CPython since every value has to be converted from and to a python int.
+'''
+
+INITIAL_KEYS = 16
+
+
+class CounterRegistry(object):
+    def __init__(self, metrics, initialKeys: int = INITIAL_KEYS) -> None:
+        self.metrics = {metric: i for i, metric in enumerate(metrics)}
+        self.width = len(metrics)
+        self.offsets = {}  # key -> offset of its first counter
+        self.keys = []
+
+        size = self.width * initialKeys
+        self.values = [0] * size
+        self.snapshot = [0] * size
+        self.period = [0] * size
+
+    def getIndex(self, metric: str) -> int:
+        return self.metrics[metric]
+
+    def intern(self, key) -> int:
+        offset = self.offsets.get(key)
+        if offset is not None:
+            return offset
+
+        offset = len(self.keys) * self.width
+        if offset == len(self.values):
+            # Double the capacity, new counters are zeroes
+            for counters in (self.values, self.snapshot, self.period):
+                counters.extend([0] * len(counters))
+
+        self.offsets[key] = offset
+        self.keys.append(key)
+        return offset
+
+    def makeUpdater(self, index: int):
+        '''Return update(key, val), counting one event of val bytes in the
+        counters index and index + 1 of key. The lists are only modified in
+        place, so the closure can keep references to them.
+        '''
+        offsets = self.offsets
+        values = self.values
+        intern = self.intern
+        bytesIndex = index + 1
+
+        def update(key, val):
+            offset = offsets.get(key)
+            if offset is None:
+                offset = intern(key)
+
+            values[offset + index] += 1
+            values[offset + bytesIndex] += val
+
+        return update
+
+    def endPeriod(self):
+        '''Compute the values of the period ending now'''
+        values, snapshot, period = self.values, self.snapshot, self.period
+        for i in range(len(self.keys) * self.width):
+            period[i] = values[i] - snapshot[i]
+
+        snapshot[:] = values
+
+    def get(self, key, metric: str) -> int:
+        offset = self.offsets.get(key)
+        if offset is None:
+            return 0
+
+        return self.values[offset + self.metrics[metric]]
+
+    def getValues(self, metric: str) -> dict:
+        index = self.metrics[metric]
+        return {
+            key: self.values[offset + index] for key, offset in self.offsets.items()
+        }
+
+    def getPeriodValues(self, metric: str) -> dict:
+        '''Values of the last period, as computed by endPeriod'''
+        index = self.metrics[metric]
+        return {
+            key: self.period[offset + index] for key, offset in self.offsets.items()
+        }
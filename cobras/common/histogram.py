@@ -0,0 +1,120 @@
+'''Log linear latency histograms (HDR histogram style), with fixed memory
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Values are recorded in microseconds. Each power of two range is split in
+32 buckets of equal width, so a reported percentile is at most 1/32 (3%)
+above the real one. Values up to 2^36 us (19 hours) fit in 1024 buckets.
+'''
+
+SUB_BUCKET_BITS = 6
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS  # values below are counted exactly
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+MAX_VALUE = (1 << 36) - 1
+
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+def getBucketIndex(value: int) -> int:
+    if value < SUB_BUCKET_COUNT:
+        return value
+
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value >> shift)
+
+
+def getBucketUpperBound(index: int) -> int:
+    '''Largest value counted in a bucket'''
+    if index < SUB_BUCKET_COUNT:
+        return index
+
+    shift = index // SUB_BUCKET_HALF - 1
+    mantissa = index - shift * SUB_BUCKET_HALF
+    return ((mantissa + 1) << shift) - 1
+
+
+BUCKET_COUNT = getBucketIndex(MAX_VALUE) + 1
+ZEROES = [0] * BUCKET_COUNT
+
+
+class Histogram(object):
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.max = 0
+        self.sum = 0
+
+    def record(self, seconds: float):
+        value = min(int(seconds * 1e6), MAX_VALUE)
+
+        self.counts[getBucketIndex(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def getPercentiles(self) -> dict:
+        '''Percentiles in microseconds, in one pass over the buckets'''
+        percentiles = {}
+        if self.count == 0:
+            return {name: 0 for name, _ in PERCENTILES}
+
+        targets = iter(PERCENTILES)
+        name, p = next(targets)
+        threshold = p * self.count
+        total = 0
+
+        for index, count in enumerate(self.counts):
+            total += count
+            while total >= threshold:
+                percentiles[name] = min(getBucketUpperBound(index), self.max)
+
+                nextTarget = next(targets, None)
+                if nextTarget is None:
+                    return percentiles
+
+                name, p = nextTarget
+                threshold = p * self.count
+
+        return percentiles
+
+    def getStats(self) -> dict:
+        '''count, and p50, p90, p99 and max in milliseconds'''
+        stats = {'count': self.count}
+        for name, value in self.getPercentiles().items():
+            stats[name] = value / 1000
+        stats['max'] = self.max / 1000
+        return stats
+
+    def reset(self):
+        self.counts[:] = ZEROES
+        self.count = 0
+        self.max = 0
+        self.sum = 0
+
+
+class Histograms(object):
+    '''One histogram per name, for a bounded set of names'''
+
+    def __init__(self) -> None:
+        self.histograms = {}
+
+    def record(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[name] = histogram
+
+        histogram.record(seconds)
+
+    def getStats(self) -> dict:
+        '''Stats of the histograms with values'''
+        return {
+            name: histogram.getStats()
+            for name, histogram in self.histograms.items()
+            if histogram.count > 0
+        }
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
@@ -0,0 +1,209 @@
+'''python profiler that can be started and stopped on a running process
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Unlike the atexit profiler, no restart is needed. Two modes are available:
+
+* sampler: a thread records the stack of the event loop thread every few
+  milliseconds. The overhead is low and does not depend on the number of
+  function calls, which makes it usable on a node under real load.
+  The stacks are returned collapsed, one per line, the format expected
+  by flamegraph.pl or speedscope: `outer;inner;leaf 12`
+* cprofile: the deterministic profiler, over the same window. Timings are
+  exact, but every call is slowed down. No stacks are available.
+'''
+
+import asyncio
+import collections
+import cProfile
+import os
+import pstats
+import selectors
+import sys
+import threading
+
+PROFILE_MODES = ('sampler', 'cprofile')
+DEFAULT_PROFILE_MODE = 'sampler'
+DEFAULT_PROFILE_DURATION = 5
+MAX_PROFILE_DURATION = 60
+DEFAULT_SAMPLING_INTERVAL_MS = 5
+DEFAULT_TOP_FUNCTIONS = 20
+
+# Bounds the size of a profile, the rarest stacks are dropped
+MAX_STACKS = 1000
+MAX_STACK_DEPTH = 128
+
+# The frames of the event loop are below almost every stack, and would
+# fill the top functions
+EVENT_LOOP_FILES = (os.path.dirname(asyncio.__file__), selectors.__file__)
+
+# Profiling slows the node down, one profile at a time
+profileLock = threading.Lock()
+
+
+def getFrameName(code) -> str:
+    filename = os.path.basename(code.co_filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def isEventLoopCode(code) -> bool:
+    return code.co_filename.startswith(EVENT_LOOP_FILES)
+
+
+def collapseStack(frame, eventLoopFrames) -> str:
+    '''Frame names from the outermost to the innermost, separated by ;
+    The names of the event loop frames are added to eventLoopFrames
+    '''
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        name = getFrameName(frame.f_code)
+        if isEventLoopCode(frame.f_code):
+            eventLoopFrames.add(name)
+
+        names.append(name)
+        frame = frame.f_back
+
+    names.reverse()
+    return ';'.join(names)
+
+
+class SamplingProfiler:
+    def __init__(self, threadId, intervalMs=DEFAULT_SAMPLING_INTERVAL_MS):
+        self.threadId = threadId
+        self.interval = intervalMs / 1000
+
+        self.stacks = collections.Counter()
+        self.eventLoopFrames = set()
+        self.sampleCount = 0
+
+        self.thread = None
+        self.stopSampling = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.sample, name='cobra-sampling-profiler', daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopSampling.set()
+        self.thread.join()
+
+    def sample(self):
+        while not self.stopSampling.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                continue
+
+            self.stacks[collapseStack(frame, self.eventLoopFrames)] += 1
+            self.sampleCount += 1
+
+    def getCollapsedStacks(self) -> str:
+        lines = [
+            f'{stack} {count}' for stack, count in self.stacks.most_common(MAX_STACKS)
+        ]
+        return '\n'.join(lines)
+
+    def getTopFunctions(self, count, skipEventLoop=True) -> list:
+        '''Functions with the most samples, where they run or below them.
+        Ties are broken by self samples, then by name.
+        '''
+        selfSamples = collections.Counter()
+        totalSamples = collections.Counter()
+
+        for stack, samples in self.stacks.items():
+            names = stack.split(';')
+            selfSamples[names[-1]] += samples
+
+            # Recursive functions are only counted once per stack
+            for name in set(names):
+                totalSamples[name] += samples
+
+        names = list(totalSamples)
+        if skipEventLoop:
+            names = [name for name in names if name not in self.eventLoopFrames]
+
+        names.sort(key=lambda name: (-totalSamples[name], -selfSamples[name], name))
+
+        return [
+            {
+                'function': name,
+                'self_samples': selfSamples[name],
+                'total_samples': totalSamples[name],
+            }
+            for name in names[:count]
+        ]
+
+
+def getCProfileTopFunctions(profiler, count) -> list:
+    '''Functions with the largest cumulative time'''
+    stats = pstats.Stats(profiler).stats
+
+    functions = []
+    for (filename, line, name), (_, calls, selfTime, totalTime, _) in stats.items():
+        functions.append(
+            {
+                'function': f'{name} ({os.path.basename(filename)}:{line})',
+                'calls': calls,
+                'self_ms': round(selfTime * 1000, 3),
+                'total_ms': round(totalTime * 1000, 3),
+            }
+        )
+
+    functions.sort(key=lambda function: function['total_ms'], reverse=True)
+    return functions[:count]
+
+
+async def profileWithSampler(duration, top, intervalMs):
+    profiler = SamplingProfiler(threading.get_ident(), intervalMs)
+    profiler.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profiler.stop()
+
+    return {
+        'mode': 'sampler',
+        'duration': duration,
+        'samples': profiler.sampleCount,
+        'stacks': profiler.getCollapsedStacks(),
+        'functions': profiler.getTopFunctions(top),
+    }
+
+
+async def profileWithCProfile(duration, top):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profiler.disable()
+
+    return {
+        'mode': 'cprofile',
+        'duration': duration,
+        'stacks': '',
+        'functions': getCProfileTopFunctions(profiler, top),
+    }
+
+
+async def profile(
+    duration=DEFAULT_PROFILE_DURATION,
+    mode=DEFAULT_PROFILE_MODE,
+    top=DEFAULT_TOP_FUNCTIONS,
+    intervalMs=DEFAULT_SAMPLING_INTERVAL_MS,
+):
+    '''Profile the event loop thread for duration seconds'''
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'Invalid profile mode: {mode}')
+
+    if not profileLock.acquire(blocking=False):
+        raise ValueError('A profile is already running')
+
+    try:
+        if mode == 'sampler':
+            return await profileWithSampler(duration, top, intervalMs)
+        else:
+            return await profileWithCProfile(duration, top)
+    finally:
+        profileLock.release()
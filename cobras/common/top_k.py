@@ -0,0 +1,103 @@
+'''Top K heavy hitters with bounded memory (space saving algorithm)
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+At most `capacity` keys are tracked. When a new key comes in and the
+table is full, the key with the smallest count is evicted and the new key
+inherits its counters. Counts of the tracked keys are over estimated by at
+most the count they inherited, which is small for the real heavy hitters.
+
+Each key is interned once into a slot holding its message count and
+bytes, over the total and over the current period, so that counting a
+message is a single dict lookup followed by list increments. Keys are
+ranked by their total count.
+
+The counters of all the tracked keys always sum up to the totals, so the
+keys which are not reported are summed up in an "other" bucket.
+'''
+
+import heapq
+import operator
+
+OTHER_KEY = '(other)'
+
+# Track more keys than reported, to make the top K more accurate
+CAPACITY_FACTOR = 10
+
+FIELDS = ('count', 'bytes')
+PERIOD_OFFSET = len(FIELDS)
+
+
+class TopK(object):
+    def __init__(self, k: int, capacity: int = None) -> None:
+        self.k = k
+        self.capacity = capacity or max(1, k * CAPACITY_FACTOR)
+
+        # key -> [count, bytes, period count, period bytes]
+        self.slots = {}
+
+        # (count, key) min heap, with one entry per tracked key. Entries
+        # are not updated on increments, only when they reach the top.
+        self.heap = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, key):
+        slot = self.slots.get(key)
+        return 0 if slot is None else slot[0]
+
+    def update(self, key, val):
+        '''Count one message of val bytes'''
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.intern(key)
+
+        slot[0] += 1
+        slot[1] += val
+        slot[2] += 1
+        slot[3] += val
+
+    def intern(self, key):
+        if len(self.slots) >= self.capacity:
+            slot = self.evict()
+        else:
+            slot = [0] * (2 * PERIOD_OFFSET)
+
+        self.slots[key] = slot
+        heapq.heappush(self.heap, (slot[0], key))
+        return slot
+
+    def evict(self):
+        '''Remove the key with the smallest count, and return its slot'''
+        while True:
+            count, key = self.heap[0]
+            slot = self.slots[key]
+
+            if slot[0] == count:
+                heapq.heappop(self.heap)
+                del self.slots[key]
+                return slot
+
+            # Stale entry, put it back with its current count
+            heapq.heapreplace(self.heap, (slot[0], key))
+
+    def endPeriod(self):
+        '''Zero the counters of the period, the keys stay tracked'''
+        for slot in self.slots.values():
+            slot[2] = 0
+            slot[3] = 0
+
+    def top(self, field='count', period=False):
+        '''The k largest values of field, and the sum of the others'''
+        index = FIELDS.index(field) + (PERIOD_OFFSET if period else 0)
+        values = {key: slot[index] for key, slot in self.slots.items() if slot[index]}
+
+        items = heapq.nlargest(self.k, values.items(), key=operator.itemgetter(1))
+        result = dict(items)
+
+        other = sum(values.values()) - sum(result.values())
+        if other > 0:
+            result[OTHER_KEY] = other
+
+        return result
@@ -7,6 +7,7 @@ import asyncio
 import logging
 
 import click
+import tabulate
 from cobras.client.connection import Connection
 from cobras.client.credentials import (
     createCredentials,
@@ -16,7 +17,9 @@ from cobras.client.credentials import (
 from cobras.common.apps_config import ADMIN_APPKEY, getDefaultEndpoint, makeUrl
 
 
-async def adminCoroutine(url, creds, action, connectionId):
+async def adminCoroutine(
+    url, creds, action, connectionId, count, duration, mode, output
+):
 
     connection = Connection(url, creds)
     try:
@@ -34,6 +37,26 @@ async def adminCoroutine(url, creds, action, connectionId):
     elif action == 'disconnect':
         await connection.adminCloseConnection(connectionId)
 
+    elif action == 'get_consumer_lag':
+        lags = await connection.adminGetConsumerLag(count)
+        print(tabulate.tabulate(lags, tablefmt="simple", headers="keys"))
+
+    elif action == 'get_slow_callbacks':
+        result = await connection.adminGetSlowCallbacks()
+        print(f'#{result["count"]} slow callback(s)')
+        for slowCallback in result['slow_callbacks']:
+            print(f'\t{slowCallback["blocked_ms"]} ms in {slowCallback["task"] or "-"}')
+            print(''.join(slowCallback['stack']))
+
+    elif action == 'profile':
+        result = await connection.adminProfile(duration, mode, count)
+        print(tabulate.tabulate(result['functions'], tablefmt="simple", headers="keys"))
+
+        if output is not None:
+            with open(output, 'w') as f:
+                f.write(result['stacks'] + '\n')
+            print(f'Collapsed stacks written to {output}')
+
 
 @click.option('--endpoint', default=getDefaultEndpoint())
 @click.option('--appkey', default=ADMIN_APPKEY)
@@ -41,17 +64,43 @@ async def adminCoroutine(url, creds, action, connectionId):
 @click.option('--rolesecret', default=getDefaultSecretForApp('admin'))
 @click.option('--action', default='get_connections')
 @click.option('--connection_id')
+@click.option(
+    '--count',
+    default=10,
+    help='Subscriptions or functions shown by get_consumer_lag and profile',
+)
+@click.option('--duration', default=5.0, help='Profile duration in seconds')
+@click.option('--mode', default='sampler', type=click.Choice(['sampler', 'cprofile']))
+@click.option(
+    '--output', help='File where the collapsed stacks of a profile are written'
+)
 @click.command()
-def admin(endpoint, appkey, rolename, rolesecret, action, connection_id):
+def admin(
+    endpoint,
+    appkey,
+    rolename,
+    rolesecret,
+    action,
+    connection_id,
+    count,
+    duration,
+    mode,
+    output,
+):
     '''Execute admin operations on the server
 
     \b
     cobra admin --action disconnect --connection_id 3919dc67
+    cobra admin --action get_consumer_lag --count 20
+    cobra admin --action get_slow_callbacks
+    cobra admin --action profile --duration 10 --output stacks.txt
     '''
 
     url = makeUrl(endpoint, appkey)
     credentials = createCredentials(rolename, rolesecret)
 
     asyncio.get_event_loop().run_until_complete(
-        adminCoroutine(url, credentials, action, connection_id)
+        adminCoroutine(
+            url, credentials, action, connection_id, count, duration, mode, output
+        )
     )
@@ -0,0 +1,110 @@
+'''Convert the keys of the cobra key value store to another kv backend
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+'''
+
+import asyncio
+import logging
+
+import click
+
+from cobras.common.apps_config import KV_BACKENDS
+from cobras.server.handlers.kv_store import kvMigrate
+from cobras.server.rcc_client import RedisClientRcc
+from cobras.server.redis_clients import makeRedisClient
+
+
+async def getNodeUrls(redisUrls, redisPassword):
+    '''The urls of the nodes holding keys: every master of a redis
+    cluster, or every shard
+    '''
+    urls = []
+    for url in redisUrls.split(';'):
+        node = RedisClientRcc(url, redisPassword, False)
+        try:
+            if await node.isCluster():
+                await node.refreshSlotMap()
+                nodeUrls = sorted(set(node.slotMap.urls.values()))
+            else:
+                nodeUrls = [url]
+        finally:
+            node.close()
+
+        for nodeUrl in nodeUrls:
+            if nodeUrl not in urls:
+                urls.append(nodeUrl)
+
+    return urls
+
+
+async def migrate(redisUrls, redisPassword, redisCluster, pattern, backend, dryRun):
+    redis = makeRedisClient(redisUrls, redisPassword, redisCluster)
+    migrated = 0
+
+    # Keys are scanned on each node, and converted through the (cluster or
+    # sharded) client
+    for url in await getNodeUrls(redisUrls, redisPassword):
+        node = RedisClientRcc(url, redisPassword, False)
+        cursor = '0'
+
+        while True:
+            cursor, keys = await node.scan(cursor, pattern, 1000)
+            cursor = cursor.decode()
+
+            for key in keys:
+                key = key.decode()
+
+                if dryRun:
+                    keyType = (await redis.type(key)).decode()
+                    print(f'{key}: {keyType}')
+                    continue
+
+                try:
+                    if await kvMigrate(redis, key, backend):
+                        migrated += 1
+                except Exception as e:
+                    logging.error(f'{key}: cannot migrate: {e}')
+
+            if cursor == '0':
+                break
+
+        node.close()
+
+    redis.close()
+
+    if not dryRun:
+        print(f'{migrated} keys migrated to the {backend} kv backend')
+
+
+@click.command()
+@click.option(
+    '--redis_urls', '-r', envvar='COBRA_REDIS_URLS', default='redis://localhost'
+)
+@click.option('--redis_password', envvar='COBRA_REDIS_PASSWORD')
+@click.option('--redis_cluster', is_flag=True, envvar='COBRA_REDIS_CLUSTER')
+@click.option('--appkey', required=True)
+@click.option(
+    '--pattern',
+    required=True,
+    help='Keys to migrate, such as "channel*". Publish/subscribe channels '
+    'are streams too, the pattern must only match keys of the kv store',
+)
+@click.option('--backend', type=click.Choice(KV_BACKENDS), required=True)
+@click.option('--dry_run', is_flag=True, help='Only list the keys to migrate')
+def kv_migrate(
+    redis_urls, redis_password, redis_cluster, appkey, pattern, backend, dry_run
+):
+    '''Convert the keys of an app to another kv backend.
+
+    \b
+    Run it after updating the kv_backend setting of the app, and restarting
+    the cobra nodes. Each key is converted atomically, with a lua script.
+
+    \b
+    cobra kv-migrate --appkey _health --pattern 'session_*' --backend hash
+    '''
+    pattern = f'{appkey}::{pattern}'
+
+    asyncio.get_event_loop().run_until_complete(
+        migrate(redis_urls, redis_password, redis_cluster, pattern, backend, dry_run)
+    )
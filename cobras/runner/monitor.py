@@ -22,6 +22,7 @@ from cobras.common.apps_config import STATS_APPKEY, getDefaultEndpoint, makeUrl
 @click.option('--hide_nodes', is_flag=True)
 @click.option('--hide_roles', is_flag=True)
 @click.option('--hide_channels', is_flag=True)
+@click.option('--hide_latencies', is_flag=True)
 @click.option('--hide_summary', is_flag=True)
 @click.option('--subscribers', is_flag=True)
 @click.option('--role_filter')
@@ -43,6 +44,7 @@ def monitor(
     hide_nodes,
     hide_roles,
     hide_channels,
+    hide_latencies,
     hide_summary,
     subscribers,
     system,
@@ -60,6 +62,7 @@ def monitor(
         hide_nodes = True
         hide_roles = True
         hide_channels = True
+        hide_latencies = True
 
     retry = not unsafe
 
@@ -78,4 +81,5 @@ def monitor(
         system,
         once,
         retry,
+        not hide_latencies,
     )
@@ -42,12 +42,22 @@ async def sendEvent(connection, channel, event, connectionId):
     await connection.publish(channel, data)
 
 
+async def sendEvents(connection, channel, events, connectionId):
+    entries = [{'channel': channel, 'message': json.loads(event)} for event in events]
+
+    now = datetime.datetime.now().strftime("%H:%M:%S.%f")
+    logging.info(f"[{now}][{connectionId}] > {len(entries)} events")
+
+    await connection.publishBatch(entries)
+
+
 async def clientCallback(connection, **args):
     item = args['item']
     channel = args['channel']
     delay = args['delay']
     repeat = args['repeat']
     summary = args['summary']
+    publishBatchSize = args['publish_batch_size']
 
     if not item:  # FIXME: how can this happen ?
         return
@@ -64,6 +74,18 @@ async def clientCallback(connection, **args):
         if not summary:
             print(f"[{now}][{connectionId}] {N} events")
 
+        # Send many events per websocket frame, ignoring the time deltas
+        if publishBatchSize > 1:
+            events = [event for event, _ in eventsWithDeltas]
+            eventsWithDeltas = []
+
+            for i in range(0, N, publishBatchSize):
+                batch = events[i : i + publishBatchSize]
+                await sendEvents(connection, channel, batch, connectionId)
+
+                if delay:
+                    await asyncio.sleep(delay)
+
         for event, deltaMs in eventsWithDeltas:
             await sendEvent(connection, channel, event, connectionId)
 
@@ -90,7 +112,9 @@ async def clientCallback(connection, **args):
             cnt = 0
 
 
-async def publishTask(url, credentials, items, channel, repeat, delay, summary):
+async def publishTask(
+    url, credentials, items, channel, repeat, delay, summary, publishBatchSize
+):
     tasks = []
     for item in items:
         publishClientCallback = functools.partial(
@@ -100,6 +124,7 @@ async def publishTask(url, credentials, items, channel, repeat, delay, summary):
             repeat=repeat,
             delay=delay,
             summary=summary,
+            publish_batch_size=publishBatchSize,
         )
 
         task = asyncio.ensure_future(client(url, credentials, publishClientCallback))
@@ -134,7 +159,9 @@ def buildItemList(path, limit):
     return items
 
 
-def run(url, channel, path, credentials, repeat, delay, limit, summary):
+def run(
+    url, channel, path, credentials, repeat, delay, limit, summary, publishBatchSize=1
+):
     items = buildItemList(path, limit)
     if len(items) == 0:
         print('Empty input file')
@@ -143,7 +170,9 @@ def run(url, channel, path, credentials, repeat, delay, limit, summary):
     print(f'Processing {len(items)} items')
 
     asyncio.get_event_loop().run_until_complete(
-        publishTask(url, credentials, items, channel, repeat, delay, summary)
+        publishTask(
+            url, credentials, items, channel, repeat, delay, summary, publishBatchSize
+        )
     )
 
 
@@ -164,6 +193,11 @@ def run(url, channel, path, credentials, repeat, delay, limit, summary):
 )
 @click.option('--limit', default=256)
 @click.option('--delay', default=0.1)
+@click.option(
+    '--publish_batch_size',
+    default=1,
+    help='Send that many events per websocket frame, with rtm/publish_batch',
+)
 def publish(
     endpoint,
     appkey,
@@ -177,6 +211,7 @@ def publish(
     repeat,
     delay,
     summary,
+    publish_batch_size,
 ):
     '''Publish to a channel
     '''
@@ -186,4 +221,14 @@ def publish(
     url = makeUrl(endpoint, appkey)
     credentials = createCredentials(rolename, rolesecret)
 
-    run(url, channel, path, credentials, repeat, delay, limit, summary)
+    run(
+        url,
+        channel,
+        path,
+        credentials,
+        repeat,
+        delay,
+        limit,
+        summary,
+        publish_batch_size,
+    )
@@ -18,6 +18,7 @@ from cobras.common.apps_config import (
 )
 from cobras.common.version import getVersion
 from cobras.server.app import AppRunner
+from cobras.server.redis_drivers import REDIS_DRIVER_RCC, REDIS_DRIVERS
 
 
 @click.command()
@@ -33,6 +34,12 @@ from cobras.server.app import AppRunner
 )
 @click.option('--redis_password', envvar='COBRA_REDIS_PASSWORD')
 @click.option('--redis_cluster', is_flag=True, envvar='COBRA_REDIS_CLUSTER')
+@click.option(
+    '--redis_driver',
+    envvar='COBRA_REDIS_DRIVER',
+    type=click.Choice(REDIS_DRIVERS),
+    default=REDIS_DRIVER_RCC,
+)
 @click.option(
     '--apps_config_path', envvar='COBRA_APPS_CONFIG', default=getDefaultAppsConfigPath()
 )
@@ -82,6 +89,7 @@ def run(
     redis_urls,
     redis_password,
     redis_cluster,
+    redis_driver,
     apps_config_path,
     apps_config_path_content,
     debug_memory,
@@ -153,6 +161,7 @@ def run(
         probeRedisOnStartup=not disable_redis_startup_probing,
         redisStartupProbingTimeout=redis_startup_probing_timeout,
         messageMaxSize=message_max_size,
+        redisDriver=redis_driver,
     )
 
     loop = asyncio.get_event_loop()
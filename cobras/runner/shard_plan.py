@@ -0,0 +1,76 @@
+'''Plan the keys moving between redis nodes when sharding changes
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+'''
+
+import asyncio
+
+import click
+import tabulate
+
+from cobras.server.rcc_client import RedisClientRcc
+from cobras.server.sharded_redis_client import planMoves
+
+
+async def scanKeys(url, redisPassword, pattern):
+    node = RedisClientRcc(url, redisPassword, False)
+    keys = []
+    cursor = '0'
+
+    while True:
+        cursor, batch = await node.scan(cursor, pattern, 1000)
+        cursor = cursor.decode()
+        keys.extend(key.decode() for key in batch)
+
+        if cursor == '0':
+            break
+
+    node.close()
+    return keys
+
+
+async def plan(redisUrls, newRedisUrls, redisPassword, pattern, verbose):
+    keysByUrl = {}
+    for url in redisUrls.split(';'):
+        keysByUrl[url] = await scanKeys(url, redisPassword, pattern)
+
+    moves = planMoves(keysByUrl, newRedisUrls.split(';'))
+
+    total = sum(len(keys) for keys in keysByUrl.values())
+    moved = sum(len(keys) for keys in moves.values())
+
+    rows = [['source', 'destination', 'keys']]
+    for (source, destination), keys in sorted(moves.items()):
+        rows.append([source, destination, len(keys)])
+
+    print(tabulate.tabulate(rows, tablefmt="simple", headers="firstrow"))
+    print()
+    print(f'{moved} keys out of {total} change node')
+
+    if verbose:
+        for (source, destination), keys in sorted(moves.items()):
+            print()
+            print(f'{source} -> {destination}')
+            for key in sorted(keys):
+                print(f'  {key}')
+
+
+@click.command()
+@click.option(
+    '--redis_urls', '-r', envvar='COBRA_REDIS_URLS', default='redis://localhost'
+)
+@click.option('--new_redis_urls', required=True, help='The new list of redis urls')
+@click.option('--redis_password', envvar='COBRA_REDIS_PASSWORD')
+@click.option('--pattern', default='*')
+@click.option('--verbose', '-v', is_flag=True, help='List the keys to move')
+def shard_plan(redis_urls, new_redis_urls, redis_password, pattern, verbose):
+    '''Show the keys which change node when redis nodes are added or removed.
+
+    \b
+    Channels are sharded over the redis urls when redis cluster is not used.
+    Keys moving to another node should be copied there before the cobra
+    nodes are restarted with the new urls.
+    '''
+    asyncio.get_event_loop().run_until_complete(
+        plan(redis_urls, new_redis_urls, redis_password, pattern, verbose)
+    )
@@ -18,14 +18,12 @@ from cobras.client.credentials import (
     getDefaultSecretForApp,
 )
 from cobras.common.apps_config import PUBSUB_APPKEY, getDefaultEndpoint, makeUrl
-from cobras.common.throttle import Throttle
 
 
 class MessageHandlerClass:
     def __init__(self, connection, args):
         self.cnt = 0
         self.cntPerSec = 0
-        self.throttle = Throttle(seconds=1)
         self.args = args
         self.position = None
 
@@ -54,12 +52,6 @@ class MessageHandlerClass:
         for message in messages:
             logging.info(f'{message} at position {position}')
 
-        if self.throttle.exceedRate():
-            return ActionFlow.CONTINUE
-
-        if self.args['resume_from_last_position']:
-            return ActionFlow.SAVE_POSITION
-
         return ActionFlow.CONTINUE
 
 
@@ -91,9 +83,10 @@ def subscribe(
     url = makeUrl(endpoint, appkey)
     credentials = createCredentials(rolename, rolesecret)
 
-    resumeFromLastPositionId = ''
+    # The server saves the position of durable subscriptions
+    subscriptionId = channel
     if resume_from_last_position:
-        resumeFromLastPositionId = f'{channel}::{stream_sql}'
+        subscriptionId = f'{channel}::{stream_sql}'
 
     asyncio.get_event_loop().run_until_complete(
         subscribeClient(
@@ -103,12 +96,9 @@ def subscribe(
             position,
             stream_sql,
             MessageHandlerClass,
-            {
-                'resume_from_last_position': resume_from_last_position,
-                'disable_debug_memory': disable_debug_memory,
-            },
-            resumeFromLastPosition=resume_from_last_position,
-            resumeFromLastPositionId=resumeFromLastPositionId,
+            {'disable_debug_memory': disable_debug_memory},
             batchSize=batch_size,
+            subscriptionId=subscriptionId,
+            resume=resume_from_last_position,
         )
     )
@@ -15,17 +15,32 @@ import zlib
 import sys
 from urllib.parse import parse_qs, urlparse
 
+import tabulate
 import websockets
 from sentry_sdk import configure_scope
 from sentry_sdk.hub import Hub
 
 from cobras.common.apps_config import STATS_APPKEY, PULSAR_APPKEY, AppsConfig
 from cobras.common.memory_debugger import MemoryDebugger
+from cobras.common.sampling_profiler import (
+    DEFAULT_PROFILE_DURATION,
+    DEFAULT_PROFILE_MODE,
+    MAX_PROFILE_DURATION,
+    profile,
+)
 from cobras.common.task_cleanup import addTaskCleanup
 from cobras.common.version import getVersion
 from cobras.common.banner import getBanner
+from cobras.server.channel_readers import ChannelReaders
 from cobras.server.connection_state import ConnectionState
+from cobras.server.checkpoints import Checkpoints
+from cobras.server.consumer_lag import ConsumerLag
+from cobras.server.loop_lag import LoopLag
+from cobras.server.metrics import METRICS_CONTENT_TYPE, renderMetrics
+from cobras.server.pipelined_publishers import PipelinedPublishers
 from cobras.server.protocol import processCobraMessage
+from cobras.server.read_cache import ReadCache
+from cobras.server.redis_drivers import REDIS_DRIVER_RCC
 from cobras.server.stats import ServerStats
 from cobras.server.redis_clients import RedisClients
 from cobras.server.pulsar import processPulsarMessage
@@ -111,6 +126,8 @@ async def cobraHandler(websocket, path, app, redisUrls: str, userAgent: str):
     finally:
         del app['connections'][key]
 
+        state.publishAck.terminate()
+
         subCount = len(state.subscriptions)
 
         if subCount > 0:
@@ -135,11 +152,23 @@ class ServerProtocol(websockets.WebSocketServerProtocol):
     '''Used to validate appkey'''
 
     appsConfig = None
+    stats = None
 
     async def process_request(self, path, request_headers):
         if path == '/health/':
             return http.HTTPStatus.OK, [], b'OK\n'
 
+        if path in ('/metrics/', '/metrics'):
+            if ServerProtocol.stats is None:
+                return http.HTTPStatus.SERVICE_UNAVAILABLE, [], b'KO\n'
+
+            headers = [('Content-Type', METRICS_CONTENT_TYPE)]
+            metrics = renderMetrics(ServerProtocol.stats)
+            return http.HTTPStatus.OK, headers, metrics.encode()
+
+        if urlparse(path).path in ('/profile/', '/profile'):
+            return await self.processProfileRequest(path)
+
         if path == '/version/':
             return http.HTTPStatus.OK, [], bytes(getVersion(), 'utf8') + b'\n'
 
@@ -154,6 +183,34 @@ class ServerProtocol(websockets.WebSocketServerProtocol):
 
         self.requestHeaders = request_headers
 
+    async def processProfileRequest(self, path):
+        '''/profile/?duration=10&mode=sampler returns the collapsed stacks,
+           ready for flamegraph.pl. Only local clients can profile a node,
+           since the http endpoints are not authenticated
+        '''
+        host = self.remote_address[0] if self.remote_address else None
+        if host not in ('127.0.0.1', '::1'):
+            logging.warning(f'Rejecting profile request from {host}')
+            return http.HTTPStatus.FORBIDDEN, [], b'KO\n'
+
+        params = parse_qs(urlparse(path).query)
+        mode = params.get('mode', [DEFAULT_PROFILE_MODE])[0]
+        try:
+            duration = float(params.get('duration', [DEFAULT_PROFILE_DURATION])[0])
+            if not 0 < duration <= MAX_PROFILE_DURATION:
+                raise ValueError(f'max duration is {MAX_PROFILE_DURATION}')
+
+            result = await profile(duration, mode)
+        except ValueError as e:
+            return http.HTTPStatus.BAD_REQUEST, [], f'KO {e}\n'.encode()
+
+        if result['stacks']:
+            body = result['stacks'] + '\n'
+        else:
+            body = tabulate.tabulate(result['functions'], headers="keys") + '\n'
+
+        return http.HTTPStatus.OK, [], body.encode()
+
     async def read_message(self):
         '''Override that method for debugging'''
 
@@ -193,6 +250,7 @@ class AppRunner:
         probeRedisOnStartup,
         redisStartupProbingTimeout,
         messageMaxSize,
+        redisDriver=REDIS_DRIVER_RCC,
     ):
         self.app = {}
         self.app['connections'] = {}
@@ -222,10 +280,15 @@ class AppRunner:
         # Create app redis connection handler, one per apps to avoid one busy
         # app blocking others
         self.redisClients = RedisClients(
-            redisUrls, redisPassword, redisCluster, appsConfig
+            redisUrls, redisPassword, redisCluster, appsConfig, redisDriver
         )
         self.app['redis_clients'] = self.redisClients
 
+        # One redis stream reader per channel, shared by all subscribers
+        self.app['channel_readers'] = ChannelReaders(
+            self.redisClients, appsConfig.getSubscriberQueueSize()
+        )
+
         try:
             appsConfig.validateConfig()
         except ValueError as e:
@@ -233,24 +296,34 @@ class AppRunner:
             pass
 
         self.app['batch_publish_size'] = appsConfig.getBatchPublishSize()
+        self.app['pipelined_publishers'] = PipelinedPublishers(
+            self.redisClients, appsConfig
+        )
         self.app['channel_max_length'] = appsConfig.getChannelMaxLength()
+        self.app['read_cache'] = ReadCache(appsConfig.getReadCacheSize())
+        self.app['checkpoints'] = Checkpoints(
+            self.redisClients, appsConfig.getCheckpointIntervalMs()
+        )
+        self.app['consumer_lag'] = ConsumerLag(
+            self.app['channel_readers'], self.redisClients
+        )
+        self.app['loop_lag'] = LoopLag(slowCallbackMs=appsConfig.getSlowCallbackMs())
         self.server = None
 
     async def waitForAllConnectionsToBeReady(self, timeout: float):
         start = time.time()
 
-        urls = self.app['redis_urls'].split(';')
-
-        for url in urls:
-            sys.stderr.write(f'Checking {url} ')
+        # The default redis backend, and the ones configured for some apps
+        for urls, pool in self.redisClients.getBackendPools().items():
+            sys.stderr.write(f'Checking {urls} ')
 
             while True:
                 sys.stderr.write('.')
                 sys.stderr.flush()
 
                 try:
-                    redis = self.redisClients.makeRedisClient()
-                    await redis.ping()
+                    async with pool.client() as redis:
+                        await redis.ping()
                     break
                 except Exception:
                     if time.time() - start > timeout:
@@ -278,9 +351,27 @@ class AppRunner:
 
         redis = self.redisClients.getRedisClient(STATS_APPKEY)
 
-        serverStats = ServerStats(redis, STATS_APPKEY)
+        serverStats = ServerStats(
+            redis,
+            STATS_APPKEY,
+            self.redisClients,
+            self.app['read_cache'],
+            self.app['checkpoints'],
+            self.app['apps_config'].getChannelStatsTopK(),
+            self.app['consumer_lag'],
+            self.app['loop_lag'],
+        )
         self.app['stats'] = serverStats
 
+        self.checkpointsTask = asyncio.ensure_future(self.app['checkpoints'].run())
+        addTaskCleanup(self.checkpointsTask)
+
+        self.consumerLagTask = asyncio.ensure_future(self.app['consumer_lag'].run())
+        addTaskCleanup(self.consumerLagTask)
+
+        self.loopLagTask = asyncio.ensure_future(self.app['loop_lag'].run())
+        addTaskCleanup(self.loopLagTask)
+
         if self.enableStats:
             self.serverStatsTask = asyncio.ensure_future(serverStats.run())
             addTaskCleanup(self.serverStatsTask)
@@ -296,6 +387,18 @@ class AppRunner:
             addTaskCleanup(self.memoryDebuggerTask)
 
     async def cleanup(self):
+        # Save the positions recorded since the last flush
+        self.app['checkpoints'].terminate()
+        await self.checkpointsTask
+        await self.app['checkpoints'].flush()
+
+        # Nothing to save, no need to wait for the end of the interval
+        self.consumerLagTask.cancel()
+
+        # Also stops the watchdog thread
+        self.loopLagTask.cancel()
+        await asyncio.gather(self.loopLagTask, return_exceptions=True)
+
         # FIXME: we could speed this up
         if self.enableStats:
             self.app['stats'].terminate()
@@ -316,6 +419,7 @@ class AppRunner:
         )
 
         ServerProtocol.appsConfig = self.app['apps_config']
+        ServerProtocol.stats = self.app['stats']
         extraHeaders = {
             "X-Cobra-Node": platform.uname().node,
             "X-Cobra-Version": getVersion(),
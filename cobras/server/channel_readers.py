@@ -0,0 +1,404 @@
+'''Node-local channel readers, shared by all the subscribers of a channel.
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+There is one blocking XREAD loop per (appkey, channel, position class).
+Each stream entry is decoded once, and queued for every registered
+message handler (see RedisSubscriberMessageHandlerClass in rcc).
+Readers are ref-counted and stop when their last subscriber leaves.
+
+Each handler has its own bounded queue, emptied by its own task, so that
+a subscriber with a slow websocket does not delay the others, nor the
+reader. A subscriber which falls behind by more than the queue size is
+dropped, and its handleOverflow method, if any, is told about it.
+
+Message handlers can expose the StreamSQL predicate they require through
+a getIndexKey method, in which case messages which cannot match it are
+not dispatched to them (see StreamSqlIndex). Their handleSkippedMsg method,
+if any, is called instead, so that they can count the message like the
+ones they filter out themselves.
+'''
+
+import asyncio
+import base64
+import json
+import logging
+import traceback
+from hashlib import sha1
+
+from cobras.common.task_cleanup import addTaskCleanup
+from cobras.server.stream_sql import StreamSqlIndex
+
+DEFAULT_SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+def getPositionClass(position):
+    '''Subscribers tailing a stream all share the same reader.
+    Subscribers starting from an explicit position share a reader only
+    with subscribers starting from that same position, as long as the
+    reader has not started reading (see ChannelReader.canJoin).
+    '''
+    if position is None or position == '$':
+        return '$'
+
+    return position
+
+
+class Subscriber:
+    '''A message handler, with the messages it has yet to handle'''
+
+    def __init__(self, handler, done, position: str, queueSize: int):
+        self.handler = handler
+        self.done = done  # completed when the handler is done
+        self.queue = asyncio.Queue(queueSize)
+        self.task = None
+
+        # Queued messages, and the one being handled
+        self.pendingCount = 0
+
+        # Position of the last message handled
+        self.lastId = position
+
+
+class ChannelReader:
+    def __init__(
+        self,
+        key,
+        redis,
+        stream: str,
+        position: str,
+        onClose,
+        queueSize=DEFAULT_SUBSCRIBER_QUEUE_SIZE,
+    ):
+        self.key = key
+        self.redis = redis
+        self.stream = stream
+        self.position = position
+        self.onClose = onClose
+        self.queueSize = queueSize
+
+        # Position of the last message queued for the handlers
+        self.lastId = position
+
+        # handler -> Subscriber
+        self.handlers = {}
+        self.index = StreamSqlIndex()
+        self.joining = 0
+        self.initInfo = None
+        self.closed = False
+        self.reading = False
+        self.task = None
+        self.overflowCount = 0
+
+        self.logPrefix = f'reader[{stream}]'
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+        addTaskCleanup(self.task)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def addHandler(self, handler):
+        '''Returns a future which completes when the handler is done'''
+        done = asyncio.get_event_loop().create_future()
+
+        if self.closed:
+            done.set_result(None)
+            return done
+
+        if self.initInfo is None:
+            # The reader is not ready yet, it will initialize us
+            self.registerHandler(handler, done)
+            return done
+
+        # Late joiner, make sure that the subscribe response
+        # goes out before any data
+        self.joining += 1
+        try:
+            await handler.on_init(self.initInfo)
+        except Exception as e:
+            logging.error(f'{self.logPrefix} cannot initialize message handler: {e}')
+            done.set_result(None)
+            return done
+        finally:
+            self.joining -= 1
+
+        if self.closed or not self.initInfo.get('success', False):
+            done.set_result(None)
+        else:
+            self.registerHandler(handler, done)
+
+        return done
+
+    def registerHandler(self, handler, done):
+        subscriber = Subscriber(handler, done, self.lastId, self.queueSize)
+        subscriber.task = asyncio.ensure_future(self.serve(subscriber))
+        addTaskCleanup(subscriber.task)
+        self.handlers[handler] = subscriber
+
+        getIndexKey = getattr(handler, 'getIndexKey', None)
+        self.index.add(handler, getIndexKey() if getIndexKey else None)
+
+    def canJoin(self):
+        '''Joining a reader which started from an explicit position after
+        it moved past it would skip the history the subscriber asked for
+        '''
+        return self.position == '$' or not self.reading
+
+    def isIdle(self):
+        return len(self.handlers) == 0 and self.joining == 0
+
+    def removeHandler(self, handler):
+        self.index.remove(handler)
+
+        subscriber = self.handlers.pop(handler, None)
+        if subscriber is None:
+            return
+
+        if subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+
+        if not subscriber.done.done():
+            subscriber.done.set_result(None)
+
+    async def getInitInfo(self):
+        streamExists = False
+        redisHost = 'unknown-host'
+        clientId = -1
+        success = True
+
+        # query the stream metadata
+        try:
+            streamExists = await self.redis.exists(self.stream)
+            clientId = await self.redis.getClientIdForKey(self.stream)
+            redisHost = await self.redis.getHostForKey(self.stream)
+        except Exception as e:
+            logging.error(f"{self.logPrefix} cannot retreive stream metadata: {e}")
+            success = False
+
+        return {
+            'success': success,
+            'redis_node': redisHost,
+            'redis_client_id': clientId,
+            'stream_exists': streamExists,
+            'stream_name': self.stream,
+        }
+
+    async def initHandlers(self):
+        self.initInfo = await self.getInitInfo()
+
+        for handler in list(self.handlers):
+            try:
+                await handler.on_init(self.initInfo)
+            except Exception as e:
+                logging.error(
+                    f'{self.logPrefix} cannot initialize message handler: {e}'
+                )
+                self.removeHandler(handler)
+
+        return self.initInfo['success']
+
+    def getCandidates(self, msg: dict):
+        '''msg is a publish PDU, filters apply to its message'''
+        try:
+            msg = msg.get('body', {}).get('message')
+            msg = msg.get('messages') or msg
+        except AttributeError:
+            return list(self.handlers)
+
+        return self.index.getCandidates(msg)
+
+    async def serve(self, subscriber):
+        '''Hand the queued messages to a handler, one at a time'''
+        handler = subscriber.handler
+
+        while True:
+            msg, position, payloadSize = await subscriber.queue.get()
+
+            try:
+                ret = await handler.handleMsg(msg, position, payloadSize)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                handler.log(e)
+                backtrace = traceback.format_exc()
+                handler.log(f'{self.logPrefix} Generic Exception caught in {backtrace}')
+                ret = False
+
+            if not ret:
+                self.removeHandler(handler)
+                return
+
+            subscriber.lastId = position
+            subscriber.pendingCount -= 1
+
+    def overflow(self, subscriber):
+        '''Drop a subscriber which cannot keep up with the channel'''
+        handler = subscriber.handler
+        missedCount = subscriber.pendingCount + 1
+
+        self.overflowCount += 1
+        logging.warning(
+            f'{self.logPrefix} dropping a subscriber {missedCount} messages '
+            f'behind, after position {subscriber.lastId}'
+        )
+        self.removeHandler(handler)
+
+        handleOverflow = getattr(handler, 'handleOverflow', None)
+        if handleOverflow is not None:
+            handleOverflow(subscriber.lastId, missedCount)
+
+    def skip(self, candidates, payloadSize: int):
+        '''Notify the handlers which the index did not select'''
+        candidates = set(candidates)
+        for handler in list(self.handlers):
+            if handler in candidates:
+                continue
+
+            handleSkippedMsg = getattr(handler, 'handleSkippedMsg', None)
+            if handleSkippedMsg is not None:
+                handleSkippedMsg(payloadSize)
+
+    def dispatch(self, msg: dict, position: str, payloadSize: int):
+        '''Queue a message for the handlers which can match it, without
+        waiting for them to handle it
+        '''
+        candidates = self.getCandidates(msg)
+        if len(candidates) < len(self.handlers):
+            self.skip(candidates, payloadSize)
+
+        for handler in candidates:
+            subscriber = self.handlers[handler]
+            try:
+                subscriber.queue.put_nowait((msg, position, payloadSize))
+                subscriber.pendingCount += 1
+            except asyncio.QueueFull:
+                self.overflow(subscriber)
+
+    async def run(self):
+        try:
+            if not await self.initHandlers():
+                return
+
+            lastId = self.position
+
+            # wait for incoming events.
+            while True:
+                results = await self.redis.xread(self.stream, lastId)
+                results = results[self.stream.encode()]
+                self.reading = True
+
+                for result in results:
+                    lastId = result[0].decode()
+                    msg = result[1]
+                    data = msg[b'json']
+
+                    msgCksum = msg.get(b'sha1')
+                    if msgCksum is not None:
+                        cksum = sha1(data).hexdigest().encode()
+                        if cksum != msgCksum:
+                            logging.error(f'{lastId}: invalid xread msg cksum')
+                            continue
+
+                    payloadSize = len(data)
+                    try:
+                        msg = json.loads(data)
+                    except json.JSONDecodeError:
+                        msgEncoded = base64.b64encode(data).decode()
+                        err = f'{lastId}: malformed json: base64: {msgEncoded} '
+                        err += f'raw: {data}'
+                        logging.error(err)
+                        continue
+
+                    self.dispatch(msg, lastId, payloadSize)
+                    self.lastId = lastId
+
+                # Including the invalid messages which were skipped
+                self.lastId = lastId
+
+        except asyncio.CancelledError:
+            logging.info(f'{self.logPrefix} Cancelling redis subscription')
+            raise
+
+        except Exception as e:
+            backtrace = traceback.format_exc()
+            logging.warning(f'{self.logPrefix} Generic Exception {e} in {backtrace}')
+
+        finally:
+            logging.info(f'{self.logPrefix} Closing redis subscription')
+            self.closed = True
+
+            # When finished, close the connection.
+            self.redis.close()
+
+            for handler in list(self.handlers):
+                self.removeHandler(handler)
+
+            self.onClose(self)
+
+
+class ChannelReaders:
+    '''Registry of the channel readers running on this node'''
+
+    def __init__(self, redisClients, queueSize=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        self.redisClients = redisClients
+        self.queueSize = queueSize
+        self.readers = {}
+        self.detachedCount = 0
+
+    def getReaderKey(self, appkey: str, stream: str, position):
+        return (appkey, stream, getPositionClass(position))
+
+    def makeReader(self, key, appkey: str, stream: str, position):
+        # We need to create a new connection as reading from it will be blocking
+        redis = self.redisClients.makeRedisClient(appkey)
+
+        lastId = '$' if position is None else position
+
+        # A reader which moved past its start position keeps serving its
+        # subscribers under its own key, the new one takes over for the
+        # subscribers coming next
+        previous = self.readers.get(key)
+        if previous is not None:
+            self.detachedCount += 1
+            previous.key = key[:2] + (f'{key[2]}#{self.detachedCount}',)
+            self.readers[previous.key] = previous
+
+        reader = ChannelReader(
+            key, redis, stream, lastId, self.removeReader, self.queueSize
+        )
+        self.readers[key] = reader
+        reader.start()
+        return reader
+
+    def removeReader(self, reader):
+        if self.readers.get(reader.key) is reader:
+            del self.readers[reader.key]
+
+    async def subscribe(
+        self, appkey: str, stream: str, position, messageHandlerClass, obj
+    ):
+        '''Register a new message handler, and wait until it is done.
+        Cancelling this coroutine unregisters the handler.
+        '''
+        messageHandler = messageHandlerClass(obj)
+
+        key = self.getReaderKey(appkey, stream, position)
+        reader = self.readers.get(key)
+        if reader is None or not reader.canJoin():
+            reader = self.makeReader(key, appkey, stream, position)
+
+        try:
+            done = await reader.addHandler(messageHandler)
+            await done
+        finally:
+            reader.removeHandler(messageHandler)
+
+            # Ref-counting: stop the reader when nobody is listening anymore
+            if reader.isIdle() and not reader.closed:
+                self.removeReader(reader)
+                reader.stop()
+
+        return messageHandler
@@ -0,0 +1,117 @@
+'''Server side positions of durable subscriptions
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Subscriptions started with resume: true are durable. The position of the
+last data PDU sent to them is recorded in memory, and the checkpoints are
+written to redis periodically, with one pipeline per app. Only the latest
+position of each subscription is written, no matter how many messages
+were delivered during a period.
+
+A subscription resumed on another node can see up to one flush interval
+worth of messages again (at least once delivery).
+
+Checkpoint keys are not prefixed by their appkey, so that no channel name
+can produce them, and kv-migrate patterns of an app never match them.
+'''
+
+import asyncio
+import collections
+import logging
+
+from cobras.common.apps_config import CHECKPOINT_KEY_PREFIX
+
+DEFAULT_CHECKPOINT_INTERVAL_MS = 1000
+
+# Checkpoints of subscriptions which stopped resuming eventually expire
+CHECKPOINT_TTL = 7 * 24 * 3600
+
+
+def getCheckpointKey(appkey, subscriptionId):
+    return f'{CHECKPOINT_KEY_PREFIX}::{appkey}::{subscriptionId}'
+
+
+class Checkpoints:
+    def __init__(self, redisClients, intervalMs=DEFAULT_CHECKPOINT_INTERVAL_MS):
+        self.redisClients = redisClients
+        self.interval = intervalMs / 1000
+        self.stop = False
+
+        # appkey -> subscription id -> last delivered position
+        self.pending = collections.defaultdict(dict)
+
+        # Positions being written, still the most recent ones until the
+        # write completes
+        self.flushing = {}
+
+        self.flushedCount = 0
+        self.errorCount = 0
+
+    def update(self, appkey, subscriptionId, position):
+        self.pending[appkey][subscriptionId] = position
+
+    async def get(self, appkey, subscriptionId):
+        '''Returns None when there is no checkpoint for that subscription'''
+        for positions in (self.pending, self.flushing):
+            position = positions.get(appkey, {}).get(subscriptionId)
+            if position is not None:
+                return position
+
+        pool = self.redisClients.getRedisPool(appkey)
+        async with pool.client() as redis:
+            position = await redis.get(getCheckpointKey(appkey, subscriptionId))
+
+        return position.decode() if position is not None else None
+
+    async def flush(self):
+        pending = self.pending
+        self.pending = collections.defaultdict(dict)
+        self.flushing = pending
+
+        for appkey, positions in pending.items():
+            subscriptionIds = list(positions.keys())
+            commands = [
+                (
+                    'SET',
+                    getCheckpointKey(appkey, subscriptionId),
+                    positions[subscriptionId],
+                    b'EX',
+                    CHECKPOINT_TTL,
+                )
+                for subscriptionId in subscriptionIds
+            ]
+
+            try:
+                pool = self.redisClients.getRedisPool(appkey)
+                async with pool.client() as redis:
+                    results = await redis.pipeline(commands)
+            except Exception as e:
+                logging.warning(f'checkpoints: cannot connect to redis {e}')
+                results = [e] * len(commands)
+
+            for subscriptionId, result in zip(subscriptionIds, results):
+                if isinstance(result, Exception):
+                    # Retried on the next flush, unless a newer position
+                    # was recorded in the meantime
+                    self.errorCount += 1
+                    position = positions[subscriptionId]
+                    self.pending[appkey].setdefault(subscriptionId, position)
+                else:
+                    self.flushedCount += 1
+
+        self.flushing = {}
+
+    async def run(self):
+        while not self.stop:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def terminate(self):
+        self.stop = True
+
+    def getStats(self):
+        return {
+            'checkpoints_pending': sum(len(p) for p in self.pending.values()),
+            'checkpoints_flushed': self.flushedCount,
+            'checkpoints_errors': self.errorCount,
+        }
@@ -11,6 +11,8 @@ import uuid
 
 import websockets
 
+from cobras.server.publish_ack import PublishAck
+
 
 class ConnectionState:
     def __init__(self, appkey, userAgent):
@@ -28,6 +30,9 @@ class ConnectionState:
         self.error = 'na'
         self.msgCount = 0
 
+        # How successful publishes are acknowledged
+        self.publishAck = PublishAck()
+
         tempdir = tempfile.gettempdir()
         self.path = os.path.join(tempdir, f'log_{self.connection_id}')
         self.fileLogging = False
@@ -0,0 +1,209 @@
+'''Lag of the subscriptions, compared with the tail of their redis stream
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Each subscription has its own queue in its channel reader, so it is
+measured from the last message it handled (Subscriber.lastId). Once per
+interval, the tails of the streams read by the node are fetched, with one
+pipeline per app, and compared with those positions:
+
+* time lag: difference between the timestamps embedded in the tail
+  and in the position stream ids, in milliseconds
+* message lag: number of messages after the position, counted up to
+  MAX_MESSAGE_LAG, since counting requires fetching the messages. Only
+  the streams with a lagging subscription are fetched again, in a second
+  pipeline, from their oldest lagging position.
+'''
+
+import asyncio
+import collections
+import logging
+
+DEFAULT_CONSUMER_LAG_INTERVAL_MS = 1000
+MAX_MESSAGE_LAG = 100
+
+
+def getStreamIdMs(streamId) -> int:
+    '''b'1526919030474-55' -> 1526919030474'''
+    if isinstance(streamId, bytes):
+        streamId = streamId.decode()
+
+    ms, _, _ = streamId.partition('-')
+    return int(ms)
+
+
+def parseStreamId(streamId) -> tuple:
+    '''1526919030474-55 -> (1526919030474, 55)'''
+    ms, _, seq = streamId.partition('-')
+    return (int(ms), int(seq or 0))
+
+
+class ConsumerLag:
+    def __init__(
+        self, channelReaders, redisClients, intervalMs=DEFAULT_CONSUMER_LAG_INTERVAL_MS
+    ):
+        self.channelReaders = channelReaders
+        self.redisClients = redisClients
+        self.interval = intervalMs / 1000
+
+        # One entry per subscription, from the last sample
+        self.lags = []
+        self.errorCount = 0
+
+    async def getStreamLags(self, appkey, positions):
+        '''(message lag, time lag in ms) per (stream, position), for the
+        stream -> positions dict of an app. Streams which cannot be read
+        are left out.
+        '''
+        streams = list(positions)
+
+        pool = self.redisClients.getRedisPool(appkey)
+        async with pool.client() as redis:
+            tails = await redis.pipeline(
+                [('XREVRANGE', stream, '+', '-', b'COUNT', 1) for stream in streams]
+            )
+
+            tailIds = {}
+            oldestPositions = {}
+            for stream, tail in zip(streams, tails):
+                if isinstance(tail, Exception):
+                    logging.warning(f'consumer lag: cannot read {stream}: {tail}')
+                    self.errorCount += 1
+                    continue
+
+                tailId = tail[0][0].decode() if tail else None
+                tailIds[stream] = tailId
+
+                # '$': nothing was handled since the subscription started
+                lagging = [
+                    position
+                    for position in positions[stream]
+                    if position != '$' and position != tailId
+                ]
+                if tailId is not None and lagging:
+                    oldestPositions[stream] = min(lagging, key=parseStreamId)
+
+            laggingStreams = list(oldestPositions)
+            results = []
+            if laggingStreams:
+                results = await redis.pipeline(
+                    [
+                        (
+                            'XREVRANGE',
+                            stream,
+                            '+',
+                            oldestPositions[stream],
+                            b'COUNT',
+                            MAX_MESSAGE_LAG + 1,
+                        )
+                        for stream in laggingStreams
+                    ]
+                )
+
+        entryIds = {}
+        for stream, entries in zip(laggingStreams, results):
+            if isinstance(entries, Exception):
+                logging.warning(f'consumer lag: cannot read {stream}: {entries}')
+                self.errorCount += 1
+                del tailIds[stream]
+                continue
+
+            entryIds[stream] = [parseStreamId(entry[0].decode()) for entry in entries]
+
+        lags = {}
+        for stream, tailId in tailIds.items():
+            for position in positions[stream]:
+                if stream not in oldestPositions or position in ('$', tailId):
+                    lags[(stream, position)] = (0, 0)
+                    continue
+
+                positionId = parseStreamId(position)
+                messageLag = sum(1 for i in entryIds[stream] if i > positionId)
+                messageLag = min(messageLag, MAX_MESSAGE_LAG)
+
+                timeLag = getStreamIdMs(tailId) - getStreamIdMs(position)
+                lags[(stream, position)] = (messageLag, max(timeLag, 0))
+
+        return lags
+
+    async def sample(self):
+        # appkey -> [(stream, handler, position)]
+        subscriptions = collections.defaultdict(list)
+
+        for (appkey, stream, _), reader in list(self.channelReaders.readers.items()):
+            if reader.closed:
+                continue
+
+            for handler, subscriber in list(reader.handlers.items()):
+                subscriptions[appkey].append(
+                    (reader.stream, handler, subscriber.lastId)
+                )
+
+        lags = []
+
+        for appkey, appSubscriptions in subscriptions.items():
+            positions = collections.defaultdict(set)
+            for stream, _, position in appSubscriptions:
+                positions[stream].add(position)
+
+            try:
+                streamLags = await self.getStreamLags(appkey, positions)
+            except Exception as e:
+                logging.warning(
+                    f'consumer lag: cannot read the streams of {appkey}: {e}'
+                )
+                self.errorCount += 1
+                continue
+
+            for stream, handler, position in appSubscriptions:
+                lag = streamLags.get((stream, position))
+                if lag is None:
+                    continue
+
+                messageLag, timeLag = lag
+                lags.append(
+                    {
+                        'appkey': appkey,
+                        'channel': handler.channel,
+                        'subscription_id': handler.subscriptionId,
+                        'role': handler.state.role,
+                        'connection_id': handler.state.connection_id,
+                        'position': position,
+                        'message_lag': messageLag,
+                        'time_lag_ms': timeLag,
+                    }
+                )
+
+        self.lags = lags
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sample()
+
+    def getWorstLags(self, count):
+        '''The count subscriptions with the largest time lags'''
+        lags = sorted(
+            self.lags,
+            key=lambda lag: (lag['time_lag_ms'], lag['message_lag']),
+            reverse=True,
+        )
+        return lags[:count]
+
+    def getLagsBy(self, field, skipIdle=False):
+        '''(sum of the message lags, max time lag) per role or channel'''
+        messageLags = collections.defaultdict(int)
+        maxTimeLags = collections.defaultdict(int)
+
+        for lag in self.lags:
+            if skipIdle and lag['message_lag'] == 0 and lag['time_lag_ms'] == 0:
+                continue
+
+            key = lag[field]
+            messageLags[key] += lag['message_lag']
+            maxTimeLags[key] = max(maxTimeLags[key], lag['time_lag_ms'])
+
+        return messageLags, maxTimeLags
+
+    def getStats(self):
+        return {'consumer_lag_errors': self.errorCount}
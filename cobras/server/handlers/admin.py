@@ -7,6 +7,13 @@ import logging
 from typing import Dict
 
 from cobras.common.cobra_types import JsonDict
+from cobras.common.sampling_profiler import (
+    DEFAULT_PROFILE_DURATION,
+    DEFAULT_PROFILE_MODE,
+    DEFAULT_TOP_FUNCTIONS,
+    MAX_PROFILE_DURATION,
+    profile,
+)
 from cobras.server.connection_state import ConnectionState
 
 
@@ -68,6 +75,98 @@ async def handleAdminCloseConnection(
     await state.respond(ws, response)
 
 
+DEFAULT_CONSUMER_LAG_COUNT = 10
+
+
+async def handleAdminGetConsumerLag(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    '''The subscriptions with the largest lags on this node'''
+    action = pdu['action']
+    body = pdu.get('body', {})
+    count = body.get('count', DEFAULT_CONSUMER_LAG_COUNT)
+
+    if not isinstance(count, int) or count < 0:
+        errMsg = f'Invalid count: {count}'
+        logging.warning(errMsg)
+        response = {
+            "action": f"{action}/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    subscriptions = app['consumer_lag'].getWorstLags(count)
+
+    response = {
+        "action": f"{action}/ok",
+        "id": pdu.get('id', 1),
+        "body": {'subscriptions': subscriptions},
+    }
+    await state.respond(ws, response)
+
+
+async def handleAdminGetSlowCallbacks(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    '''The last callbacks which blocked the event loop of this node'''
+    action = pdu['action']
+    loopLag = app['loop_lag']
+
+    response = {
+        "action": f"{action}/ok",
+        "id": pdu.get('id', 1),
+        "body": {
+            'count': loopLag.slowCallbackCount,
+            'slow_callbacks': loopLag.getSlowCallbacks(),
+        },
+    }
+    await state.respond(ws, response)
+
+
+async def handleAdminProfile(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    '''Profile this node for a few seconds, while it keeps serving'''
+    action = pdu['action']
+    body = pdu.get('body', {})
+    duration = body.get('duration', DEFAULT_PROFILE_DURATION)
+    mode = body.get('mode', DEFAULT_PROFILE_MODE)
+    top = body.get('top', DEFAULT_TOP_FUNCTIONS)
+
+    errMsg = None
+    if (
+        not isinstance(duration, (int, float))
+        or not 0 < duration <= MAX_PROFILE_DURATION
+    ):
+        errMsg = f'Invalid duration: {duration}, max is {MAX_PROFILE_DURATION}'
+    elif not isinstance(top, int) or top < 0:
+        errMsg = f'Invalid top: {top}'
+    else:
+        try:
+            result = await profile(duration, mode, top)
+        except ValueError as e:
+            errMsg = str(e)
+
+    if errMsg is not None:
+        logging.warning(errMsg)
+        response = {
+            "action": f"{action}/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    response = {
+        "action": f"{action}/ok",
+        "id": pdu.get('id', 1),
+        "body": result,
+    }
+    await state.respond(ws, response)
+
+
 # FIXME
 async def toggleFileLogging(state: ConnectionState, app: Dict, params: JsonDict):
     found = False
@@ -12,6 +12,7 @@ from cobras.server.connection_state import ConnectionState
 from cobras.common.apps_config import generateNonce
 from cobras.common.auth_hash import computeHash
 from cobras.common.version import getVersion
+from cobras.server.publish_ack import InvalidPublishAckError, PublishAck
 
 
 async def handleHandshake(
@@ -29,7 +30,22 @@ async def handleHandshake(
         await state.respond(ws, response)
         return
 
-    role = pdu.get('body', {}).get('data', {}).get('role')
+    data = pdu.get('body', {}).get('data', {})
+
+    try:
+        state.publishAck = PublishAck.fromConfig(data.get('publish_ack'))
+    except InvalidPublishAckError as e:
+        errMsg = str(e)
+        logging.warning(errMsg)
+        response = {
+            "action": "auth/handshake/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    role = data.get('role')
     state.role = role
     state.nonce = generateNonce()
 
@@ -1,9 +1,18 @@
-'''Key Value store operations (set, get, delete),
-but that are using streams for storage
+'''Key Value store operations (set, get, delete)
 
 Copyright (c) 2019 Machine Zone, Inc. All rights reserved.
 
-FIXME: missing delete
+Values are stored according to the kv_backend setting of each app:
+* stream: a redis stream trimmed to a single entry (default). Reads can
+  specify a position.
+* hash: a redis hash with the value in its json field.
+* string: a redis string, the most compact representation.
+
+Writes can set a ttl, in seconds. Keys can be converted from one backend
+to another with `cobra kv-migrate`.
+
+Apps with a read_cache_ttl_ms setting serve the reads of hot keys from
+an in process cache, see read_cache.py.
 '''
 
 import asyncio
@@ -11,6 +20,7 @@ import json
 import logging
 from typing import Dict, Optional
 
+from cobras.common.apps_config import KV_BACKEND_STREAM, KV_BACKEND_HASH
 from cobras.common.cobra_types import JsonDict
 from cobras.server.connection_state import ConnectionState
 
@@ -42,6 +52,142 @@ async def kvStoreRead(redis, stream: str, position: Optional[str], logger):
         raise
 
 
+async def kvRead(redis, backend: str, key: str, position: Optional[str], logger):
+    if backend == KV_BACKEND_STREAM:
+        return await kvStoreRead(redis, key, position, logger)
+
+    if backend == KV_BACKEND_HASH:
+        data = await redis.hget(key, 'json')
+    else:
+        data = await redis.get(key)
+
+    if data is None:
+        return None
+
+    return json.loads(data)
+
+
+def makeKvWriteCommands(redis, backend: str, key: str, data: str, ttl):
+    '''The first command is the one writing the value'''
+    if backend == KV_BACKEND_STREAM:
+        commands = [redis.makeXaddCommand(key, 'json', data, 1)]
+    elif backend == KV_BACKEND_HASH:
+        # Like SET, a write without ttl clears the one of a previous write
+        commands = [('HSET', key, 'json', data), ('PERSIST', key)]
+    elif ttl:
+        return [('SET', key, data, b'EX', ttl)]
+    else:
+        return [('SET', key, data)]
+
+    # The default stream write stays a single XADD, so a write without ttl
+    # keeps the ttl of a previous write on that backend.
+    if ttl:
+        commands[1:] = [('EXPIRE', key, ttl)]
+
+    return commands
+
+
+def makeKvReadCommand(backend: str, key: str):
+    if backend == KV_BACKEND_STREAM:
+        return ('XREVRANGE', key, '+', '-', b'COUNT', 1)
+    elif backend == KV_BACKEND_HASH:
+        return ('HGET', key, 'json')
+    else:
+        return ('GET', key)
+
+
+def getKvReadData(backend: str, result):
+    '''Extract the serialized value from the result of a read command'''
+    if backend == KV_BACKEND_STREAM:
+        return result[0][1][b'json'] if result else None
+
+    return result
+
+
+async def kvWrite(redis, backend: str, key: str, data: str, ttl: Optional[int]):
+    '''Returns the stream id for the stream backend, None otherwise'''
+    commands = makeKvWriteCommands(redis, backend, key, data, ttl)
+
+    # pipeline returns errors instead of raising them
+    results = await redis.pipeline(commands)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    if backend == KV_BACKEND_STREAM:
+        return results[0].decode()
+    return None
+
+
+# Runs atomically on the node owning the key, so that a write cannot land
+# between the read of the old value and the write of the new one
+KV_MIGRATE_SCRIPT = """
+local key = KEYS[1]
+local backend = ARGV[1]
+
+local keyType = redis.call('TYPE', key)['ok']
+if keyType == 'none' or keyType == backend then
+    return 0
+end
+
+local data
+if keyType == 'stream' then
+    local entries = redis.call('XREVRANGE', key, '+', '-', 'COUNT', 1)
+    if #entries == 0 then
+        return 0
+    end
+    local fields = entries[1][2]
+    for i = 1, #fields, 2 do
+        if fields[i] == 'json' then
+            data = fields[i + 1]
+        end
+    end
+elseif keyType == 'hash' then
+    data = redis.call('HGET', key, 'json')
+elseif keyType == 'string' then
+    data = redis.call('GET', key)
+else
+    return redis.error_reply(key .. ': unexpected key type ' .. keyType)
+end
+
+if not data then
+    return 0
+end
+
+local pttl = redis.call('PTTL', key)
+redis.call('DEL', key)
+
+if backend == 'stream' then
+    redis.call('XADD', key, 'MAXLEN', '~', 1, '*',
+               'json', data, 'sha1', redis.sha1hex(data))
+elseif backend == 'hash' then
+    redis.call('HSET', key, 'json', data)
+else
+    redis.call('SET', key, data)
+end
+
+if pttl > 0 then
+    redis.call('PEXPIRE', key, pttl)
+end
+return 1
+"""
+
+
+async def kvMigrate(redis, key: str, backend: str) -> bool:
+    '''Convert a key to another backend, keeping its ttl.
+    Returns False if there was nothing to convert.
+    '''
+    converted = await redis.eval(KV_MIGRATE_SCRIPT, [key], [backend])
+    return converted == 1
+
+
+def isValidTtl(ttl) -> bool:
+    if ttl is None:
+        return True
+
+    return isinstance(ttl, int) and not isinstance(ttl, bool) and ttl > 0
+
+
 # FIXME error handling
 async def handleRead(
     state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
@@ -53,11 +199,32 @@ async def handleRead(
 
     appChannel = '{}::{}'.format(state.appkey, channel)
 
-    redis = app['redis_clients'].makeRedisClient()
+    backend = app['apps_config'].getKvBackend(state.appkey)
+    if position is not None and backend != KV_BACKEND_STREAM:
+        errMsg = f'read: position is not supported by the {backend} kv backend'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/read/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    pool = app['redis_clients'].getRedisPool(state.appkey)
+
+    async def read():
+        async with pool.client() as redis:
+            return await kvRead(redis, backend, appChannel, position, state.log)
+
+    cacheTtlMs = app['apps_config'].getReadCacheTtlMs(state.appkey)
 
     try:
-        # Handle read
-        message = await kvStoreRead(redis, appChannel, position, state.log)
+        # Handle read, through the hot keys cache when enabled
+        if cacheTtlMs > 0 and position is None:
+            message = await app['read_cache'].get(appChannel, cacheTtlMs / 1000, read)
+        else:
+            message = await read()
     except Exception as e:
         errMsg = f'read: cannot connect to redis {e}'
         logging.warning(errMsg)
@@ -109,17 +276,32 @@ async def handleWrite(
         await state.respond(ws, response)
         return
 
+    # Optional expiration, in seconds
+    ttl = pdu.get('body', {}).get('ttl')
+    if not isValidTtl(ttl):
+        errMsg = f'write: invalid ttl {ttl}, expecting a positive integer'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/write/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
     # Extract the message. This is what will be published
     message = pdu['body']['message']
 
     appkey = state.appkey
-    redis = app['redis_clients'].getRedisClient(appkey)
+    pool = app['redis_clients'].getRedisPool(appkey)
+    backend = app['apps_config'].getKvBackend(appkey)
 
-    try:
-        appChannel = '{}::{}'.format(state.appkey, channel)
+    appChannel = '{}::{}'.format(state.appkey, channel)
 
+    try:
         serializedPdu = json.dumps(message)
-        streamId = await redis.xadd(appChannel, 'json', serializedPdu, maxLen=1)
+        async with pool.client() as redis:
+            streamId = await kvWrite(redis, backend, appChannel, serializedPdu, ttl)
 
     except Exception as e:
         errMsg = f'write: cannot connect to redis {e}'
@@ -131,6 +313,8 @@ async def handleWrite(
         }
         await state.respond(ws, response)
         return
+    finally:
+        app['read_cache'].invalidate(appChannel)
 
     # Stats
     app['stats'].updateWrites(state.role, len(serializedPdu))
@@ -138,7 +322,7 @@ async def handleWrite(
     response = {
         "action": f"rtm/write/ok",
         "id": pdu.get('id', 1),
-        "body": {"stream": streamId.decode()},
+        "body": {"stream": streamId},
     }
     await state.respond(ws, response)
 
@@ -162,10 +346,11 @@ async def handleDelete(
     appChannel = '{}::{}'.format(state.appkey, channel)
 
     appkey = state.appkey
-    redis = app['redis_clients'].getRedisClient(appkey)
+    pool = app['redis_clients'].getRedisPool(appkey)
 
     try:
-        await redis.delete(appChannel)
+        async with pool.client() as redis:
+            await redis.delete(appChannel)
     except Exception as e:
         errMsg = f'delete: cannot connect to redis {e}'
         logging.warning(errMsg)
@@ -176,6 +361,238 @@ async def handleDelete(
         }
         await state.respond(ws, response)
         return
+    finally:
+        app['read_cache'].invalidate(appChannel)
 
     response = {"action": f"rtm/delete/ok", "id": pdu.get('id', 1), "body": {}}
     await state.respond(ws, response)
+
+
+async def handleMultiRead(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    '''Read many keys with one pipeline (one round trip per redis node).
+    Missing keys are returned as null messages.
+    '''
+    channels = pdu.get('body', {}).get('channels')
+    if (
+        not isinstance(channels, list)
+        or len(channels) == 0
+        or not all(isinstance(channel, str) for channel in channels)
+    ):
+        errMsg = 'mread: missing or invalid channels field'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mread/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    backend = app['apps_config'].getKvBackend(state.appkey)
+    commands = [
+        makeKvReadCommand(backend, '{}::{}'.format(state.appkey, channel))
+        for channel in channels
+    ]
+
+    pool = app['redis_clients'].getRedisPool(state.appkey)
+
+    try:
+        async with pool.client() as redis:
+            results = await redis.pipeline(commands)
+    except Exception as e:
+        errMsg = f'mread: cannot connect to redis {e}'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mread/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    messages = {}
+    errors = {}
+    for channel, result in zip(channels, results):
+        if isinstance(result, Exception):
+            errors[channel] = f'mread: redis error {result}'
+            continue
+
+        data = getKvReadData(backend, result)
+        if data is None:
+            messages[channel] = None
+            continue
+
+        try:
+            messages[channel] = json.loads(data)
+        except ValueError as e:  # json or utf8 decoding error
+            errors[channel] = f'mread: invalid json value {e}'
+            continue
+
+        app['stats'].updateReads(state.role, len(data))
+
+    body = {"messages": messages}
+    if errors:
+        body['errors'] = errors
+
+    response = {"action": "rtm/mread/ok", "id": pdu.get('id', 1), "body": body}
+    await state.respond(ws, response)
+
+
+async def handleMultiWrite(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    '''Write many keys with one pipeline. The body has a list of
+    {"channel": channel, "message": message} entries, and an optional ttl
+    applied to all of them.
+    '''
+    body = pdu.get('body', {})
+    entries = body.get('messages')
+    if (
+        not isinstance(entries, list)
+        or len(entries) == 0
+        or not all(
+            isinstance(entry, dict)
+            and isinstance(entry.get('channel'), str)
+            and entry.get('message') is not None
+            for entry in entries
+        )
+    ):
+        errMsg = 'mwrite: missing or invalid messages field'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mwrite/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    ttl = body.get('ttl')
+    if not isValidTtl(ttl):
+        errMsg = f'mwrite: invalid ttl {ttl}, expecting a positive integer'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mwrite/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    appkey = state.appkey
+    pool = app['redis_clients'].getRedisPool(appkey)
+    backend = app['apps_config'].getKvBackend(appkey)
+
+    appChannels = ['{}::{}'.format(appkey, entry['channel']) for entry in entries]
+
+    try:
+        async with pool.client() as redis:
+            commands = []
+            sizes = []
+            offsets = []  # index of the first command of each entry
+            for entry, appChannel in zip(entries, appChannels):
+                data = json.dumps(entry['message'])
+                sizes.append(len(data))
+                offsets.append(len(commands))
+                commands.extend(
+                    makeKvWriteCommands(redis, backend, appChannel, data, ttl)
+                )
+
+            results = await redis.pipeline(commands)
+    except Exception as e:
+        errMsg = f'mwrite: cannot connect to redis {e}'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mwrite/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+    finally:
+        for appChannel in appChannels:
+            app['read_cache'].invalidate(appChannel)
+
+    streams = {}
+    errors = {}
+    offsets.append(len(commands))
+    for i, entry in enumerate(entries):
+        channel = entry['channel']
+        start, end = offsets[i], offsets[i + 1]
+        entryResults = results[start:end]
+
+        failures = [result for result in entryResults if isinstance(result, Exception)]
+        if failures:
+            errors[channel] = f'mwrite: redis error {failures[0]}'
+            continue
+
+        streamId = None
+        if backend == KV_BACKEND_STREAM:
+            streamId = entryResults[0].decode()
+        streams[channel] = streamId
+
+        app['stats'].updateWrites(state.role, sizes[i])
+
+    body = {"streams": streams}
+    if errors:
+        body['errors'] = errors
+
+    response = {"action": "rtm/mwrite/ok", "id": pdu.get('id', 1), "body": body}
+    await state.respond(ws, response)
+
+
+async def handleMultiDelete(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    channels = pdu.get('body', {}).get('channels')
+    if (
+        not isinstance(channels, list)
+        or len(channels) == 0
+        or not all(isinstance(channel, str) for channel in channels)
+    ):
+        errMsg = 'mdelete: missing or invalid channels field'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mdelete/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+
+    appChannels = ['{}::{}'.format(state.appkey, channel) for channel in channels]
+    commands = [('DEL', appChannel) for appChannel in appChannels]
+
+    pool = app['redis_clients'].getRedisPool(state.appkey)
+
+    try:
+        async with pool.client() as redis:
+            results = await redis.pipeline(commands)
+    except Exception as e:
+        errMsg = f'mdelete: cannot connect to redis {e}'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/mdelete/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.respond(ws, response)
+        return
+    finally:
+        for appChannel in appChannels:
+            app['read_cache'].invalidate(appChannel)
+
+    errors = {
+        channel: f'mdelete: redis error {result}'
+        for channel, result in zip(channels, results)
+        if isinstance(result, Exception)
+    }
+
+    body = {}
+    if errors:
+        body['errors'] = errors
+
+    response = {"action": "rtm/mdelete/ok", "id": pdu.get('id', 1), "body": body}
+    await state.respond(ws, response)
@@ -6,6 +6,7 @@ import asyncio
 import itertools
 import json
 import logging
+import time
 from typing import Dict
 
 from cobras.common.channel_builder import updateMsg
@@ -13,19 +14,20 @@ from cobras.common.cobra_types import JsonDict
 from cobras.common.task_cleanup import addTaskCleanup
 from cobras.common.throttle import Throttle
 from cobras.server.connection_state import ConnectionState
-from rcc.subscriber import (
-    RedisSubscriberMessageHandlerClass,
-    redisSubscriber,
-    validatePosition,
+from rcc.subscriber import RedisSubscriberMessageHandlerClass, validatePosition
+from cobras.server.stream_sql import (
+    InvalidStreamSQLError,
+    StreamSqlAggregator,
+    getStreamSqlFilter,
 )
-from cobras.server.stream_sql import InvalidStreamSQLError, StreamSqlFilter
 
 
 async def handlePublish(
     state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
 ):
-    '''Here we don't write back a result to the client for efficiency.
-    Client doesn't really needs it.
+    '''Successful publishes are acknowledged according to the connection
+    publish ack mode, see publish_ack.py. Clients which do not need a result
+    can skip it for efficiency.
     '''
     # Potentially add extra channels with channel builder rules
     rules = app['apps_config'].getChannelBuilderRules(state.appkey)
@@ -41,7 +43,7 @@ async def handlePublish(
             "id": pdu.get('id', 1),
             "body": {"error": errMsg},
         }
-        await state.respond(ws, response)
+        await state.publishAck.error(state, ws, response)
         return
 
     # Missing channels
@@ -55,55 +57,230 @@ async def handlePublish(
             "id": pdu.get('id', 1),
             "body": {"error": errMsg},
         }
-        await state.respond(ws, response)
+        await state.publishAck.error(state, ws, response)
         return
 
     if channels is None:
         channels = [channel]
 
-    streams = {}
+    # sanity check to skip empty channels
+    channels = [chan for chan in channels if chan is not None]
 
     appkey = state.appkey
     redis = app['redis_clients'].getRedisClient(appkey)
+    maxLen = app['channel_max_length']
+
+    # All the XADDs are sent in one batch, in a single round trip.
+    # For apps using batch publishing, they are also batched with the
+    # XADDs of the other connections.
+    commands = [
+        redis.makeXaddCommand(
+            '{}::{}'.format(appkey, chan), 'json', serializedPdu, maxLen
+        )
+        for chan in channels
+    ]
 
-    for chan in channels:
+    try:
+        results = await app['pipelined_publishers'].publish(appkey, commands)
+    except Exception as e:
+        errMsg = f'publish: cannot connect to redis {e}'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/publish/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.publishAck.error(state, ws, response)
+        return
 
-        # sanity check to skip empty channels
-        if chan is None:
+    errors = {}
+    for chan, result in zip(channels, results):
+        if isinstance(result, Exception):
+            errors[chan] = f'publish: redis error {result}'
             continue
 
-        try:
-            maxLen = app['channel_max_length']
-            stream = '{}::{}'.format(appkey, chan)
-            streamId = await redis.xadd(stream, 'json', serializedPdu, maxLen)
-
-            streams[chan] = streamId
-        except Exception as e:
-            # await publishers.erasePublisher(appkey, chan)  # FIXME
-
-            errMsg = f'publish: cannot connect to redis {e}'
-            logging.warning(errMsg)
-            response = {
-                "action": "rtm/publish/error",
-                "id": pdu.get('id', 1),
-                "body": {"error": errMsg},
-            }
-            await state.respond(ws, response)
-            return
-
         app['stats'].updateChannelPublished(chan, len(serializedPdu))
 
+    if errors and len(errors) == len(channels):
+        errMsg = 'publish: cannot publish to any channel'
+        logging.warning(f'{errMsg}: {errors}')
+        response = {
+            "action": "rtm/publish/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg, "errors": errors},
+        }
+        await state.publishAck.error(state, ws, response)
+        return
+
     response = {
         "action": "rtm/publish/ok",
         "id": pdu.get('id', 1),
         "body": {'channels': channels},
     }
-    await state.respond(ws, response)
+
+    # Partial failures are reported per channel, whatever the ack mode
+    if errors:
+        response['body']['errors'] = errors
+        await state.publishAck.error(state, ws, response)
+    else:
+        await state.publishAck.ok(state, ws, pdu, response)
 
     # Stats
     app['stats'].updatePublished(state.role, len(serializedPdu))
 
 
+async def handlePublishBatch(
+    state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
+):
+    '''Publish many messages carried by a single PDU.
+    All the XADDs are written to redis with a single pipeline, and one response
+    is returned with the stream ids (or the errors) of each entry.
+    '''
+    entries = pdu.get('body', {}).get('messages')
+    if not isinstance(entries, list) or len(entries) == 0:
+        errMsg = 'publish_batch: missing or empty messages field'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/publish_batch/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.publishAck.error(state, ws, response)
+        return
+
+    appkey = state.appkey
+    redis = app['redis_clients'].getRedisClient(appkey)
+    maxLen = app['channel_max_length']
+    rules = app['apps_config'].getChannelBuilderRules(appkey)
+
+    results = []
+    payloadSizes = []
+    commands = []
+    targets = []  # (entry index, channel) for each command
+
+    for i, entry in enumerate(entries):
+        payloadSizes.append(0)
+
+        if not isinstance(entry, dict) or entry.get('message') is None:
+            results.append({'error': 'publish_batch: empty message'})
+            continue
+
+        if entry.get('channel') is None and entry.get('channels') is None:
+            results.append({'error': 'publish_batch: no channel or channels field'})
+            continue
+
+        # Each entry is stored like a regular publish PDU,
+        # which is what subscribers expect
+        entryPdu = {"action": "rtm/publish", "body": entry}
+        serializedEntry = json.dumps(entryPdu)
+        payloadSizes[i] = len(serializedEntry)
+
+        # Potentially add extra channels with channel builder rules
+        entryPdu = updateMsg(rules, entryPdu)
+
+        body = entryPdu['body']
+        channels = body.get('channels')
+        if channels is None:
+            channels = [body.get('channel')]
+
+        results.append({'channels': {}})
+
+        for chan in channels:
+            # sanity check to skip empty channels
+            if chan is None:
+                continue
+
+            stream = '{}::{}'.format(appkey, chan)
+            command = redis.makeXaddCommand(stream, 'json', serializedEntry, maxLen)
+            commands.append(command)
+            targets.append((i, chan))
+
+    try:
+        streamIds = await app['pipelined_publishers'].publish(appkey, commands)
+    except Exception as e:
+        errMsg = f'publish_batch: cannot connect to redis {e}'
+        logging.warning(errMsg)
+        response = {
+            "action": "rtm/publish_batch/error",
+            "id": pdu.get('id', 1),
+            "body": {"error": errMsg},
+        }
+        await state.publishAck.error(state, ws, response)
+        return
+
+    for (i, chan), streamId in zip(targets, streamIds):
+        result = results[i]
+
+        if isinstance(streamId, Exception):
+            result.setdefault('errors', {})[chan] = f'publish: redis error {streamId}'
+            continue
+
+        result['channels'][chan] = streamId.decode()
+        app['stats'].updateChannelPublished(chan, payloadSizes[i])
+
+    # Stats
+    for result, payloadSize in zip(results, payloadSizes):
+        if result.get('channels'):
+            app['stats'].updatePublished(state.role, payloadSize)
+
+    response = {
+        "action": "rtm/publish_batch/ok",
+        "id": pdu.get('id', 1),
+        "body": {"results": results},
+    }
+
+    # Like a publish, a batch is only acknowledged according to the ack
+    # mode of the connection when all its entries succeeded
+    if any('error' in result or 'errors' in result for result in results):
+        await state.publishAck.error(state, ws, response)
+    else:
+        await state.publishAck.ok(state, ws, pdu, response)
+
+
+async def sendAggregates(state: ConnectionState, ws, subscriptionId, aggregator):
+    '''Send the rows computed during each tumbling window.
+    Windows are aligned on the wall clock, and empty windows are skipped.
+    '''
+    idIterator = itertools.count()
+    window = aggregator.window
+
+    while True:
+        now = time.time()
+        end = (now // window + 1) * window
+        await asyncio.sleep(end - now)
+
+        rows = aggregator.flush()
+        if not rows:
+            continue
+
+        pdu = {
+            "action": "rtm/subscription/data",
+            "id": next(idIterator),
+            "body": {
+                "subscription_id": subscriptionId,
+                "messages": rows,
+                "position": aggregator.position,
+                "window": {"start": end - window, "end": end},
+            },
+        }
+        serializedPdu = json.dumps(pdu)
+        state.log(f"> {serializedPdu}")
+
+        await ws.send(serializedPdu)
+
+
+async def runAggregatedSubscription(
+    subscription, state: ConnectionState, ws, subscriptionId, aggregator
+):
+    task = asyncio.ensure_future(sendAggregates(state, ws, subscriptionId, aggregator))
+    addTaskCleanup(task)
+
+    try:
+        return await subscription
+    finally:
+        task.cancel()
+
+
 async def handleSubscribe(
     state: ConnectionState, ws, app: Dict, pdu: JsonDict, serializedPdu: str
 ):
@@ -150,7 +327,7 @@ async def handleSubscribe(
     hasFilter = filterStr not in ('', None)
 
     try:
-        streamSQLFilter = StreamSqlFilter(filterStr) if hasFilter else None
+        streamSQLFilter = getStreamSqlFilter(filterStr) if hasFilter else None
     except InvalidStreamSQLError:
         errMsg = f'Invalid SQL expression {filterStr}'
         logging.warning(errMsg)
@@ -167,6 +344,26 @@ async def handleSubscribe(
         channel = streamSQLFilter.channel
 
     position = body.get('position')
+
+    # Durable subscriptions start from their last delivered position
+    resume = body.get('resume', False)
+    if resume:
+        try:
+            checkpoint = await app['checkpoints'].get(state.appkey, subscriptionId)
+        except Exception as e:
+            errMsg = f'subscribe: cannot read checkpoint {e}'
+            logging.warning(errMsg)
+            response = {
+                "action": "rtm/subscribe/error",
+                "id": pdu.get('id', 1),
+                "body": {"error": errMsg},
+            }
+            await state.respond(ws, response)
+            return
+
+        if checkpoint is not None:
+            position = checkpoint
+
     if not validatePosition(position):
         errMsg = f'Invalid position: {position}'
         logging.warning(errMsg)
@@ -223,6 +420,8 @@ async def handleSubscribe(
             self.app = args['app']
             self.channel = args['channel']
             self.batchSize = args['batch_size']
+            self.aggregator = args['aggregator']
+            self.checkpoints = args['checkpoints']
             self.idIterator = itertools.count()
 
             self.messages = []
@@ -230,6 +429,12 @@ async def handleSubscribe(
         def log(self, msg):
             self.state.log(msg)
 
+        def getIndexKey(self):
+            if not self.hasFilter:
+                return None
+
+            return self.streamSQLFilter.getIndexKey()
+
         async def on_init(self, initInfo):
             response = self.subscribeResponse
             response['body'].update(initInfo)
@@ -247,14 +452,36 @@ async def handleSubscribe(
             # Send response.
             await self.state.respond(self.ws, response)
 
+        def updateStats(self, payloadSize: int):
+            self.serverStats.updateSubscribed(self.state.role, payloadSize)
+            self.serverStats.updateChannelSubscribed(self.channel, payloadSize)
+
+        def handleSkippedMsg(self, payloadSize: int):
+            '''The channel reader index found that the filter cannot match'''
+            self.updateStats(payloadSize)
+
+        def handleOverflow(self, position: str, missedCount: int):
+            '''The channel reader dropped this subscription, which fell behind'''
+            pdu = {
+                "action": "rtm/subscription/error",
+                "body": {
+                    "error": "out_of_sync",
+                    "reason": "Too much traffic",
+                    "position": position,
+                    "subscription_id": self.subscriptionId,
+                    "missed_message_count": missedCount,
+                },
+            }
+            task = asyncio.ensure_future(self.state.respond(self.ws, pdu))
+            addTaskCleanup(task)
+
         async def handleMsg(self, msg: dict, position: str, payloadSize: int) -> bool:
 
             # Input msg is the full serialized publish pdu.
             # Extract the real message out of it.
             msg = msg.get('body', {}).get('message')
 
-            self.serverStats.updateSubscribed(self.state.role, payloadSize)
-            self.serverStats.updateChannelSubscribed(self.channel, payloadSize)
+            self.updateStats(payloadSize)
 
             if self.hasFilter:
                 filterOutput = self.streamSQLFilter.match(
@@ -265,6 +492,10 @@ async def handleSubscribe(
                 else:
                     msg = filterOutput
 
+            if self.aggregator is not None:
+                self.aggregator.add(msg, position)
+                return True
+
             self.messages.append(msg)
             if len(self.messages) < self.batchSize:
                 return True
@@ -285,6 +516,9 @@ async def handleSubscribe(
 
             await self.ws.send(serializedPdu)
 
+            if self.checkpoints is not None:
+                self.checkpoints.update(self.appkey, self.subscriptionId, position)
+
             self.cnt += len(self.messages)
             self.cntPerSec += len(self.messages)
 
@@ -300,30 +534,41 @@ async def handleSubscribe(
 
     appChannel = '{}::{}'.format(state.appkey, channel)
 
-    # We need to create a new connection as reading from it will be blocking
-    redisClient = app['redis_clients'].makeRedisClient()
-
-    task = asyncio.ensure_future(
-        redisSubscriber(
-            redisClient.redis,
-            appChannel,
-            position,
-            MessageHandlerClass,
-            {
-                'ws': ws,
-                'subscription_id': subscriptionId,
-                'has_filter': hasFilter,
-                'stream_sql_filter': streamSQLFilter,
-                'appkey': state.appkey,
-                'stats': app['stats'],
-                'state': state,
-                'subscribe_response': response,
-                'app': app,
-                'channel': channel,
-                'batch_size': batchSize,
-            },
-        )
+    # Aggregation filters emit one data PDU per window
+    aggregator = None
+    if hasFilter and streamSQLFilter.window is not None:
+        aggregator = StreamSqlAggregator(streamSQLFilter)
+
+    # The redis stream is read by a reader shared with the other subscribers
+    # of that channel on this node
+    subscription = app['channel_readers'].subscribe(
+        state.appkey,
+        appChannel,
+        position,
+        MessageHandlerClass,
+        {
+            'ws': ws,
+            'subscription_id': subscriptionId,
+            'has_filter': hasFilter,
+            'stream_sql_filter': streamSQLFilter,
+            'appkey': state.appkey,
+            'stats': app['stats'],
+            'state': state,
+            'subscribe_response': response,
+            'app': app,
+            'channel': channel,
+            'batch_size': batchSize,
+            'aggregator': aggregator,
+            'checkpoints': app['checkpoints'] if resume else None,
+        },
     )
+
+    if aggregator is not None:
+        subscription = runAggregatedSubscription(
+            subscription, state, ws, subscriptionId, aggregator
+        )
+
+    task = asyncio.ensure_future(subscription)
     addTaskCleanup(task)
 
     key = subscriptionId + state.connection_id
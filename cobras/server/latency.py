@@ -0,0 +1,66 @@
+'''Latency histograms of the actions and of the redis commands
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+They are shared by all the redis clients of the process, and reported
+then reset every second by ServerStats. The commands of a pipeline are
+recorded under their own name, from the time the pipeline is sent to the
+time their reply is read. xread is not recorded: it blocks until there
+are new messages, its duration measures how idle a channel is.
+'''
+
+import asyncio
+import functools
+import time
+
+from cobras.common.histogram import Histograms
+
+actionLatencies = Histograms()
+redisLatencies = Histograms()
+
+
+def recordRedisLatency(command):
+    '''Decorator for the redis client methods'''
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except asyncio.CancelledError:
+                # Unsubscribed while blocked in xread, not a latency
+                start = None
+                raise
+            finally:
+                if start is not None:
+                    redisLatencies.record(command, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def getCommandName(command) -> str:
+    '''('XADD', stream, ...) -> xadd'''
+    name = command[0]
+    if isinstance(name, bytes):
+        name = name.decode()
+
+    return name.lower()
+
+
+def recordPipelineLatency(command, seconds):
+    redisLatencies.record(getCommandName(command), seconds)
+
+
+def getLatencies():
+    return {
+        'actions': actionLatencies.getStats(),
+        'redis': redisLatencies.getStats(),
+    }
+
+
+def resetLatencies():
+    actionLatencies.reset()
+    redisLatencies.reset()
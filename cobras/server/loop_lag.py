@@ -0,0 +1,150 @@
+'''Event loop lag, and detection of the callbacks blocking the loop
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Every connection of a node is served by the same asyncio loop, so a slow
+callback (a huge json.dumps, a slow stream sql filter...) delays all of
+them. The lag is measured by a task sleeping for a fixed interval, as
+the difference between the time it wakes up and the time it asked to.
+
+A blocked loop cannot report on itself, so a watchdog thread checks when
+the task last woke up. Past the slow callback threshold, it captures the
+stack of the loop thread while it is still blocked, and logs it. The
+last reports are kept, and returned by the admin/get_slow_callbacks action.
+'''
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from cobras.common.histogram import Histogram
+
+DEFAULT_LOOP_LAG_INTERVAL_MS = 100
+DEFAULT_SLOW_CALLBACK_MS = 500
+MAX_SLOW_CALLBACKS = 10
+
+
+def getTaskName(task) -> str:
+    if task is None:
+        return ''
+
+    coro = task.get_coro()
+    return getattr(coro, '__qualname__', repr(coro))
+
+
+class LoopLag:
+    def __init__(
+        self,
+        intervalMs=DEFAULT_LOOP_LAG_INTERVAL_MS,
+        slowCallbackMs=DEFAULT_SLOW_CALLBACK_MS,
+    ):
+        self.interval = intervalMs / 1000
+        self.slowCallbackThreshold = slowCallbackMs / 1000
+
+        # Reset at the end of every stats period, like the latencies
+        self.histogram = Histogram()
+
+        # Written by the loop, read by the watchdog thread
+        self.lastWakeUp = time.monotonic()
+        self.loop = None
+        self.loopThreadId = None
+
+        self.slowCallbacks = collections.deque(maxlen=MAX_SLOW_CALLBACKS)
+        self.slowCallbackCount = 0
+
+        self.watchdog = None
+        self.stopWatchdog = threading.Event()
+
+    async def run(self):
+        self.loop = asyncio.get_event_loop()
+        self.loopThreadId = threading.get_ident()
+        self.lastWakeUp = time.monotonic()
+
+        self.stopWatchdog.clear()
+        self.watchdog = threading.Thread(
+            target=self.watch, name='cobra-loop-watchdog', daemon=True
+        )
+        self.watchdog.start()
+
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.wakeUp(time.monotonic())
+        finally:
+            # The watchdog can be in the middle of a report, do not block
+            # the loop while it finishes
+            self.stopWatchdog.set()
+            await self.loop.run_in_executor(None, self.watchdog.join)
+
+    def wakeUp(self, now):
+        lag = max(now - self.lastWakeUp - self.interval, 0)
+        self.histogram.record(lag)
+
+        # The watchdog only saw the beginning of the stall
+        if self.slowCallbacks and self.slowCallbacks[-1]['since'] == self.lastWakeUp:
+            self.slowCallbacks[-1]['blocked_ms'] = round(lag * 1000)
+
+        self.lastWakeUp = now
+
+    def watch(self):
+        reported = None
+
+        while not self.stopWatchdog.wait(self.interval):
+            lastWakeUp = self.lastWakeUp
+            blocked = time.monotonic() - lastWakeUp - self.interval
+
+            if blocked < self.slowCallbackThreshold or reported == lastWakeUp:
+                continue
+
+            # Only one report per stall
+            reported = lastWakeUp
+            self.reportSlowCallback(lastWakeUp, blocked)
+
+    def reportSlowCallback(self, since, blocked):
+        frame = sys._current_frames().get(self.loopThreadId)
+        stack = traceback.format_stack(frame) if frame is not None else []
+
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+
+        slowCallback = {
+            'since': since,
+            'time': time.time(),
+            'task': getTaskName(task),
+            'blocked_ms': round(blocked * 1000),
+            'stack': stack,
+        }
+        self.slowCallbacks.append(slowCallback)
+        self.slowCallbackCount += 1
+
+        logging.warning(
+            'event loop blocked for more than {} ms in task {}\n{}'.format(
+                slowCallback['blocked_ms'], slowCallback['task'] or '-', ''.join(stack)
+            )
+        )
+
+    def getSlowCallbacks(self):
+        '''The last slow callbacks, the most recent first'''
+        return [
+            {key: value for key, value in slowCallback.items() if key != 'since'}
+            for slowCallback in reversed(self.slowCallbacks)
+        ]
+
+    def getStats(self):
+        stats = self.histogram.getStats()
+        return {
+            'loop_lag_p50_ms': stats['p50'],
+            'loop_lag_p90_ms': stats['p90'],
+            'loop_lag_p99_ms': stats['p99'],
+            'loop_lag_max_ms': stats['max'],
+            'slow_callbacks': self.slowCallbackCount,
+        }
+
+    def reset(self):
+        self.histogram.reset()
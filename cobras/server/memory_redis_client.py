@@ -0,0 +1,349 @@
+'''In process replacement for redis, selected with --redis_urls memory://
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+For single node deployments and tests which do not need persistence.
+It implements the commands cobra uses: streams (XADD with MAXLEN, blocking
+XREAD, XREVRANGE), strings, hashes, DEL, expirations and SCAN. Replies
+have the same shape as redis replies, and are converted like rcc does.
+
+All the clients of a memory:// url in a process share the same data,
+memory://other urls get their own data.
+
+Streams are trimmed exactly to MAXLEN (redis trims approximately).
+
+Like redis, expired keys are deleted when they are accessed, and also
+actively: each command deletes up to ACTIVE_EXPIRE_LIMIT of the keys
+whose deadline passed, so that keys which are never read again are freed.
+'''
+
+import asyncio
+import collections
+import fnmatch
+import heapq
+import itertools
+import time
+
+import hiredis
+
+from cobras.server.redis_drivers import RedisDriverClient
+
+ACTIVE_EXPIRE_LIMIT = 20
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+
+def toBytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode(errors='surrogateescape')
+
+
+def toStr(value):
+    if isinstance(value, bytes):
+        return value.decode(errors='surrogateescape')
+    return str(value)
+
+
+def parseStreamId(streamId):
+    '''b'1526919030474-55' -> (1526919030474, 55)'''
+    ms, _, seq = toBytes(streamId).partition(b'-')
+    return (int(ms), int(seq or 0))
+
+
+class MemoryStream:
+    def __init__(self):
+        self.entries = collections.deque()  # (parsed id, id, fields)
+        self.lastId = (0, 0)
+
+    def add(self, fields, maxLen):
+        ms = int(time.time() * 1000)
+        lastMs, lastSeq = self.lastId
+        self.lastId = (ms, 0) if ms > lastMs else (lastMs, lastSeq + 1)
+
+        streamId = '{}-{}'.format(*self.lastId).encode()
+        self.entries.append((self.lastId, streamId, fields))
+
+        while maxLen is not None and len(self.entries) > maxLen:
+            self.entries.popleft()
+
+        return streamId
+
+    def after(self, lastId):
+        entries = []
+        for parsedId, streamId, fields in reversed(self.entries):
+            if parsedId <= lastId:
+                break
+            entries.append([streamId, fields])
+
+        entries.reverse()
+        return entries
+
+    def revrange(self, start, end, count):
+        entries = []
+        for parsedId, streamId, fields in reversed(self.entries):
+            if len(entries) == count:
+                break
+            if end <= parsedId <= start:
+                entries.append([streamId, fields])
+
+        return entries
+
+
+class MemoryStore:
+    def __init__(self):
+        self.data = {}
+        self.expirations = {}  # key -> time.monotonic() deadline
+
+        # (deadline, key) min heap. Entries are not removed when a key is
+        # deleted, persisted or expired again, they are skipped when popped.
+        self.deadlines = []
+        self.waiters = collections.defaultdict(set)  # stream -> futures
+        self.clientIds = itertools.count(1)
+
+    def lookup(self, key, kind=None):
+        deadline = self.expirations.get(key)
+        if deadline is not None and time.monotonic() >= deadline:
+            self.delete(key)
+
+        value = self.data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise hiredis.ReplyError(WRONGTYPE)
+
+        return value
+
+    def delete(self, key):
+        self.expirations.pop(key, None)
+        return self.data.pop(key, None) is not None
+
+    def store(self, key, value):
+        self.expirations.pop(key, None)
+        self.data[key] = value
+
+    def expire(self, key, ttl):
+        if self.lookup(key) is None:
+            return 0
+
+        deadline = time.monotonic() + ttl
+        self.expirations[key] = deadline
+        heapq.heappush(self.deadlines, (deadline, key))
+        return 1
+
+    def expireActively(self):
+        '''Delete a bounded number of the keys which expired'''
+        deadlines = self.deadlines
+        if not deadlines:
+            return
+
+        now = time.monotonic()
+        for _ in range(ACTIVE_EXPIRE_LIMIT):
+            if not deadlines or deadlines[0][0] > now:
+                return
+
+            deadline, key = heapq.heappop(deadlines)
+            if self.expirations.get(key) == deadline:
+                self.delete(key)
+
+    def execute(self, args):
+        '''Return a redis like reply, or raise a hiredis.ReplyError'''
+        self.expireActively()
+
+        cmd = toStr(args[0]).upper()
+        args = [toStr(arg) for arg in args[1:]]
+
+        handler = getattr(self, 'cmd' + cmd, None)
+        if handler is None:
+            raise hiredis.ReplyError(f"ERR unknown command '{cmd}'")
+
+        return handler(*args)
+
+    def cmdPING(self):
+        return b'PONG'
+
+    def cmdINFO(self):
+        return b'# Cluster\r\ncluster_enabled:0\r\n'
+
+    def cmdCLIENT(self, subcommand):
+        return next(self.clientIds)
+
+    def cmdXADD(self, key, *args):
+        maxLen = None
+        if args[0].upper() == 'MAXLEN':
+            args = args[1:]
+            if args[0] in ('~', '='):
+                args = args[1:]
+            maxLen = int(args[0])
+            args = args[1:]
+
+        # Only auto generated ids are supported
+        if args[0] != '*':
+            raise hiredis.ReplyError('ERR only * ids are supported')
+
+        fields = [toBytes(arg) for arg in args[1:]]
+
+        stream = self.lookup(key, MemoryStream)
+        if stream is None:
+            stream = MemoryStream()
+            self.data[key] = stream
+
+        streamId = stream.add(fields, maxLen)
+
+        for waiter in self.waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+        return streamId
+
+    def cmdXREVRANGE(self, key, start, end, countArg=None, count=None):
+        stream = self.lookup(key, MemoryStream)
+        if stream is None:
+            return []
+
+        start = (float('inf'), 0) if start == '+' else parseStreamId(start)
+        end = (0, 0) if end == '-' else parseStreamId(end)
+        count = int(count) if count is not None else None
+
+        return stream.revrange(start, end, count)
+
+    async def xread(self, key, lastId):
+        '''Blocking XREAD on a single stream, without timeout'''
+        stream = self.lookup(key, MemoryStream)
+
+        if lastId == '$':
+            lastId = stream.lastId if stream is not None else (0, 0)
+        else:
+            lastId = parseStreamId(lastId)
+
+        while True:
+            stream = self.lookup(key, MemoryStream)
+            entries = stream.after(lastId) if stream is not None else []
+            if entries:
+                return [[toBytes(key), entries]]
+
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters[key].add(waiter)
+            try:
+                await waiter
+            finally:
+                waiters = self.waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self.waiters[key]
+
+    def cmdEXISTS(self, *keys):
+        return sum(1 for key in keys if self.lookup(key) is not None)
+
+    def cmdDEL(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self.lookup(key) is not None:
+                deleted += self.delete(key)
+
+        return deleted
+
+    def cmdGET(self, key):
+        return self.lookup(key, bytes)
+
+    def cmdSET(self, key, value, *options):
+        self.store(key, toBytes(value))
+
+        if options and options[0].upper() == 'EX':
+            self.expire(key, int(options[1]))
+
+        return b'OK'
+
+    def cmdHSET(self, key, field, value):
+        fields = self.lookup(key, dict)
+        if fields is None:
+            fields = {}
+            self.data[key] = fields
+
+        created = field not in fields
+        fields[field] = toBytes(value)
+        return int(created)
+
+    def cmdHGET(self, key, field):
+        fields = self.lookup(key, dict)
+        return None if fields is None else fields.get(field)
+
+    def cmdTYPE(self, key):
+        value = self.lookup(key)
+        if value is None:
+            return b'none'
+
+        types = {MemoryStream: b'stream', bytes: b'string', dict: b'hash'}
+        return types[type(value)]
+
+    def cmdEXPIRE(self, key, ttl):
+        return self.expire(key, int(ttl))
+
+    def cmdPEXPIRE(self, key, ttl):
+        return self.expire(key, int(ttl) / 1000)
+
+    def cmdPERSIST(self, key):
+        if self.lookup(key) is None:
+            return 0
+
+        return 1 if self.expirations.pop(key, None) is not None else 0
+
+    def cmdPTTL(self, key):
+        if self.lookup(key) is None:
+            return -2
+
+        deadline = self.expirations.get(key)
+        if deadline is None:
+            return -1
+
+        return int(1000 * (deadline - time.monotonic()))
+
+    def cmdSCAN(self, cursor, matchArg='MATCH', pattern='*', countArg=None, count=None):
+        '''Everything is returned at once'''
+        keys = [
+            toBytes(key)
+            for key in list(self.data)
+            if fnmatch.fnmatchcase(key, pattern) and self.lookup(key) is not None
+        ]
+        return [b'0', keys]
+
+
+# url -> store shared by all the clients of that url
+stores = {}
+
+
+def getMemoryStore(url):
+    store = stores.get(url)
+    if store is None:
+        store = MemoryStore()
+        stores[url] = store
+
+    return store
+
+
+class MemoryRedisClient(RedisDriverClient):
+    def __init__(self, url, password=None):
+        super().__init__(url, password)
+        self.store = getMemoryStore(url)
+
+    async def execute(self, *args):
+        if args[0] == 'XREAD':
+            # XREAD BLOCK 0 STREAMS key id
+            return await self.store.xread(toStr(args[-2]), toStr(args[-1]))
+
+        return self.store.execute(args)
+
+    async def executeMany(self, commands):
+        results = []
+        for command in commands:
+            try:
+                results.append(self.store.execute(command))
+            except hiredis.ReplyError as e:
+                results.append(e)
+
+        return results
+
+    async def getHostForKey(self, key):
+        return 'memory'
+
+    def close(self):
+        pass
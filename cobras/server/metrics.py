@@ -0,0 +1,165 @@
+'''Node metrics in the Prometheus text exposition format, served on /metrics/
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Everything is rendered from memory, without going through redis:
+
+* per role and per channel (top K) message and byte counters
+* the system stats also found in the /stats stream (connections, tasks,
+  memory, redis pools, read cache, checkpoints...)
+* subscription lags, from the last sample
+* latency summaries of the actions and redis commands. The quantiles,
+  sum and count cover the current stats period, since the histograms are
+  reset every second when stats are enabled
+
+The per channel values come from space saving counters: a channel can
+leave the top K and come back with a lower count, so they are gauges.
+'''
+
+import time
+
+from cobras.server.latency import actionLatencies, redisLatencies
+from cobras.server.stats import METRICS
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# published_count -> cobra_published_messages_total
+COUNTER_NAMES = {
+    metric: 'cobra_' + metric.replace('_count', '_messages') + '_total'
+    for metric in METRICS
+}
+
+
+# Already exported with more details (per app pools, uptime in seconds)
+SKIPPED_SYSTEM_DATA = ('uptime_minutes', 'redis_pool_waits', 'redis_pool_wait_ms')
+
+
+def escapeLabelValue(value):
+    value = str(value)
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+
+    labels = ','.join(
+        f'{name}="{escapeLabelValue(value)}"' for name, value in labels.items()
+    )
+    return '{' + labels + '}'
+
+
+class MetricsWriter:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, metricType, samples):
+        '''samples is a list of (labels dict, value)'''
+        self.lines.append(f'# TYPE {name} {metricType}')
+        for labels, value in samples:
+            self.lines.append(f'{name}{formatLabels(labels)} {value}')
+
+    def addSummary(self, name, summaries):
+        '''summaries is a list of (labels dict, quantiles dict, sum, count)'''
+        self.lines.append(f'# TYPE {name} summary')
+        for labels, quantiles, total, count in summaries:
+            for quantile, value in quantiles.items():
+                quantileLabels = dict(labels, quantile=quantile)
+                self.lines.append(f'{name}{formatLabels(quantileLabels)} {value}')
+
+            self.lines.append(f'{name}_sum{formatLabels(labels)} {total}')
+            self.lines.append(f'{name}_count{formatLabels(labels)} {count}')
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def addLatencies(writer, name, label, histograms):
+    summaries = []
+    for key, histogram in histograms.histograms.items():
+        if histogram.count == 0:
+            continue
+
+        stats = histogram.getStats()
+        quantiles = {
+            quantile: stats[field] / 1000
+            for quantile, field in (
+                ('0.5', 'p50'),
+                ('0.9', 'p90'),
+                ('0.99', 'p99'),
+                ('1', 'max'),
+            )
+        }
+        summaries.append(
+            ({label: key}, quantiles, histogram.sum / 1e6, histogram.count)
+        )
+
+    writer.addSummary(f'{name}_seconds', summaries)
+
+
+def renderMetrics(serverStats):
+    writer = MetricsWriter()
+
+    for metric in METRICS:
+        samples = [
+            ({'role': role}, value)
+            for role, value in serverStats.counters.getValues(metric).items()
+        ]
+        writer.add(COUNTER_NAMES[metric], 'counter', samples)
+
+    channelCounters = (
+        ('published', serverStats.publishedByChannel),
+        ('subscribed', serverStats.subscribedByChannel),
+    )
+    for prefix, topK in channelCounters:
+        for field in ('count', 'bytes'):
+            # Not monotonic, the _total suffix is for counters
+            metric = f'{prefix}_{field}'
+            name = COUNTER_NAMES[metric].replace('cobra_', 'cobra_channel_', 1)
+            name = name[: -len('_total')]
+            samples = [
+                ({'channel': channel}, value)
+                for channel, value in topK.top(field).items()
+            ]
+            writer.add(name, 'gauge', samples)
+
+    writer.add(
+        'cobra_subscriptions',
+        'gauge',
+        [({'role': role}, count) for role, count in serverStats.subscriptions.items()],
+    )
+
+    # Reading the pools stats must not reset the max wait of the stats period
+    poolsStats = serverStats.getPoolsStats(reset=False)
+    systemData = serverStats.getSystemData(poolsStats)
+    for key, value in systemData.items():
+        if key in SKIPPED_SYSTEM_DATA or not isinstance(value, (int, float)):
+            continue
+
+        writer.add(f'cobra_{key}', 'gauge', [({}, value)])
+
+    writer.add('cobra_uptime_seconds', 'gauge', [({}, time.time() - serverStats.start)])
+
+    for field in ('connections', 'idle', 'wait_count', 'wait_ms', 'errors'):
+        samples = [
+            ({'appkey': appkey}, pool[field]) for appkey, pool in poolsStats.items()
+        ]
+        writer.add(f'cobra_redis_pool_{field}', 'gauge', samples)
+
+    if serverStats.consumerLag is not None:
+        lagMessages, lagMaxMs = serverStats.consumerLag.getLagsBy('role')
+        writer.add(
+            'cobra_consumer_lag_messages',
+            'gauge',
+            [({'role': role}, value) for role, value in lagMessages.items()],
+        )
+        writer.add(
+            'cobra_consumer_lag_max_seconds',
+            'gauge',
+            [({'role': role}, value / 1000) for role, value in lagMaxMs.items()],
+        )
+
+    addLatencies(writer, 'cobra_action_latency', 'action', actionLatencies)
+    addLatencies(writer, 'cobra_redis_latency', 'command', redisLatencies)
+
+    return writer.render()
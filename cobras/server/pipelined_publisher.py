@@ -5,56 +5,68 @@ Copyright (c) 2018-2019 Machine Zone, Inc. All rights reserved.
 
 https://redis.io/topics/pipelining
 Weird leaks https://bugs.python.org/issue31620
+
+A batch is flushed when it reaches batchSize jobs, or when the oldest job
+in it has been waiting for lingerMs milliseconds, whichever comes first.
 '''
 
 import asyncio
-from typing import Optional
+
+from cobras.common.task_cleanup import addTaskCleanup
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_LINGER_MS = 1
 
 
 class PipelinedPublisher:
-    def __init__(self, redis, batchSize=None, channelMaxLength=None):
+    def __init__(self, redis, batchSize=None, lingerMs=None):
         self.redis = redis
-        self.queue = asyncio.Queue()
-        self.batchSize = batchSize or 100
-        self.xaddMaxLength = channelMaxLength or 1000
-        self.lock = asyncio.Lock()
-
-    async def publishAll(self):
-        async with await self.redis.pipeline() as pipe:
-            async with self.lock:
-                while True:
-                    try:
-                        job = self.queue.get_nowait()
-                    except asyncio.QueueEmpty:
-                        break
-                    else:
-                        await self.publish(pipe, job)
-                        self.queue.task_done()
-
-            await pipe.execute()
-
-    def enqueue(self, job):
-        self.queue.put_nowait(job)
-
-    async def publish(self, pipe, job, maxLen: Optional[int] = None):
-        if maxLen is None:
-            maxLen = self.xaddMaxLength
-
-        appkey, channel, data = job
-        appChannel = '{}::{}'.format(appkey, channel)
-        await self.redis.xadd(
-            appChannel, {'json': data}, max_len=self.xaddMaxLength, approximate=True
-        )
-
-    async def publishNow(self, job, maxLen: Optional[int] = None):
-        await self.publish(None, job, maxLen)
-
-    async def push(self, job, batchPublish=False):
-        if not batchPublish:
-            await self.publishNow(job)
+        self.batchSize = batchSize or DEFAULT_BATCH_SIZE
+        self.linger = (DEFAULT_LINGER_MS if lingerMs is None else lingerMs) / 1000
+
+        self.jobs = []
+        self.timer = None
+
+    def publish(self, command):
+        '''Enqueue a command (XADD usually), and return a future which
+        completes with the command result once its batch has been sent.
+        '''
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.jobs.append((command, future))
+
+        if len(self.jobs) >= self.batchSize:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self.flush)
+
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if not self.jobs:
             return
 
-        self.enqueue(job)
+        jobs = self.jobs
+        self.jobs = []
+
+        task = asyncio.ensure_future(self.publishAll(jobs))
+        addTaskCleanup(task)
+
+    async def publishAll(self, jobs):
+        commands = [command for command, _ in jobs]
+
+        try:
+            results = await self.redis.pipeline(commands)
+        except Exception as e:
+            for _, future in jobs:
+                if not future.done():
+                    future.set_exception(e)
+            return
 
-        if self.queue.qsize() >= self.batchSize:
-            await self.publishAll()
+        for (_, future), result in zip(jobs, results):
+            if not future.done():
+                future.set_result(result)
@@ -5,60 +5,42 @@ Copyright (c) 2018-2019 Machine Zone, Inc. All rights reserved.
 
 import asyncio
 
+from cobras.common.apps_config import AppsConfig
 from cobras.server.pipelined_publisher import PipelinedPublisher
-from cobras.server.redis_connections import RedisConnections
+from cobras.server.redis_clients import RedisClients
 
 
 class PipelinedPublishers:
-    def __init__(
-        self,
-        redisConnections: RedisConnections,
-        batchPublishSize: int,
-        channelMaxLength: int,
-    ) -> None:
-        self.redisConnections = redisConnections
+    def __init__(self, redisClients: RedisClients, appsConfig: AppsConfig) -> None:
+        self.redisClients = redisClients
+        self.appsConfig = appsConfig
         self.pipelinedPublishers: dict = {}
-        self.batchPublishSize: int = batchPublishSize
-        self.channelMaxLength: int = channelMaxLength
-        self.lock = asyncio.Lock()
 
-    def getAppChannelAndKey(self, appkey, channel):
+        batchPublishSize = appsConfig.getBatchPublishSize()
+        self.batchPublishSize = batchPublishSize if batchPublishSize > 0 else None
+        self.batchPublishLingerMs = appsConfig.getBatchPublishLingerMs()
+
+        for appkey in appsConfig.apps or {}:
+            if appsConfig.isBatchPublishEnabled(appkey):
+                self.pipelinedPublishers[appkey] = PipelinedPublisher(
+                    redisClients.getRedisClient(appkey),
+                    self.batchPublishSize,
+                    self.batchPublishLingerMs,
+                )
+
+    def get(self, appkey):
+        '''Returns None for apps which do not use batch publishing'''
+        return self.pipelinedPublishers.get(appkey)
+
+    async def publish(self, appkey, commands):
+        '''Send commands for an app, batched with the commands of
+        the other connections of that app if batch publishing is enabled.
+        Same return value as RedisClientRcc.pipeline.
         '''
-        Constraints:
-        * (A) For a given app, subscriptions and publish should go to the
-          same redis node.
-        * (B) Each app should get its own redis connection,
-          so that one 'busy' app does not block another one.
+        pipelinedPublisher = self.get(appkey)
+        if pipelinedPublisher is None:
+            redis = self.redisClients.getRedisClient(appkey)
+            return await redis.pipeline(commands)
 
-        Those constraints are reflected in the way we compute the hashing key
-        '''
-        # Constraint A
-        appChannel = '{}::{}'.format(appkey, channel)
-
-        # Constraint B
-        key = '{}::{}'.format(appkey, self.redisConnections.hashChannel(appChannel))
-
-        return appChannel, key
-
-    async def get(self, appkey, channel):
-        appChannel, key = self.getAppChannelAndKey(appkey, channel)
-
-        async with self.lock:
-            pipelinedPublisher = self.pipelinedPublishers.get(key)
-            if pipelinedPublisher is not None:
-                return pipelinedPublisher
-
-            db = await self.redisConnections.create(appChannel)
-            pipelinedPublisher = PipelinedPublisher(
-                db, self.batchPublishSize, self.channelMaxLength
-            )
-            self.pipelinedPublishers[key] = pipelinedPublisher
-            return pipelinedPublisher
-
-    async def erasePublisher(self, appkey, channel):
-        appChannel, key = self.getAppChannelAndKey(appkey, channel)
-
-        async with self.lock:
-            pipelinedPublisher = self.pipelinedPublishers.get(key)
-            if pipelinedPublisher is not None:
-                del self.pipelinedPublishers[key]
+        futures = [pipelinedPublisher.publish(command) for command in commands]
+        return list(await asyncio.gather(*futures))
@@ -6,6 +6,7 @@ Copyright (c) 2018-2019 Machine Zone, Inc. All rights reserved.
 import base64
 import json
 import logging
+import time
 from typing import Dict
 
 from cobras.common.cobra_types import JsonDict
@@ -13,14 +14,26 @@ from cobras.server.connection_state import ConnectionState
 from cobras.server.handlers.admin import (
     handleAdminCloseConnection,
     handleAdminGetConnections,
+    handleAdminGetConsumerLag,
+    handleAdminGetSlowCallbacks,
+    handleAdminProfile,
 )
 from cobras.server.handlers.auth import handleAuth, handleHandshake
-from cobras.server.handlers.kv_store import handleDelete, handleRead, handleWrite
+from cobras.server.handlers.kv_store import (
+    handleDelete,
+    handleMultiDelete,
+    handleMultiRead,
+    handleMultiWrite,
+    handleRead,
+    handleWrite,
+)
 from cobras.server.handlers.pubsub import (
     handlePublish,
+    handlePublishBatch,
     handleSubscribe,
     handleUnSubscribe,
 )
+from cobras.server.latency import actionLatencies
 
 
 async def badFormat(state: ConnectionState, ws, app: Dict, reason: str):
@@ -30,6 +43,15 @@ async def badFormat(state: ConnectionState, ws, app: Dict, reason: str):
     await state.respond(ws, response)
 
 
+# Actions requiring the same permission as another action
+PERMISSIONS_ALIASES = {
+    'publish_batch': 'publish',
+    'mread': 'read',
+    'mwrite': 'write',
+    'mdelete': 'delete',
+}
+
+
 def validatePermissions(permissions, action):
     group, _, verb = action.partition('/')
 
@@ -39,6 +61,7 @@ def validatePermissions(permissions, action):
     if group == 'auth':
         return True
 
+    verb = PERMISSIONS_ALIASES.get(verb, verb)
     return verb in permissions
 
 
@@ -47,13 +70,20 @@ ACTION_HANDLERS_LUT = {
     f'{AUTH_PREFIX}/handshake': handleHandshake,
     f'{AUTH_PREFIX}/authenticate': handleAuth,
     'rtm/publish': handlePublish,
+    'rtm/publish_batch': handlePublishBatch,
     'rtm/subscribe': handleSubscribe,
     'rtm/unsubscribe': handleUnSubscribe,
     'rtm/read': handleRead,
     'rtm/write': handleWrite,
     'rtm/delete': handleDelete,
+    'rtm/mread': handleMultiRead,
+    'rtm/mwrite': handleMultiWrite,
+    'rtm/mdelete': handleMultiDelete,
     'admin/close_connection': handleAdminCloseConnection,
     'admin/get_connections': handleAdminGetConnections,
+    'admin/get_consumer_lag': handleAdminGetConsumerLag,
+    'admin/get_slow_callbacks': handleAdminGetSlowCallbacks,
+    'admin/profile': handleAdminProfile,
 }
 
 
@@ -107,4 +137,8 @@ async def processCobraMessage(
         return
 
     # proceed with handling action
-    await handler(state, ws, app, pdu, serializedPdu)
+    start = time.perf_counter()
+    try:
+        await handler(state, ws, app, pdu, serializedPdu)
+    finally:
+        actionLatencies.record(action, time.perf_counter() - start)
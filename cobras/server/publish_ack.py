@@ -0,0 +1,118 @@
+'''Publish acknowledgement modes
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+* all: one rtm/publish/ok response per publish (default)
+* none: no response for successful publishes
+* cumulative: one rtm/publish/ok response every N publishes or T milliseconds,
+  whichever comes first, carrying the id of the last publish. Since the
+  publishes of a connection are processed in order, and errors are always
+  reported right away (after flushing the pending ack), it acknowledges all
+  the publishes preceding it.
+
+A mode is selected for a connection in the handshake, and a single
+publish can opt out of its response with "ack": false in its body.
+Publish batches follow the same rules. Responses which report a failure,
+even a partial one, are always sent, through PublishAck.error.
+'''
+
+import asyncio
+
+from cobras.common.task_cleanup import addTaskCleanup
+
+ACK_ALL = 'all'
+ACK_NONE = 'none'
+ACK_CUMULATIVE = 'cumulative'
+ACK_MODES = (ACK_ALL, ACK_NONE, ACK_CUMULATIVE)
+
+DEFAULT_CUMULATIVE_ACK_COUNT = 100
+DEFAULT_CUMULATIVE_ACK_INTERVAL_MS = 100
+
+
+class InvalidPublishAckError(Exception):
+    pass
+
+
+class PublishAck:
+    def __init__(self, mode=ACK_ALL, count=None, intervalMs=None):
+        if mode not in ACK_MODES:
+            raise InvalidPublishAckError(f'invalid publish ack mode: {mode}')
+
+        self.mode = mode
+        self.count = count or DEFAULT_CUMULATIVE_ACK_COUNT
+        self.interval = (intervalMs or DEFAULT_CUMULATIVE_ACK_INTERVAL_MS) / 1000
+
+        self.lastId = None
+        self.pending = 0
+        self.timer = None
+
+    @staticmethod
+    def fromConfig(config):
+        '''config is the publish_ack field of the handshake data, such as
+        {"mode": "cumulative", "count": 100, "interval_ms": 50}
+        '''
+        if config is None:
+            return PublishAck()
+
+        if not isinstance(config, dict):
+            raise InvalidPublishAckError(f'invalid publish ack config: {config}')
+
+        try:
+            return PublishAck(
+                config.get('mode', ACK_ALL),
+                int(config.get('count') or 0),
+                float(config.get('interval_ms') or 0),
+            )
+        except (TypeError, ValueError):
+            raise InvalidPublishAckError(f'invalid publish ack config: {config}')
+
+    async def ok(self, state, ws, pdu, response):
+        '''Send (or not) the response of a successful publish'''
+        if not pdu.get('body', {}).get('ack', True):
+            return
+
+        if self.mode == ACK_ALL:
+            await state.respond(ws, response)
+        elif self.mode == ACK_CUMULATIVE:
+            self.lastId = response['id']
+            self.pending += 1
+
+            if self.pending >= self.count:
+                await self.flush(state, ws)
+            elif self.timer is None:
+                self.timer = asyncio.get_event_loop().call_later(
+                    self.interval, self.scheduleFlush, state, ws
+                )
+
+    async def error(self, state, ws, response):
+        '''Errors, including partial failures, are always sent, after the
+        publishes which preceded them have been acknowledged
+        '''
+        await self.flush(state, ws)
+        await state.respond(ws, response)
+
+    def scheduleFlush(self, state, ws):
+        self.timer = None
+        task = asyncio.ensure_future(self.flush(state, ws))
+        addTaskCleanup(task)
+
+    async def flush(self, state, ws):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.pending == 0:
+            return
+
+        response = {
+            "action": "rtm/publish/ok",
+            "id": self.lastId,
+            "body": {"cumulative": True, "count": self.pending},
+        }
+        self.pending = 0
+        await state.respond(ws, response)
+
+    def terminate(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
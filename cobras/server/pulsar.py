@@ -82,7 +82,9 @@ async def handleConsumerMessage(state: ConnectionState, ws, app: Dict, path: str
 
     chan = f'{tenant}::{namespace}::{topic}'
 
-    redis = app['redis_clients'].makeRedisClient()
+    # A dedicated connection to the redis backend of the app, like the
+    # producer, since the reads are blocking
+    redis = app['redis_clients'].makeRedisClient(state.appkey)
 
     lastId = '$'
 
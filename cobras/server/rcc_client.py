@@ -1,12 +1,70 @@
 '''rcc redis client
 
 Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+In cluster mode, the slot -> node map is fetched with CLUSTER SLOTS and
+shared by all the clients of a cluster. It is refreshed periodically,
+and after MOVED or ASK redirections. Key slots are computed locally.
 '''
 
+import asyncio
+import collections
+import logging
+import time
 from urllib.parse import urlparse
 from hashlib import sha1
 
+import hiredis
 from rcc.client import RedisClient
+from rcc.hash_slot import getHashSlot
+from rcc.response import convertResponse
+
+from cobras.server.latency import recordPipelineLatency, recordRedisLatency
+
+SLOT_MAP_REFRESH_INTERVAL = 60
+
+
+class SlotMap:
+    def __init__(self):
+        self.clusterEnabled = None  # unknown until the first INFO
+        self.urls = {}  # slot -> node url, also used by rcc to route commands
+        self.refreshTime = None
+
+    def isStale(self):
+        if self.refreshTime is None:
+            return True
+
+        return time.monotonic() - self.refreshTime > SLOT_MAP_REFRESH_INTERVAL
+
+    def invalidate(self):
+        self.refreshTime = None
+
+    def update(self, slots):
+        '''slots is the CLUSTER SLOTS response'''
+        urls = {}
+        for slotInfo in slots:
+            start, end, master = slotInfo[0], slotInfo[1], slotInfo[2]
+            url = 'redis://{}:{}'.format(master[0].decode(), master[1])
+            for slot in range(start, end + 1):
+                urls[slot] = url
+
+        # Updated in place, as the rcc clients hold a reference to it
+        self.urls.clear()
+        self.urls.update(urls)
+        self.refreshTime = time.monotonic()
+
+
+# One slot map per cluster (seed url)
+slotMaps = {}
+
+
+def getSlotMap(url):
+    slotMap = slotMaps.get(url)
+    if slotMap is None:
+        slotMap = SlotMap()
+        slotMaps[url] = slotMap
+
+    return slotMap
 
 
 class RedisClientRcc(object):
@@ -26,40 +84,64 @@ class RedisClientRcc(object):
 
         self.host = host
 
+        self.slotMap = getSlotMap(url)
+        self.redis.urls = self.slotMap.urls
+
+    def close(self):
+        self.redis.close()
+
     async def getClientIdForKey(self, key):
         return await self.redis.send('CLIENT', 'ID', key=key)
 
+    async def isCluster(self):
+        if self.slotMap.clusterEnabled is None:
+            if self.cluster:
+                self.slotMap.clusterEnabled = True
+            else:
+                info = await self.redis.send('INFO')
+                self.slotMap.clusterEnabled = info.get('cluster_enabled') == '1'
+
+        return self.slotMap.clusterEnabled
+
+    async def refreshSlotMap(self):
+        if not self.slotMap.isStale():
+            return
+
+        try:
+            slots = await self.redis.send('CLUSTER', 'SLOTS')
+        except Exception as e:
+            # Keep the current map, commands are redirected if needed
+            logging.warning(f'cannot refresh the cluster slot map: {e}')
+            self.slotMap.refreshTime = time.monotonic()
+            return
+
+        self.slotMap.update(slots)
+
     async def getHostForKey(self, key):
         # Check whether redis is running in cluster mode or not
         try:
-            info = await self.redis.send('INFO')
+            cluster = await self.isCluster()
         except Exception:
             return f'{self.redis.host}:{self.redis.port}'
 
-        if info.get('cluster_enabled') == '0':
+        if not cluster:
             return f'{self.redis.host}:{self.redis.port}'
 
-        # Redis is running in cluster mode.
-        # 1. get the slot for a key
-        slot = await self.redis.send('CLUSTER', 'KEYSLOT', key)
+        await self.refreshSlotMap()
 
-        # 2. find which node is handling a slot
-        slots = await self.redis.send('CLUSTER', 'SLOTS')
-
-        for slotInfo in slots:
-            if slotInfo[0] <= slot <= slotInfo[1]:
-                host = slotInfo[2][0].decode()
-                port = slotInfo[2][1]
-                return f'{host}:{port}'
+        url = self.slotMap.urls.get(getHashSlot(key))
+        if url is None:
+            # this should not happen, unless the cluster is being reconfigured
+            return 'unknown-host'
 
-        # this should not happen, unless the cluster is being reconfigured
-        return 'unknown-host'
+        return urlparse(url).netloc
 
     async def ping(self):
         return await self.redis.send('PING')
 
-    async def xadd(self, stream, field, data, maxLen):
-        return await self.redis.send(
+    @staticmethod
+    def makeXaddCommand(stream, field, data, maxLen):
+        return (
             'XADD',
             stream,
             'MAXLEN',
@@ -72,6 +154,10 @@ class RedisClientRcc(object):
             sha1(data.encode()).hexdigest(),
         )
 
+    @recordRedisLatency('xadd')
+    async def xadd(self, stream, field, data, maxLen):
+        return await self.redis.send(*self.makeXaddCommand(stream, field, data, maxLen))
+
     async def xaddRaw(self, stream, maxLen, *args):
         return await self.redis.send('XADD', stream, 'MAXLEN', '~', maxLen, b'*', *args)
 
@@ -83,8 +169,139 @@ class RedisClientRcc(object):
             'XREAD', 'BLOCK', b'0', b'STREAMS', stream, streamId
         )
 
+    @recordRedisLatency('del')
     async def delete(self, key):
         return await self.redis.send('DEL', key)
 
+    @recordRedisLatency('xrevrange')
     async def xrevrange(self, stream, start, end, count):
         return await self.redis.send('XREVRANGE', stream, start, end, b'COUNT', count)
+
+    @recordRedisLatency('get')
+    async def get(self, key):
+        return await self.redis.send('GET', key)
+
+    @recordRedisLatency('set')
+    async def set(self, key, value, ttl=None):
+        if ttl:
+            return await self.redis.send('SET', key, value, b'EX', ttl)
+        return await self.redis.send('SET', key, value)
+
+    @recordRedisLatency('hget')
+    async def hget(self, key, field):
+        return await self.redis.send('HGET', key, field)
+
+    async def type(self, key):
+        return await self.redis.send('TYPE', key)
+
+    async def pttl(self, key):
+        return await self.redis.send('PTTL', key)
+
+    async def eval(self, script, keys, args):
+        '''keys must live on the same node'''
+        return await self.redis.send(
+            'EVAL', script, len(keys), *keys, *args, key=keys[0]
+        )
+
+    async def scan(self, cursor, pattern, count):
+        '''Scan the keys of a single redis node (cursor is a string)'''
+        return await self.redis.send('SCAN', cursor, b'MATCH', pattern, b'COUNT', count)
+
+    @recordRedisLatency('pipeline')
+    async def pipeline(self, commands):
+        '''Send a list of commands, with one round trip per redis node.
+
+        commands is a list of tuples such as ('XADD', stream, ...).
+        One result is returned per command. When a command fails the
+        redis error is returned in place of its result instead of being
+        raised, so that callers can report partial failures.
+        '''
+        try:
+            return await self.doPipeline(commands)
+        except (asyncio.CancelledError, Exception):
+            # Cancelled (or failed) between writing the commands and reading
+            # their replies, the next caller would read them
+            self.redis.close()
+            raise
+
+    async def doPipeline(self, commands):
+        results = [None] * len(commands)
+        redirected = []
+        asked = []
+
+        # Commands are grouped per node using the slot map
+        if await self.isCluster():
+            await self.refreshSlotMap()
+
+        async with self.redis.lock:
+            # In cluster mode, group the commands by the node owning their slot
+            groups = collections.OrderedDict()
+            for i, command in enumerate(commands):
+                key = self.redis.findKey(*command)
+                connection = await self.redis.getConnection(key)
+                groups.setdefault(connection, []).append(i)
+
+            start = time.perf_counter()
+
+            # 1. write all the commands
+            for connection, indexes in groups.items():
+                for i in indexes:
+                    await connection.send(*commands[i])
+
+            # 2. read all the responses
+            for connection, indexes in groups.items():
+                for i in indexes:
+                    response = await connection.readResponse()
+                    recordPipelineLatency(commands[i], time.perf_counter() - start)
+
+                    if isinstance(response, hiredis.ReplyError):
+                        if str(response).startswith('MOVED'):
+                            redirected.append(i)
+                        elif str(response).startswith('ASK'):
+                            asked.append((i, str(response).split()[2]))
+                        results[i] = response
+                    else:
+                        results[i] = convertResponse(response, commands[i][0])
+
+        if redirected or asked:
+            self.slotMap.invalidate()
+
+        # Commands sent to the wrong cluster node are retried one by one,
+        # rcc follows the redirection and updates the slot map
+        for i in redirected:
+            try:
+                results[i] = await self.redis.send(*commands[i])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                results[i] = e
+
+        # Slots being migrated: the command is sent once to the importing node
+        for i, hostPort in asked:
+            results[i] = await self.sendAsking('redis://' + hostPort, commands[i])
+
+        return results
+
+    async def sendAsking(self, url, command):
+        '''Like in pipeline, errors are returned instead of being raised'''
+        async with self.redis.lock:
+            connection = self.redis.pool.get(url)
+
+            try:
+                await connection.send('ASKING')
+                await connection.send(*command)
+
+                await connection.readResponse()
+                response = await connection.readResponse()
+            except asyncio.CancelledError:
+                connection.close()
+                raise
+            except Exception as e:
+                # Do not leave unread replies on the connection
+                connection.close()
+                return e
+
+        if isinstance(response, hiredis.ReplyError):
+            return response
+
+        return convertResponse(response, command[0])
@@ -0,0 +1,97 @@
+'''In process cache for KV reads of hot keys
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+* LRU, bounded in number of keys
+* Entries expire after a per app ttl, which bounds how stale a value
+  written through another node can be.
+* Writes and deletes going through this node invalidate their key.
+* Concurrent misses for the same key share a single redis read
+  (single flight).
+'''
+
+import asyncio
+import collections
+import time
+
+from cobras.common.task_cleanup import addTaskCleanup
+
+DEFAULT_READ_CACHE_SIZE = 10000
+
+
+class ReadCache:
+    def __init__(self, maxSize=DEFAULT_READ_CACHE_SIZE):
+        self.maxSize = maxSize
+
+        # key -> (expiration time, value)
+        self.entries = collections.OrderedDict()
+
+        # key -> task reading the key from redis
+        self.inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get(self, key, ttl, loader):
+        '''ttl is in seconds. loader is a coroutine function
+        reading the value from redis on misses
+        '''
+        entry = self.entries.get(key)
+        if entry is not None:
+            expiration, value = entry
+            if time.monotonic() < expiration:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self.entries[key]
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self.load(key, ttl, loader))
+            addTaskCleanup(task)
+            self.inflight[key] = task
+
+        # Shielded so that a cancelled reader does not cancel the other ones
+        return await asyncio.shield(task)
+
+    async def load(self, key, ttl, loader):
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+        finally:
+            # Invalidated while loading, the value might be stale
+            current = self.inflight.get(key) is task
+            if current:
+                del self.inflight[key]
+
+        if current:
+            self.put(key, value, ttl)
+
+        return value
+
+    def put(self, key, value, ttl):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+        self.inflight.pop(key, None)
+
+    def getStats(self):
+        return {
+            'read_cache_keys': len(self.entries),
+            'read_cache_hits': self.hits,
+            'read_cache_misses': self.misses,
+            'read_cache_coalesced': self.coalesced,
+            'read_cache_evictions': self.evictions,
+        }
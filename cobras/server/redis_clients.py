@@ -1,23 +1,88 @@
 '''Manage redis clients, owned by the app
 
 Copyright (c) 2018-2020 Machine Zone, Inc. All rights reserved.
+
+Apps use the redis urls given on the command line, unless they have their
+own redis_urls (and redis_password, redis_cluster) in the apps config.
 '''
 
-from cobras.server.rcc_client import RedisClientRcc
+import functools
+
+from cobras.server.memory_redis_client import MemoryRedisClient
+from cobras.server.redis_drivers import REDIS_DRIVER_RCC, makeDriverClient
+from cobras.server.redis_pool import RedisClientPool
+from cobras.server.sharded_redis_client import ShardedRedisClient
+
+
+def makeRedisClient(redisUrls, redisPassword, redisCluster, driver=REDIS_DRIVER_RCC):
+    '''Without redis cluster, channels are sharded over the redis urls'''
+    if redisUrls.startswith('memory://'):
+        return MemoryRedisClient(redisUrls)
+
+    urls = redisUrls.split(';')
+    if len(urls) > 1 and not redisCluster:
+        return ShardedRedisClient(urls, redisPassword, driver)
+
+    return makeDriverClient(redisUrls, redisPassword, redisCluster, driver)
 
 
 class RedisClients(object):
-    def __init__(self, redisUrls, redisPassword, redisCluster, appsConfig):
+    def __init__(
+        self,
+        redisUrls,
+        redisPassword,
+        redisCluster,
+        appsConfig,
+        redisDriver=REDIS_DRIVER_RCC,
+    ):
         self.redisUrls = redisUrls
         self.redisPassword = redisPassword
         self.redisCluster = redisCluster
+        self.redisDriver = redisDriver
+        self.settings = {}
         self.clients = {}
+        self.pools = {}
 
         for app in appsConfig.apps:
-            self.clients[app] = self.makeRedisClient()
+            urls = appsConfig.getRedisUrls(app)
+            if urls is not None:
+                self.settings[app] = (
+                    urls,
+                    appsConfig.getRedisPassword(app),
+                    appsConfig.isRedisCluster(app),
+                )
+
+            self.clients[app] = self.makeRedisClient(app)
+            self.pools[app] = RedisClientPool(
+                functools.partial(self.makeRedisClient, app),
+                appsConfig.getRedisPoolSize(app),
+            )
 
-    def makeRedisClient(self):
-        return RedisClientRcc(self.redisUrls, self.redisPassword, self.redisCluster)
+        # For operations not tied to an app, such as startup probes
+        self.defaultPool = RedisClientPool(self.makeRedisClient)
+
+    def getRedisSettings(self, appkey=None):
+        '''(urls, password, cluster) used by an app'''
+        defaultSettings = (self.redisUrls, self.redisPassword, self.redisCluster)
+        return self.settings.get(appkey, defaultSettings)
+
+    def makeRedisClient(self, appkey=None):
+        urls, password, cluster = self.getRedisSettings(appkey)
+        return makeRedisClient(urls, password, cluster, self.redisDriver)
 
     def getRedisClient(self, appkey):
         return self.clients.get(appkey)
+
+    def getRedisPool(self, appkey):
+        return self.pools.get(appkey, self.defaultPool)
+
+    def getBackendPools(self):
+        '''One pool per distinct redis backend, the default backend first'''
+        pools = {self.redisUrls: self.defaultPool}
+        for appkey, (urls, _, _) in self.settings.items():
+            pools.setdefault(urls, self.pools[appkey])
+
+        return pools
+
+    def getPoolsStats(self, reset=True):
+        return {appkey: pool.getStats(reset) for appkey, pool in self.pools.items()}
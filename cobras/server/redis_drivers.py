@@ -0,0 +1,219 @@
+'''Redis drivers
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+The server talks to redis through clients exposing the interface of
+RedisClientRcc: the commands cobra uses (xadd, xread, xrevrange, del,
+ping, pipeline...), with responses converted the rcc way.
+
+* rcc (default): rcc.client.RedisClient, supports redis cluster
+* aioredis: aioredis 1.x connections
+* justredis: the vendored multiplexing client (cobras/server/justredis)
+
+The aioredis and justredis clients only need to implement execute and
+executeMany, and do not support redis cluster.
+Use tools/bench_redis_drivers.py to compare them.
+'''
+
+import abc
+import asyncio
+import time
+from urllib.parse import urlparse
+
+from rcc.response import convertResponse
+
+from cobras.common.task_cleanup import addTaskCleanup
+from cobras.server.latency import recordPipelineLatency, recordRedisLatency
+from cobras.server.rcc_client import RedisClientRcc
+
+REDIS_DRIVER_RCC = 'rcc'
+REDIS_DRIVER_AIOREDIS = 'aioredis'
+REDIS_DRIVER_JUSTREDIS = 'justredis'
+REDIS_DRIVERS = (REDIS_DRIVER_RCC, REDIS_DRIVER_AIOREDIS, REDIS_DRIVER_JUSTREDIS)
+
+
+def makeDriverClient(url, password, cluster, driver=REDIS_DRIVER_RCC):
+    if driver == REDIS_DRIVER_RCC:
+        return RedisClientRcc(url, password, cluster)
+
+    if cluster:
+        raise ValueError(f'the {driver} redis driver does not support redis cluster')
+
+    if driver == REDIS_DRIVER_AIOREDIS:
+        return AioRedisClient(url, password)
+    elif driver == REDIS_DRIVER_JUSTREDIS:
+        return JustRedisClient(url, password)
+    else:
+        raise ValueError(f'unknown redis driver {driver}')
+
+
+class RedisDriverClient(abc.ABC):
+    '''Commands used by cobra, on top of execute and executeMany'''
+
+    def __init__(self, url, password):
+        self.url = url
+        self.password = password
+
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+
+    @abc.abstractmethod
+    async def execute(self, *args):
+        '''Returns the raw response, raise on errors'''
+
+    @abc.abstractmethod
+    async def executeMany(self, commands):
+        '''Send commands in one round trip. Errors are returned in place'''
+
+    @abc.abstractmethod
+    def close(self):
+        pass
+
+    async def send(self, *args):
+        return convertResponse(await self.execute(*args), args[0])
+
+    async def getClientIdForKey(self, key):
+        return await self.send('CLIENT', 'ID')
+
+    async def getHostForKey(self, key):
+        return f'{self.host}:{self.port}'
+
+    async def ping(self):
+        return await self.send('PING')
+
+    makeXaddCommand = staticmethod(RedisClientRcc.makeXaddCommand)
+
+    @recordRedisLatency('xadd')
+    async def xadd(self, stream, field, data, maxLen):
+        return await self.send(*self.makeXaddCommand(stream, field, data, maxLen))
+
+    async def xaddRaw(self, stream, maxLen, *args):
+        return await self.send('XADD', stream, 'MAXLEN', '~', maxLen, b'*', *args)
+
+    async def exists(self, key):
+        return await self.send('EXISTS', key)
+
+    async def xread(self, stream, streamId):
+        return await self.send('XREAD', 'BLOCK', b'0', b'STREAMS', stream, streamId)
+
+    @recordRedisLatency('del')
+    async def delete(self, key):
+        return await self.send('DEL', key)
+
+    @recordRedisLatency('xrevrange')
+    async def xrevrange(self, stream, start, end, count):
+        return await self.send('XREVRANGE', stream, start, end, b'COUNT', count)
+
+    @recordRedisLatency('get')
+    async def get(self, key):
+        return await self.send('GET', key)
+
+    @recordRedisLatency('set')
+    async def set(self, key, value, ttl=None):
+        if ttl:
+            return await self.send('SET', key, value, b'EX', ttl)
+        return await self.send('SET', key, value)
+
+    @recordRedisLatency('hget')
+    async def hget(self, key, field):
+        return await self.send('HGET', key, field)
+
+    async def type(self, key):
+        return await self.send('TYPE', key)
+
+    async def pttl(self, key):
+        return await self.send('PTTL', key)
+
+    async def eval(self, script, keys, args):
+        return await self.send('EVAL', script, len(keys), *keys, *args)
+
+    async def scan(self, cursor, pattern, count):
+        return await self.send('SCAN', cursor, b'MATCH', pattern, b'COUNT', count)
+
+    @recordRedisLatency('pipeline')
+    async def pipeline(self, commands):
+        '''Same as RedisClientRcc.pipeline'''
+        start = time.perf_counter()
+        responses = await self.executeMany(commands)
+
+        # The replies are not timed one by one
+        duration = time.perf_counter() - start
+        for command in commands:
+            recordPipelineLatency(command, duration)
+
+        return [
+            response
+            if isinstance(response, Exception)
+            else convertResponse(response, command[0])
+            for command, response in zip(commands, responses)
+        ]
+
+
+class AioRedisClient(RedisDriverClient):
+    def __init__(self, url, password):
+        super().__init__(url, password)
+        self.connection = None
+        self.lock = None
+
+    async def getConnection(self):
+        # Created lazily, to be bound to the running loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            if self.connection is None or self.connection.closed:
+                import aioredis
+
+                self.connection = await aioredis.create_connection(
+                    self.url, password=self.password
+                )
+
+        return self.connection
+
+    async def execute(self, *args):
+        connection = await self.getConnection()
+        try:
+            return await connection.execute(*args)
+        except asyncio.CancelledError:
+            raise
+        except ConnectionError:
+            self.close()
+            raise
+
+    async def executeMany(self, commands):
+        connection = await self.getConnection()
+
+        # Commands are written right away, and answered in order
+        futures = [connection.execute(*command) for command in commands]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class JustRedisClient(RedisDriverClient):
+    def __init__(self, url, password):
+        super().__init__(url, password)
+
+        from cobras.server.justredis import Multiplexer
+
+        config = {'endpoints': [(self.host, self.port)]}
+        if password:
+            config['password'] = password
+
+        self.multiplexer = Multiplexer(config)
+        self.database = self.multiplexer.database()
+
+    async def execute(self, *args):
+        return await self.database.commandreply(*args)
+
+    async def executeMany(self, commands):
+        futures = [self.database.commandreply(*command) for command in commands]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def close(self):
+        task = asyncio.ensure_future(self.multiplexer.aclose())
+        addTaskCleanup(task)
@@ -0,0 +1,151 @@
+'''Bounded pool of redis clients, for non blocking commands
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+At most size clients are in use at any time, so that a burst of requests
+does not open as many redis connections. Idle clients are re-used, and
+checked with a PING when they have been idle for a while. A client which
+lost its connection, or was cancelled in the middle of a command, is closed
+instead of being put back into the pool. Errors replied by redis, such as
+WRONGTYPE, leave the connection usable.
+
+Usage:
+
+    async with pool.client() as redis:
+        await redis.xrevrange(...)
+'''
+
+import asyncio
+import collections
+import time
+
+import hiredis
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+# Errors after which the connection state is unknown. A cancelled command
+# can leave an unread reply on the connection.
+CONNECTION_ERRORS = (
+    asyncio.CancelledError,
+    asyncio.TimeoutError,
+    EOFError,  # asyncio.IncompleteReadError
+    OSError,  # ConnectionError
+    hiredis.ProtocolError,
+)
+
+
+class PooledClient:
+    '''Async context manager returned by RedisClientPool.client'''
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.redis = None
+
+    async def __aenter__(self):
+        self.redis = await self.pool.acquire()
+        return self.redis
+
+    async def __aexit__(self, excType, exc, tb):
+        healthy = excType is None or not issubclass(excType, CONNECTION_ERRORS)
+        self.pool.release(self.redis, healthy=healthy)
+
+
+class RedisClientPool:
+    def __init__(
+        self,
+        makeRedisClient,
+        size=DEFAULT_POOL_SIZE,
+        healthCheckInterval=DEFAULT_HEALTH_CHECK_INTERVAL,
+    ):
+        self.makeRedisClient = makeRedisClient
+        self.size = size if size > 0 else DEFAULT_POOL_SIZE
+        self.healthCheckInterval = healthCheckInterval
+
+        self.idle = collections.deque()  # (client, last release time)
+        self.opened = 0
+        self.semaphore = None
+
+        # Stats
+        self.waitCount = 0
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+        self.errorCount = 0
+
+    def client(self):
+        return PooledClient(self)
+
+    async def acquire(self):
+        # Created lazily, to be bound to the running loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.size)
+
+        if self.semaphore.locked():
+            start = time.monotonic()
+            await self.semaphore.acquire()
+
+            waitTime = time.monotonic() - start
+            self.waitCount += 1
+            self.waitTime += waitTime
+            self.maxWaitTime = max(self.maxWaitTime, waitTime)
+        else:
+            await self.semaphore.acquire()
+
+        try:
+            return await self.getClient()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    async def getClient(self):
+        while self.idle:
+            # Most recently used first, so that extra clients can age out
+            redis, lastUsed = self.idle.pop()
+
+            if time.monotonic() - lastUsed < self.healthCheckInterval:
+                return redis
+
+            try:
+                await redis.ping()
+                return redis
+            except asyncio.CancelledError:
+                self.discard(redis)
+                raise
+            except Exception:
+                self.discard(redis)
+
+        self.opened += 1
+        return self.makeRedisClient()
+
+    def release(self, redis, healthy=True):
+        if healthy:
+            self.idle.append((redis, time.monotonic()))
+        else:
+            self.errorCount += 1
+            self.discard(redis)
+
+        self.semaphore.release()
+
+    def discard(self, redis):
+        self.opened -= 1
+        redis.close()
+
+    def close(self):
+        while self.idle:
+            redis, _ = self.idle.pop()
+            self.discard(redis)
+
+    def getStats(self, reset=True):
+        '''max_wait_ms is reset on each call, once per stats period'''
+        stats = {
+            'size': self.size,
+            'connections': self.opened,
+            'idle': len(self.idle),
+            'wait_count': self.waitCount,
+            'wait_ms': round(1000 * self.waitTime, 3),
+            'max_wait_ms': round(1000 * self.maxWaitTime, 3),
+            'errors': self.errorCount,
+        }
+        if reset:
+            self.maxWaitTime = 0.0  # max wait time per stats period
+        return stats
@@ -0,0 +1,183 @@
+'''Redis client spreading keys over independent redis instances
+
+Copyright (c) 2020 Machine Zone, Inc. All rights reserved.
+
+Each key (such as an appkey::channel stream) is owned by one node, picked
+with a consistent hash ring. Adding a node only moves the keys that the
+new node takes over, see `cobra shard-plan`.
+
+ShardedRedisClient has the same interface as RedisClientRcc, so it can
+be used anywhere a client is expected. Connections to the nodes are
+opened lazily, as blocking readers only talk to the node owning their
+stream.
+'''
+
+import asyncio
+import collections
+
+from uhashring import HashRing
+
+from cobras.server.rcc_client import RedisClientRcc
+from cobras.server.redis_drivers import REDIS_DRIVER_RCC, makeDriverClient
+
+
+def makeHashRing(urls):
+    return HashRing(nodes=list(urls))
+
+
+def getCommandKey(command):
+    '''The key is the first argument of all the commands we pipeline'''
+    return command[1]
+
+
+class ShardedRedisClient(object):
+    def __init__(self, urls, password, driver=REDIS_DRIVER_RCC):
+        self.urls = list(urls)
+        self.password = password
+        self.driver = driver
+        self.ring = makeHashRing(self.urls)
+        self.nodes = {}
+
+    def getUrlForKey(self, key):
+        return self.ring.get_node(key)
+
+    def getNode(self, url):
+        node = self.nodes.get(url)
+        if node is None:
+            node = makeDriverClient(url, self.password, False, self.driver)
+            self.nodes[url] = node
+
+        return node
+
+    def getNodeForKey(self, key):
+        return self.getNode(self.getUrlForKey(key))
+
+    def close(self):
+        for node in self.nodes.values():
+            node.close()
+
+    async def getClientIdForKey(self, key):
+        return await self.getNodeForKey(key).getClientIdForKey(key)
+
+    async def getHostForKey(self, key):
+        return await self.getNodeForKey(key).getHostForKey(key)
+
+    async def ping(self):
+        '''Every node has to be reachable'''
+        for url in self.urls:
+            response = await self.getNode(url).ping()
+        return response
+
+    makeXaddCommand = staticmethod(RedisClientRcc.makeXaddCommand)
+
+    async def xadd(self, stream, field, data, maxLen):
+        return await self.getNodeForKey(stream).xadd(stream, field, data, maxLen)
+
+    async def xaddRaw(self, stream, maxLen, *args):
+        return await self.getNodeForKey(stream).xaddRaw(stream, maxLen, *args)
+
+    async def exists(self, key):
+        return await self.getNodeForKey(key).exists(key)
+
+    async def xread(self, stream, streamId):
+        return await self.getNodeForKey(stream).xread(stream, streamId)
+
+    async def delete(self, key):
+        return await self.getNodeForKey(key).delete(key)
+
+    async def xrevrange(self, stream, start, end, count):
+        node = self.getNodeForKey(stream)
+        return await node.xrevrange(stream, start, end, count)
+
+    async def get(self, key):
+        return await self.getNodeForKey(key).get(key)
+
+    async def set(self, key, value, ttl=None):
+        return await self.getNodeForKey(key).set(key, value, ttl)
+
+    async def hget(self, key, field):
+        return await self.getNodeForKey(key).hget(key, field)
+
+    async def type(self, key):
+        return await self.getNodeForKey(key).type(key)
+
+    async def pttl(self, key):
+        return await self.getNodeForKey(key).pttl(key)
+
+    async def eval(self, script, keys, args):
+        '''keys must live on the same node'''
+        return await self.getNodeForKey(keys[0]).eval(script, keys, args)
+
+    async def scan(self, cursor, pattern, count):
+        '''Scan the nodes one after the other. The cursor is made of the
+        index of the node being scanned, and of the cursor of that node,
+        as in b'1:1536'. b'0' is returned once the last node is done.
+        '''
+        cursor = cursor.decode() if isinstance(cursor, bytes) else str(cursor)
+        index, _, nodeCursor = cursor.partition(':')
+        index = int(index)
+        nodeCursor = nodeCursor or '0'
+
+        nodeCursor, keys = await self.getNode(self.urls[index]).scan(
+            nodeCursor, pattern, count
+        )
+        nodeCursor = nodeCursor.decode()
+
+        if nodeCursor == '0':
+            index += 1
+            if index == len(self.urls):
+                return b'0', keys
+
+        return f'{index}:{nodeCursor}'.encode(), keys
+
+    async def pipeline(self, commands):
+        '''Same as RedisClientRcc.pipeline. The nodes are sent their commands
+        concurrently. When a node cannot be reached, its error is returned
+        for each of its commands, and raised if no node could be reached.
+        '''
+        groups = collections.OrderedDict()
+        for i, command in enumerate(commands):
+            url = self.getUrlForKey(getCommandKey(command))
+            groups.setdefault(url, []).append(i)
+
+        nodeResults = await asyncio.gather(
+            *[
+                self.getNode(url).pipeline([commands[i] for i in indexes])
+                for url, indexes in groups.items()
+            ],
+            return_exceptions=True,
+        )
+
+        errors = [r for r in nodeResults if isinstance(r, BaseException)]
+        for error in errors:
+            if isinstance(error, asyncio.CancelledError):
+                raise error
+
+        if errors and len(errors) == len(nodeResults):
+            raise errors[0]
+
+        results = [None] * len(commands)
+        for indexes, nodeResult in zip(groups.values(), nodeResults):
+            for j, i in enumerate(indexes):
+                if isinstance(nodeResult, BaseException):
+                    results[i] = nodeResult
+                else:
+                    results[i] = nodeResult[j]
+
+        return results
+
+
+def planMoves(keysByUrl, newUrls):
+    '''Returns the keys which change node when the ring becomes newUrls,
+    as a dict (source url, destination url) -> keys
+    '''
+    ring = makeHashRing(newUrls)
+    moves = collections.defaultdict(list)
+
+    for url, keys in keysByUrl.items():
+        for key in keys:
+            newUrl = ring.get_node(key)
+            if newUrl != url:
+                moves[(url, newUrl)].append(key)
+
+    return moves
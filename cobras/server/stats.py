@@ -14,14 +14,50 @@ import time
 import logging
 import sys
 
+from cobras.common.counters import CounterRegistry
 from cobras.common.memory_usage import getContainerMemoryLimit, getProcessUsedMemory
+from cobras.common.top_k import TopK
+from cobras.server.latency import getLatencies, resetLatencies
 
 DEFAULT_STATS_CHANNEL = '/stats'
+DEFAULT_CHANNEL_STATS_TOP_K = 100
+
+METRICS = (
+    'published_count',
+    'published_bytes',
+    'subscribed_count',
+    'subscribed_bytes',
+    'reads_count',
+    'reads_bytes',
+    'writes_count',
+    'writes_bytes',
+)
+
+# Index of the count of each metric, its bytes are right after
+PUBLISHED = METRICS.index('published_count')
+SUBSCRIBED = METRICS.index('subscribed_count')
+READS = METRICS.index('reads_count')
+WRITES = METRICS.index('writes_count')
 
 
 class ServerStats:
-    def __init__(self, redis, appkey):
+    def __init__(
+        self,
+        redis,
+        appkey,
+        redisClients=None,
+        readCache=None,
+        checkpoints=None,
+        channelStatsTopK=DEFAULT_CHANNEL_STATS_TOP_K,
+        consumerLag=None,
+        loopLag=None,
+    ):
         self.redis = redis
+        self.redisClients = redisClients
+        self.readCache = readCache
+        self.checkpoints = checkpoints
+        self.consumerLag = consumerLag
+        self.loopLag = loopLag
 
         self.node = platform.uname().node
         self.connectionCount = 0
@@ -32,23 +68,23 @@ class ServerStats:
         self.internalAppKey = appkey
         self.statsChannel = DEFAULT_STATS_CHANNEL
 
-        self.publishedCount = collections.defaultdict(int)
-        self.publishedBytes = collections.defaultdict(int)
-        self.subscribedCount = collections.defaultdict(int)
-        self.subscribedBytes = collections.defaultdict(int)
+        # Per role counters, the count and bytes of a metric are contiguous.
+        # The update functions are called for every message.
+        self.counters = CounterRegistry(METRICS)
+        self.updatePublished = self.counters.makeUpdater(PUBLISHED)
+        self.updateSubscribed = self.counters.makeUpdater(SUBSCRIBED)
+        self.updateReads = self.counters.makeUpdater(READS)
+        self.updateWrites = self.counters.makeUpdater(WRITES)
         self.subscriptions = collections.defaultdict(int)
 
-        self.readsCount = collections.defaultdict(int)
-        self.readsBytes = collections.defaultdict(int)
-        self.writesCount = collections.defaultdict(int)
-        self.writesBytes = collections.defaultdict(int)
+        # There can be millions of channels, only the top ones are reported.
+        # Also called for every message.
+        self.channelStatsTopK = channelStatsTopK
+        self.publishedByChannel = TopK(channelStatsTopK)
+        self.subscribedByChannel = TopK(channelStatsTopK)
+        self.updateChannelPublished = self.publishedByChannel.update
+        self.updateChannelSubscribed = self.subscribedByChannel.update
 
-        self.publishedCountByChannel = collections.defaultdict(int)
-        self.publishedBytesByChannel = collections.defaultdict(int)
-        self.subscribedCountByChannel = collections.defaultdict(int)
-        self.subscribedBytesByChannel = collections.defaultdict(int)
-
-        self.resetCounterByPeriod()
         self.start = time.time()
 
         pid = os.getpid()
@@ -70,62 +106,68 @@ class ServerStats:
         self.subscriptions[role] -= subscriptionsCount
 
     def resetCounterByPeriod(self):
-        self.publishedCountByPeriod = collections.defaultdict(int)
-        self.publishedBytesByPeriod = collections.defaultdict(int)
-        self.subscribedCountByPeriod = collections.defaultdict(int)
-        self.subscribedBytesByPeriod = collections.defaultdict(int)
+        resetLatencies()
+
+        if self.loopLag is not None:
+            self.loopLag.reset()
 
-        self.readsCountByPeriod = collections.defaultdict(int)
-        self.readsBytesByPeriod = collections.defaultdict(int)
-        self.writesCountByPeriod = collections.defaultdict(int)
-        self.writesBytesByPeriod = collections.defaultdict(int)
+        self.publishedByChannel.endPeriod()
+        self.subscribedByChannel.endPeriod()
 
-        self.publishedCountByChannelByPeriod = collections.defaultdict(int)
-        self.publishedBytesByChannelByPeriod = collections.defaultdict(int)
-        self.subscribedCountByChannelByPeriod = collections.defaultdict(int)
-        self.subscribedBytesByChannelByPeriod = collections.defaultdict(int)
+    def getRoleData(self):
+        '''published_count, published_count_per_second, ... by role'''
+        data = {}
+        for metric in METRICS:
+            data[metric] = self.counters.getValues(metric)
 
-    def updatePublished(self, role, val):
-        self.publishedCount[role] += 1
-        self.publishedBytes[role] += val
+        for metric in METRICS:
+            data[metric + '_per_second'] = self.counters.getPeriodValues(metric)
 
-        self.publishedCountByPeriod[role] += 1
-        self.publishedBytesByPeriod[role] += val
+        return data
 
-    def updateChannelPublished(self, channel, val):
-        self.publishedCountByChannel[channel] += 1
-        self.publishedBytesByChannel[channel] += val
+    def getPoolsStats(self, reset=True):
+        if self.redisClients is None:
+            return {}
 
-        self.publishedCountByChannelByPeriod[channel] += 1
-        self.publishedBytesByChannelByPeriod[channel] += val
+        return self.redisClients.getPoolsStats(reset)
 
-    def updateSubscribed(self, role, val):
-        self.subscribedCount[role] += 1
-        self.subscribedBytes[role] += val
+    def getSystemData(self, poolsStats):
+        '''Connections, memory, tasks, and the stats of the other components'''
+        uptime = time.time() - self.start
+        uptimeMinutes = uptime // 60
+        uptime = str(datetime.timedelta(seconds=uptime))
+        uptime, _, _ = uptime.partition('.')  # skip the milliseconds part
 
-        self.subscribedCountByPeriod[role] += 1
-        self.subscribedBytesByPeriod[role] += val
+        if sys.version_info[:2] < (3, 7):
+            tasks = asyncio.Task.all_tasks()
+        else:
+            tasks = asyncio.all_tasks()
 
-    def updateChannelSubscribed(self, channel, val):
-        self.subscribedCountByChannel[channel] += 1
-        self.subscribedBytesByChannel[channel] += val
+        systemData = {
+            'connections': self.connectionCount,
+            'mem_bytes': getProcessUsedMemory(),
+            'container_memory_limit_bytes': getContainerMemoryLimit(),
+            'uptime': uptime,
+            'uptime_minutes': uptimeMinutes,
+            'tasks': len(tasks),
+            'idle_connections': self.idleConnections,
+            'redis_pool_waits': sum(pool['wait_count'] for pool in poolsStats.values()),
+            'redis_pool_wait_ms': sum(pool['wait_ms'] for pool in poolsStats.values()),
+        }
 
-        self.subscribedCountByChannelByPeriod[channel] += 1
-        self.subscribedBytesByChannelByPeriod[channel] += val
+        if self.readCache is not None:
+            systemData.update(self.readCache.getStats())
 
-    def updateReads(self, role, val):
-        self.readsCount[role] += 1
-        self.readsBytes[role] += val
+        if self.checkpoints is not None:
+            systemData.update(self.checkpoints.getStats())
 
-        self.readsCountByPeriod[role] += 1
-        self.readsBytesByPeriod[role] += val
+        if self.consumerLag is not None:
+            systemData.update(self.consumerLag.getStats())
 
-    def updateWrites(self, role, val):
-        self.writesCount[role] += 1
-        self.writesBytes[role] += val
+        if self.loopLag is not None:
+            systemData.update(self.loopLag.getStats())
 
-        self.writesCountByPeriod[role] += 1
-        self.writesBytesByPeriod[role] += val
+        return systemData
 
     async def run(self):
         while True:
@@ -133,72 +175,37 @@ class ServerStats:
             # to ease the job of aggregating them in the monitor command
             cobraData = {'subscriptions': self.subscriptions}
 
-            cobraData.update(
-                {
-                    'published_count': self.publishedCount,
-                    'published_bytes': self.publishedBytes,
-                    'published_count_per_second': self.publishedCountByPeriod,
-                    'published_bytes_per_second': self.publishedBytesByPeriod,
-                }
-            )
-
-            cobraData.update(
-                {
-                    'subscribed_count': self.subscribedCount,
-                    'subscribed_bytes': self.subscribedBytes,
-                    'subscribed_count_per_second': self.subscribedCountByPeriod,
-                    'subscribed_bytes_per_second': self.subscribedBytesByPeriod,
-                }
-            )
-
-            cobraData.update(
-                {
-                    'reads_count': self.readsCount,
-                    'reads_bytes': self.readsBytes,
-                    'reads_count_per_second': self.readsCountByPeriod,
-                    'reads_bytes_per_second': self.readsBytesByPeriod,
-                }
-            )
-
-            cobraData.update(
-                {
-                    'writes_count': self.writesCount,
-                    'writes_bytes': self.writesBytes,
-                    'writes_count_per_second': self.writesCountByPeriod,
-                    'writes_bytes_per_second': self.writesBytesByPeriod,
-                }
-            )
+            self.counters.endPeriod()
+            cobraData.update(self.getRoleData())
+
+            # Lag of the subscriptions, from the last sample
+            if self.consumerLag is not None:
+                lagMessages, lagMaxMs = self.consumerLag.getLagsBy('role')
+                cobraData['lag_messages'] = lagMessages
+                cobraData['lag_max_ms'] = lagMaxMs
 
             # Channel data
             channelData = {}
 
-            channelData.update(
-                {
-                    'published_count': self.publishedCountByChannel,
-                    'published_bytes': self.publishedBytesByChannel,
-                    'published_count_per_second': self.publishedCountByChannelByPeriod,
-                    'published_bytes_per_second': self.publishedBytesByChannelByPeriod,
-                }
-            )
-
-            channelData.update(
-                {
-                    'subscribed_count': self.subscribedCountByChannel,
-                    'subscribed_bytes': self.subscribedBytesByChannel,
-                    'subscribed_count_per_second': self.subscribedCountByChannelByPeriod,  # noqa
-                    'subscribed_bytes_per_second': self.subscribedBytesByChannelByPeriod,  # noqa
-                }
-            )
-
-            uptime = time.time() - self.start
-            uptimeMinutes = uptime // 60
-            uptime = str(datetime.timedelta(seconds=uptime))
-            uptime, _, _ = uptime.partition('.')  # skip the milliseconds part
-
-            if sys.version_info[:2] < (3, 7):
-                tasks = asyncio.Task.all_tasks()
-            else:
-                tasks = asyncio.all_tasks()
+            for name, topK in (
+                ('published', self.publishedByChannel),
+                ('subscribed', self.subscribedByChannel),
+            ):
+                for field in ('count', 'bytes'):
+                    channelData[f'{name}_{field}'] = topK.top(field)
+                    channelData[f'{name}_{field}_per_second'] = topK.top(
+                        field, period=True
+                    )
+
+            if self.consumerLag is not None:
+                lagMessages, lagMaxMs = self.consumerLag.getLagsBy(
+                    'channel', skipIdle=True
+                )
+                channelData['lag_messages'] = lagMessages
+                channelData['lag_max_ms'] = lagMaxMs
+
+            poolsStats = self.getPoolsStats()
+            systemData = self.getSystemData(poolsStats)
 
             message = {
                 'node': self.node,
@@ -206,15 +213,9 @@ class ServerStats:
                 'data': {
                     'cobra': cobraData,
                     'channel_data': channelData,
-                    'system': {
-                        'connections': self.connectionCount,
-                        'mem_bytes': getProcessUsedMemory(),
-                        'container_memory_limit_bytes': getContainerMemoryLimit(),  # noqa
-                        'uptime': uptime,
-                        'uptime_minutes': uptimeMinutes,
-                        'tasks': len(tasks),
-                        'idle_connections': self.idleConnections,
-                    },
+                    'system': systemData,
+                    'latencies': getLatencies(),
+                    'redis_pools': poolsStats,
                 },
             }
 
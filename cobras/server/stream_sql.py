@@ -1,11 +1,26 @@
 '''Stream SQL processor, to filter and transform messages when subcribing.
 
 Copyright (c) 2018-2019 Machine Zone, Inc. All rights reserved.
+
+Aggregations are supported over tumbling windows, such as
+SELECT device.game, count(*), sum(data.size) AS size FROM chan
+WHERE ... GROUP BY device.game WINDOW TUMBLING(5s)
+The matching messages are then accumulated by a StreamSqlAggregator,
+which produces one row per group at the end of each window.
+
+A parsed filter is compiled into a python function specialised for its
+WHERE conditions and SELECT fields, so that matching a message does not
+have to walk and dispatch on the parsed expressions. The original
+interpreter is kept around (StreamSqlFilter.interpret) as a reference
+implementation, see tools/bench_stream_sql.py.
 '''
 
 import collections
 import fnmatch
+import functools
+import json
 import logging
+import re
 
 from cobras.common.algorithm import extractAttributeFromDict
 
@@ -24,10 +39,48 @@ StreamSQLExpression = collections.namedtuple(
 )
 
 
+AGGREGATE_FUNCTIONS = ('count', 'sum')
+
+AGGREGATE_RE = re.compile(r'^(\w+)\((.+)\)$')
+GROUP_BY_RE = re.compile(r'\s+GROUP\s+BY\s+(.+?)\s*$', re.IGNORECASE | re.DOTALL)
+WINDOW_RE = re.compile(
+    r'\s+WINDOW\s+TUMBLING\s*\(\s*(\d+(?:\.\d+)?)\s*(ms|s|m)?\s*\)\s*$', re.IGNORECASE,
+)
+WINDOW_UNITS = {'ms': 0.001, 's': 1, 'm': 60}
+
+StreamSQLAggregate = collections.namedtuple(
+    'StreamSQLAggregate', ['function', 'components', 'alias']
+)
+
+
 class InvalidStreamSQLError(Exception):
     pass
 
 
+def parseAggregationClauses(sql_filter):
+    '''Strip the trailing GROUP BY and WINDOW clauses
+
+    Returns the remaining statement, the window duration in seconds (or None)
+    and the list of group by fields
+    '''
+    window = None
+    match = WINDOW_RE.search(sql_filter)
+    if match is not None:
+        duration, unit = match.groups()
+        window = float(duration) * WINDOW_UNITS[(unit or 's').lower()]
+        if window <= 0:
+            raise InvalidStreamSQLError('Invalid window duration')
+        sql_filter = sql_filter[: match.start()]
+
+    groupBy = []
+    match = GROUP_BY_RE.search(sql_filter)
+    if match is not None:
+        groupBy = [field.strip() for field in match.group(1).split(',')]
+        sql_filter = sql_filter[: match.start()]
+
+    return sql_filter, window, groupBy
+
+
 class StreamSqlFilter:
     def __init__(self, sql_filter):
         '''
@@ -36,13 +89,22 @@ class StreamSqlFilter:
 
         No parenthesis support
         '''
+        self.parse(sql_filter)
+        self.compiledMatch = self.compile()
 
+    def parse(self, sql_filter):
         self.emptyFilter = False
         self.channel = None
+        self.expressions = []
+        self.andExpr = True
+        self.aggregates = []
+        self.groupBy = []
 
         if sql_filter is None:
             raise InvalidStreamSQLError()
 
+        sql_filter, self.window, groupBy = parseAggregationClauses(sql_filter)
+
         # Basic validation
         tokens = [token.strip() for token in sql_filter.split()]
 
@@ -79,6 +141,8 @@ class StreamSqlFilter:
                     alias = field
                 self.fields.append((field, alias))
 
+        self.parseAggregates(groupBy)
+
         # Parse channel name
         channelIdx = fromIdx + 1
         self.channel = tokens[channelIdx].replace('`', '')
@@ -112,6 +176,121 @@ class StreamSqlFilter:
         else:
             self.expressions = [self.buildExpression(sql_filter)]
 
+    def parseAggregates(self, groupBy):
+        '''Split the selected fields into aggregates and group by fields'''
+        aggregates = []
+        fields = []
+        for field, alias in self.fields or []:
+            match = AGGREGATE_RE.match(field)
+            if match is None:
+                fields.append((field, alias))
+                continue
+
+            function, argument = match.groups()
+            function = function.lower()
+            argument = argument.strip()
+            if function not in AGGREGATE_FUNCTIONS:
+                raise InvalidStreamSQLError(f'Unsupported function {function}')
+
+            if argument == '*':
+                if function != 'count':
+                    raise InvalidStreamSQLError(f'Invalid argument for {function}')
+                components = None
+            else:
+                components = tuple(argument.split('.'))
+
+            aggregates.append(StreamSQLAggregate(function, components, alias))
+
+        if not aggregates:
+            if self.window is not None or groupBy:
+                raise InvalidStreamSQLError('WINDOW and GROUP BY require aggregates')
+            return
+
+        if self.window is None:
+            raise InvalidStreamSQLError('Aggregates require a WINDOW clause')
+
+        aliases = dict(fields)
+        for field, alias in fields:
+            if field not in groupBy:
+                raise InvalidStreamSQLError(f'{field} must appear in GROUP BY')
+
+        self.aggregates = aggregates
+        self.groupBy = [(field, aliases.get(field, field)) for field in groupBy]
+
+        # Matching messages are passed as is to the aggregator
+        self.fields = None
+
+    def compile(self):
+        '''Generate the source code of a function which evaluates the
+        conditions and returns the (projected) message, or False
+        '''
+        lines = ['def compiledMatch(msg):']
+        env = {}
+
+        if not self.emptyFilter:
+            conditions = [
+                self.compileExpression(expression, i, env)
+                for i, expression in enumerate(self.expressions)
+            ]
+            op = ' and ' if self.andExpr else ' or '
+            lines.append(f'    if not ({op.join(conditions)}):')
+            lines.append('        return False')
+
+        if self.fields is None:
+            lines.append('    return msg')
+        else:
+            items = []
+            for i, (field, alias) in enumerate(self.fields):
+                lines.extend(self.compileExtraction(field, f'field{i}'))
+                items.append(f'{alias!r}: field{i}')
+
+            lines.append('    return {' + ', '.join(items) + '}')
+
+        code = compile('\n'.join(lines), f'<stream_sql {self.channel}>', 'exec')
+        exec(code, env)
+        return env['compiledMatch']
+
+    def compileExpression(self, expression, idx, env):
+        # Same lookups as matchExpression, including the default values
+        components = expression.components
+        if expression.length <= 2:
+            default = ', {}' if expression.length == 2 else ''
+            val = f'msg.get({components[0]!r}{default})'
+            if expression.length == 2:
+                val += f'.get({components[1]!r})'
+        else:
+            val = 'msg'
+            for component in components:
+                val += f'.get({component!r}, {{}})'
+
+        if expression.equalExpression:
+            return f'({expression.val!r} == {val})'
+        elif expression.likeExpression:
+            # fnmatch.fnmatch without the per call normcase and cache lookup
+            like = f'like{idx}'
+            env[like] = re.compile(fnmatch.translate(expression.val)).match
+            return f'({like}({val}) is not None)'
+        elif expression.differentExpression:
+            return f'({expression.val!r} != {val})'
+        elif expression.largerThanExpression:
+            return f'({val} > {expression.val!r})'
+        elif expression.lowerThanExpression:
+            return f'({val} < {expression.val!r})'
+        else:
+            assert False, 'unexpected expression'
+
+    def compileExtraction(self, field, var):
+        '''Inlined version of extractAttributeFromDict'''
+        lines = [f'    {var} = msg']
+        indent = '    '
+        for i, component in enumerate(field.split('.')):
+            if i > 0:
+                lines.append(f'{indent}if {var} is not None:')
+                indent += '    '
+            lines.append(f'{indent}{var} = {var}.get({component!r}, {{}})')
+
+        return lines
+
     def buildExpression(self, text):
         '''
         FIXME: support lower than and greater than for ints
@@ -170,6 +349,23 @@ class StreamSqlFilter:
             lowerThanExpression,
         )
 
+    def getIndexKey(self):
+        '''Returns the (components, value) of an equality predicate which
+        must hold for a message to match, or None if there is no such
+        predicate (OR expressions for example).
+        '''
+        if self.emptyFilter:
+            return None
+
+        if not self.andExpr and len(self.expressions) > 1:
+            return None
+
+        for expression in self.expressions:
+            if expression.equalExpression:
+                return (tuple(expression.components), expression.val)
+
+        return None
+
     def matchExpression(self, msg, expression):
         if expression.length == 2:
             val = msg.get(expression.components[0], {}).get(
@@ -202,6 +398,24 @@ class StreamSqlFilter:
             assert False, 'unexpected expression'
 
     def match(self, msg):
+        if self.emptyFilter:
+            return self.compiledMatch(msg)
+
+        if isinstance(msg, list):
+            if len(msg) == 0:
+                logging.error('Bad type for {}, expecting non empty list'.format(msg))
+                return False
+            else:
+                msg = msg[0]
+
+        if not isinstance(msg, dict):
+            logging.error('Bad type for {}, expecting dictionary'.format(msg))
+            return False
+
+        return self.compiledMatch(msg)
+
+    def interpret(self, msg):
+        '''Reference implementation of match'''
         if self.emptyFilter:
             return self.transform(msg)
 
@@ -245,9 +459,175 @@ class StreamSqlFilter:
         return ret
 
 
+def extractGroupValue(msg, components):
+    '''Missing fields are grouped under None'''
+    for component in components:
+        if not isinstance(msg, dict):
+            return None
+        msg = msg.get(component)
+
+    return msg
+
+
+class StreamSqlAggregator:
+    '''Accumulate the messages matched by an aggregation filter during a window.
+    Each subscription has its own aggregator, while filters are shared.
+    '''
+
+    def __init__(self, streamSqlFilter):
+        self.window = streamSqlFilter.window
+        self.aggregates = streamSqlFilter.aggregates
+        self.groupBy = [
+            (tuple(field.split('.')), alias) for field, alias in streamSqlFilter.groupBy
+        ]
+
+        self.groups = {}
+        self.position = None
+
+    def add(self, msg, position=None):
+        if position is not None:
+            self.position = position
+
+        values = [extractGroupValue(msg, components) for components, _ in self.groupBy]
+        try:
+            key = tuple(values)
+            row = self.groups.get(key)
+        except TypeError:
+            # dict or list used as a group value
+            key = json.dumps(values, sort_keys=True)
+            row = self.groups.get(key)
+
+        if row is None:
+            row = {alias: val for (_, alias), val in zip(self.groupBy, values)}
+            for aggregate in self.aggregates:
+                row[aggregate.alias] = 0
+            self.groups[key] = row
+
+        for aggregate in self.aggregates:
+            if aggregate.components is None:
+                row[aggregate.alias] += 1
+                continue
+
+            val = extractGroupValue(msg, aggregate.components)
+            if aggregate.function == 'count':
+                if val is not None:
+                    row[aggregate.alias] += 1
+            elif isinstance(val, (int, float)) and not isinstance(val, bool):
+                row[aggregate.alias] += val
+
+    def flush(self):
+        '''Returns the rows of the window which just ended'''
+        rows = list(self.groups.values())
+        self.groups = {}
+        return rows
+
+
+def extractIndexedValue(msg, components):
+    '''Same lookups as the compiled match functions'''
+    if len(components) == 1:
+        return msg.get(components[0])
+    elif len(components) == 2:
+        return msg.get(components[0], {}).get(components[1])
+    else:
+        for component in components:
+            msg = msg.get(component, {})
+        return msg
+
+
+class StreamSqlIndex:
+    '''Index the filters of the subscribers of a channel by one of their
+    equality predicates, so that a message is only handed to the subscribers
+    which can match it. The values of each indexed field are extracted once
+    per message, then each subscriber evaluates its whole filter as usual.
+    '''
+
+    def __init__(self):
+        # components -> value -> subscribers (dicts used as ordered sets)
+        self.indexed = {}
+        self.unindexed = {}
+        self.keys = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, subscriber, key=None):
+        self.keys[subscriber] = key
+
+        if key is None:
+            self.unindexed[subscriber] = None
+            return
+
+        components, val = key
+        values = self.indexed.setdefault(components, {})
+        values.setdefault(val, {})[subscriber] = None
+
+    def remove(self, subscriber):
+        if subscriber not in self.keys:
+            return
+
+        key = self.keys.pop(subscriber)
+        if key is None:
+            del self.unindexed[subscriber]
+            return
+
+        components, val = key
+        values = self.indexed[components]
+        subscribers = values[val]
+        del subscribers[subscriber]
+
+        if not subscribers:
+            del values[val]
+            if not values:
+                del self.indexed[components]
+
+    def getCandidates(self, msg):
+        '''msg is what the filters are evaluated against, which is
+        the first item for lists, like in StreamSqlFilter.match
+        '''
+        if not self.indexed:
+            return list(self.unindexed)
+
+        if isinstance(msg, list) and len(msg) > 0:
+            msg = msg[0]
+
+        if not isinstance(msg, dict):
+            # Let the filters deal with (and report) invalid messages
+            return list(self.keys)
+
+        candidates = list(self.unindexed)
+
+        for components, values in self.indexed.items():
+            try:
+                val = extractIndexedValue(msg, components)
+            except AttributeError:
+                # Let the filters deal with (and report) bad message structures
+                for subscribers in values.values():
+                    candidates.extend(subscribers)
+                continue
+
+            try:
+                subscribers = values.get(val)
+            except TypeError:
+                # unhashable values (dict, list) never equal the scalar literals
+                continue
+
+            if subscribers:
+                candidates.extend(subscribers)
+
+        return candidates
+
+
+@functools.lru_cache(maxsize=1024)
+def getStreamSqlFilter(sql_filter):
+    '''Filters are immutable once compiled, so subscriptions using
+    the same filter share the same instance.
+    '''
+    return StreamSqlFilter(sql_filter)
+
+
 def match_stream_sql_filter(sql_filter, msg):
     try:
-        f = StreamSqlFilter(sql_filter)
+        f = getStreamSqlFilter(sql_filter)
         return f.match(msg)
     except InvalidStreamSQLError:
         return False
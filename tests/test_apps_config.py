@@ -4,7 +4,9 @@ import os
 
 import pytest
 
-from cobras.common.apps_config import AppsConfig
+from cobras.common.apps_config import CHECKPOINT_KEY_PREFIX, AppsConfig
+from cobras.server.redis_clients import RedisClients
+from cobras.server.sharded_redis_client import ShardedRedisClient
 
 
 def test_answer():
@@ -57,6 +59,47 @@ def test_get_roles_and_secret():
     assert secret == 'e3Ae82633cd59b22daea958bbb82ac92'
 
 
+def test_redis_backends():
+    root = os.path.dirname(os.path.realpath(__file__))
+    dataDir = os.path.join(root, 'test_data', 'apps_config')
+    path = os.path.join(dataDir, 'apps.yaml')
+
+    appsConfig = AppsConfig(path)
+
+    appkey = 'eeeeeeeeeeeeeeeeffffffffffffffff'
+    urls = 'redis://sms-redis-1;redis://sms-redis-2'
+    assert appsConfig.getRedisUrls(appkey) == urls
+    assert appsConfig.getRedisPassword(appkey) == 'foobared'
+    assert not appsConfig.isRedisCluster(appkey)
+    assert appsConfig.getRedisUrls('_health') is None
+
+    # Apps without redis_urls use the command line urls
+    redisClients = RedisClients('redis://localhost', None, False, appsConfig)
+    assert redisClients.getRedisSettings(appkey) == (urls, 'foobared', False)
+    assert redisClients.getRedisSettings('_health') == (
+        'redis://localhost',
+        None,
+        False,
+    )
+
+    redis = redisClients.getRedisClient(appkey)
+    assert isinstance(redis, ShardedRedisClient)
+    assert redis.password == 'foobared'
+    assert redisClients.getRedisClient('_health').url == 'redis://localhost'
+
+    assert list(redisClients.getBackendPools()) == ['redis://localhost', urls]
+
+    appsConfig.apps[appkey]['redis_urls'] = ['redis://sms-redis-1']
+    with pytest.raises(ValueError):
+        appsConfig.validateConfig()
+
+    # Checkpoint keys would collide with the keys of that app
+    appsConfig.apps[appkey]['redis_urls'] = urls
+    appsConfig.apps[CHECKPOINT_KEY_PREFIX] = appsConfig.apps.pop(appkey)
+    with pytest.raises(ValueError):
+        appsConfig.validateConfig()
+
+
 def test_empty_apps_file():
     appsConfig = AppsConfig('')
     assert not appsConfig.isAppKeyValid('ASDCSDC')
@@ -0,0 +1,79 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import uuid
+
+from cobras.server.checkpoints import Checkpoints, getCheckpointKey
+from cobras.server.rcc_client import RedisClientRcc
+from cobras.server.redis_pool import RedisClientPool
+
+
+class FakeRedisClients:
+    def __init__(self, makeRedisClient):
+        self.pool = RedisClientPool(makeRedisClient)
+
+    def getRedisPool(self, appkey):
+        return self.pool
+
+
+class BrokenRedis:
+    async def pipeline(self, commands):
+        raise ConnectionError('cannot connect to redis')
+
+    def close(self):
+        pass
+
+
+async def checkpointsCoroutine():
+    redisClients = FakeRedisClients(
+        lambda: RedisClientRcc('redis://localhost', None, False)
+    )
+    checkpoints = Checkpoints(redisClients)
+
+    appkey = 'test_checkpoints_' + uuid.uuid4().hex[:8]
+    assert await checkpoints.get(appkey, 'sub') is None
+
+    # Only the last position of a subscription is written
+    checkpoints.update(appkey, 'sub', '1-0')
+    checkpoints.update(appkey, 'sub', '2-0')
+    checkpoints.update(appkey, 'other', '3-0')
+    assert await checkpoints.get(appkey, 'sub') == '2-0'
+
+    await checkpoints.flush()
+    stats = checkpoints.getStats()
+    assert stats['checkpoints_pending'] == 0
+    assert stats['checkpoints_flushed'] == 2
+
+    # Read back from redis
+    checkpoints = Checkpoints(redisClients)
+    assert await checkpoints.get(appkey, 'sub') == '2-0'
+    assert await checkpoints.get(appkey, 'other') == '3-0'
+
+    # Failed writes are retried, without overwriting newer positions
+    checkpoints.redisClients = FakeRedisClients(BrokenRedis)
+    checkpoints.update(appkey, 'sub', '4-0')
+
+    await checkpoints.flush()
+    checkpoints.update(appkey, 'other', '5-0')
+
+    stats = checkpoints.getStats()
+    assert stats['checkpoints_pending'] == 2
+    assert stats['checkpoints_errors'] == 1
+
+    checkpoints.redisClients = redisClients
+    await checkpoints.flush()
+
+    checkpoints = Checkpoints(redisClients)
+    assert await checkpoints.get(appkey, 'sub') == '4-0'
+    assert await checkpoints.get(appkey, 'other') == '5-0'
+
+    # Outside of the keys of the channels of the app
+    key = getCheckpointKey(appkey, 'sub')
+    assert not key.startswith(f'{appkey}::')
+
+    redis = RedisClientRcc('redis://localhost', None, False)
+    assert await redis.get(key) == b'4-0'
+
+
+def test_checkpoints():
+    asyncio.get_event_loop().run_until_complete(checkpointsCoroutine())
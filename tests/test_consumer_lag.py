@@ -0,0 +1,172 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import os
+import types
+
+import pytest
+from cobras.client.connection import ActionException, ActionFlow, Connection
+from cobras.client.credentials import (
+    createCredentials,
+    getDefaultRoleForApp,
+    getDefaultSecretForApp,
+)
+from cobras.client.health_check import getDefaultHealthCheckUrl
+from cobras.server.consumer_lag import MAX_MESSAGE_LAG, ConsumerLag, getStreamIdMs
+from cobras.server.memory_redis_client import MemoryRedisClient
+from cobras.server.redis_pool import RedisClientPool
+
+from .test_utils import makeRunner, makeUniqueString
+
+
+@pytest.fixture()
+def runner():
+    runner, appsConfigPath = makeRunner(debugMemory=False)
+    yield runner
+
+    runner.terminate()
+    os.unlink(appsConfigPath)
+
+
+class PipelineCountingRedisClient(MemoryRedisClient):
+    pipelineCount = 0
+
+    async def pipeline(self, commands):
+        PipelineCountingRedisClient.pipelineCount += 1
+        return await super().pipeline(commands)
+
+
+class FakeRedisClients:
+    def __init__(self, url):
+        self.pool = RedisClientPool(lambda: PipelineCountingRedisClient(url))
+
+    def getRedisPool(self, appkey):
+        return self.pool
+
+
+class FakeHandler:
+    def __init__(self, channel, role):
+        self.channel = channel
+        self.subscriptionId = makeUniqueString()
+        self.state = types.SimpleNamespace(role=role, connection_id='abcd')
+
+
+def makeReader(stream, lastIds, role):
+    '''A reader with one subscriber per handled position'''
+    handlers = {
+        FakeHandler(stream, role): types.SimpleNamespace(lastId=lastId)
+        for lastId in lastIds
+    }
+    return types.SimpleNamespace(stream=stream, closed=False, handlers=handlers)
+
+
+async def consumerLagCoroutine():
+    url = 'memory://test_consumer_lag'
+    redis = MemoryRedisClient(url)
+
+    positions = []
+    for i in range(5):
+        position = await redis.xadd('slow', 'json', '{}', 1000)
+        positions.append(position.decode())
+        await asyncio.sleep(0.002)
+
+    for i in range(MAX_MESSAGE_LAG + 10):
+        await redis.xadd('very_slow', 'json', '{}', 1000)
+
+    channelReaders = types.SimpleNamespace(
+        readers={
+            # The subscribers of a reader are measured from their own
+            # position, behind by 3 messages and caught up
+            ('app', 'slow', '$'): makeReader(
+                'slow', [positions[1], positions[-1]], 'sub'
+            ),
+            ('app', 'new', '$'): makeReader('new', ['$'], 'other'),
+            ('app', 'very_slow', '$'): makeReader('very_slow', ['0-0'], 'sub'),
+        }
+    )
+    consumerLag = ConsumerLag(channelReaders, FakeRedisClients(url))
+    await consumerLag.sample()
+
+    # The tails, then the streams with a lagging subscriber
+    assert PipelineCountingRedisClient.pipelineCount == 2
+    assert len(consumerLag.lags) == 4
+
+    lags = consumerLag.getWorstLags(2)
+    assert [lag['channel'] for lag in lags] == ['very_slow', 'slow']
+
+    slow = lags[1]
+    assert slow['position'] == positions[1]
+    assert slow['message_lag'] == 3
+    assert slow['time_lag_ms'] == getStreamIdMs(positions[-1]) - getStreamIdMs(
+        positions[1]
+    )
+    assert slow['time_lag_ms'] > 0
+    assert lags[0]['message_lag'] == MAX_MESSAGE_LAG
+
+    messageLags, maxTimeLags = consumerLag.getLagsBy('role')
+    assert messageLags == {'sub': MAX_MESSAGE_LAG + 3, 'other': 0}
+    assert maxTimeLags['sub'] == lags[0]['time_lag_ms']
+
+    # Channels which are caught up are not reported
+    messageLags, _ = consumerLag.getLagsBy('channel', skipIdle=True)
+    assert set(messageLags) == {'very_slow', 'slow'}
+
+
+def test_consumer_lag():
+    asyncio.get_event_loop().run_until_complete(consumerLagCoroutine())
+
+
+class MessageHandlerClass:
+    def __init__(self, connection, args):
+        self.args = args
+
+    async def on_init(self):
+        pass
+
+    async def handleMsg(self, messages, position):
+        return ActionFlow.STOP
+
+
+async def adminClientCoroutine(url, creds, app):
+    channel = makeUniqueString()
+    subscriptionId = makeUniqueString()
+
+    connection = Connection(url, creds)
+    await connection.connect()
+
+    subscription = asyncio.ensure_future(
+        connection.subscribe(
+            channel, None, None, MessageHandlerClass, {}, subscriptionId
+        )
+    )
+
+    for i in range(100):
+        readers = list(app['channel_readers'].readers.values())
+        if readers and readers[0].handlers:
+            break
+        await asyncio.sleep(0.01)
+
+    await app['consumer_lag'].sample()
+
+    lags = await connection.adminGetConsumerLag()
+    assert len(lags) == 1
+    assert lags[0]['subscription_id'] == subscriptionId
+    assert lags[0]['message_lag'] == 0
+
+    with pytest.raises(ActionException):
+        await connection.adminGetConsumerLag(count='all')
+
+    await connection.publish(channel, {'foo': 'bar'})
+    await subscription
+    await connection.close()
+
+
+def test_admin_get_consumer_lag(runner):
+    url = getDefaultHealthCheckUrl(None, runner.port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        adminClientCoroutine(url, creds, runner.app)
+    )
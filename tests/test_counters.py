@@ -0,0 +1,46 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+from cobras.common.counters import CounterRegistry
+from cobras.server.stats import ServerStats
+
+
+def test_counter_registry():
+    counters = CounterRegistry(['count', 'bytes'], initialKeys=2)
+    update = counters.makeUpdater(counters.getIndex('count'))
+
+    update('a', 10)
+    update('a', 5)
+    update('b', 1)
+
+    assert counters.getValues('count') == {'a': 2, 'b': 1}
+    assert counters.getValues('bytes') == {'a': 15, 'b': 1}
+
+    # Keys added past the initial capacity
+    for key in 'cdefg':
+        update(key, 100)
+
+    assert counters.get('g', 'bytes') == 100
+    assert counters.get('z', 'bytes') == 0
+
+    counters.endPeriod()
+    assert counters.getPeriodValues('count')['a'] == 2
+
+    update('a', 1)
+    counters.endPeriod()
+    period = counters.getPeriodValues('count')
+    assert period['a'] == 1
+    assert period['b'] == 0
+    assert counters.getValues('count')['a'] == 3
+
+
+def test_server_stats_role_data():
+    stats = ServerStats(None, '_stats')
+    stats.updatePublished('_pub', 100)
+    stats.updateWrites('_pub', 10)
+    stats.counters.endPeriod()
+
+    data = stats.getRoleData()
+    assert data['published_count'] == {'_pub': 1}
+    assert data['published_bytes_per_second'] == {'_pub': 100}
+    assert data['writes_bytes'] == {'_pub': 10}
+    assert data['reads_count'] == {'_pub': 0}
@@ -0,0 +1,131 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import random
+import uuid
+
+from cobras.common.histogram import (
+    BUCKET_COUNT,
+    MAX_VALUE,
+    Histogram,
+    Histograms,
+    getBucketIndex,
+    getBucketUpperBound,
+)
+from cobras.server.latency import getLatencies, redisLatencies, resetLatencies
+from cobras.server.memory_redis_client import MemoryRedisClient
+from cobras.server.rcc_client import RedisClientRcc
+
+
+def test_buckets():
+    assert BUCKET_COUNT == 1024
+    assert getBucketIndex(MAX_VALUE) == BUCKET_COUNT - 1
+
+    random.seed(0)
+    values = list(range(1000)) + [random.randrange(MAX_VALUE) for _ in range(1000)]
+
+    for value in values:
+        index = getBucketIndex(value)
+        upperBound = getBucketUpperBound(index)
+
+        # Each value is in one bucket, with a 3% precision
+        assert upperBound >= value
+        assert index == 0 or getBucketUpperBound(index - 1) < value
+        assert upperBound - value <= value / 32
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.getStats() == {
+        'count': 0,
+        'p50': 0,
+        'p90': 0,
+        'p99': 0,
+        'max': 0,
+    }
+
+    # 1 ms to 100 ms
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+
+    stats = histogram.getStats()
+    assert stats['count'] == 100
+    assert histogram.sum == sum(range(1, 101)) * 1000
+    assert 50 <= stats['p50'] <= 50 * 1.03
+    assert 90 <= stats['p90'] <= 90 * 1.03
+    assert 99 <= stats['p99'] <= 100
+    assert stats['max'] == 100
+
+    # Values past the max are clamped
+    histogram.record(10 ** 9)
+    assert histogram.getStats()['max'] == MAX_VALUE / 1000
+
+    histogram.reset()
+    assert histogram.count == 0
+    assert not any(histogram.counts)
+
+
+def test_histograms():
+    histograms = Histograms()
+    histograms.record('rtm/publish', 0.001)
+    histograms.record('rtm/read', 0.002)
+
+    stats = histograms.getStats()
+    assert stats['rtm/publish']['p50'] == 1
+    assert stats['rtm/read']['max'] == 2
+
+    histograms.reset()
+    assert histograms.getStats() == {}
+
+
+async def redisLatencyCoroutine():
+    redis = MemoryRedisClient('memory://test_histogram')
+    await redis.xadd('stream', 'json', '{}', 10)
+    await redis.xrevrange('stream', '+', '-', 1)
+
+    # Completed blocking reads measure how idle the stream is, not redis
+    await redis.xread('stream', '0')
+
+    # Cancelled blocking reads are not recorded either
+    task = asyncio.ensure_future(redis.xread('empty_stream', '$'))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    # The commands of a pipeline are recorded under their own name
+    await redis.pipeline([('SET', 'key', 'value'), ('XADD', 'stream', '*', 'a', 'b')])
+    await redis.get('key')
+
+
+async def rccLatencyCoroutine():
+    redis = RedisClientRcc('redis://localhost', None, False)
+    key = 'test_histogram_' + uuid.uuid4().hex[:8]
+
+    await redis.pipeline([redis.makeXaddCommand(key, 'json', '{}', 1)])
+    await redis.hget(key + '_hash', 'json')
+    await redis.delete(key)
+    redis.close()
+
+
+def test_redis_latencies():
+    resetLatencies()
+    asyncio.get_event_loop().run_until_complete(redisLatencyCoroutine())
+
+    latencies = getLatencies()['redis']
+    assert latencies['xadd']['count'] == 2
+    assert latencies['xrevrange']['count'] == 1
+    assert latencies['set']['count'] == 1
+    assert latencies['get']['count'] == 1
+    assert latencies['pipeline']['count'] == 1
+    assert 'xread' not in latencies
+
+    resetLatencies()
+    assert redisLatencies.getStats() == {}
+
+    # Publishes go through pipelines
+    asyncio.get_event_loop().run_until_complete(rccLatencyCoroutine())
+
+    latencies = getLatencies()['redis']
+    assert latencies['xadd']['count'] == 1
+    assert latencies['hget']['count'] == 1
+    resetLatencies()
@@ -0,0 +1,58 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import uuid
+
+from cobras.runner.kv_migrate import getNodeUrls, migrate
+from cobras.server.rcc_client import RedisClientRcc, getSlotMap
+
+CLUSTER_SLOTS = [
+    [0, 8191, [b'10.0.0.1', 7000, b'id1'], [b'10.0.0.3', 7000, b'id3']],
+    [8192, 16383, [b'10.0.0.2', 7000, b'id2']],
+]
+
+
+def test_node_urls():
+    # A known cluster, with a fresh slot map
+    url = f'redis://{uuid.uuid4().hex[:8]}:7000'
+    slotMap = getSlotMap(url)
+    slotMap.clusterEnabled = True
+    slotMap.update(CLUSTER_SLOTS)
+
+    urls = asyncio.get_event_loop().run_until_complete(
+        getNodeUrls(f'{url};redis://localhost', None)
+    )
+
+    # Every master is scanned, not only the seed node
+    assert urls == [
+        'redis://10.0.0.1:7000',
+        'redis://10.0.0.2:7000',
+        'redis://localhost',
+    ]
+
+
+async def migrateCoroutine():
+    appkey = uuid.uuid4().hex[:8]
+    redis = RedisClientRcc('redis://localhost', None, False)
+
+    await redis.set(f'{appkey}::kv_a', '{"a": 1}', ttl=60)
+    await redis.xadd(f'{appkey}::kv_b', 'json', '{"b": 2}', 1)
+    await redis.xadd(f'{appkey}::channel', 'json', '{"c": 3}', 100)
+
+    await migrate('redis://localhost', None, False, f'{appkey}::kv_*', 'hash', False)
+
+    assert await redis.hget(f'{appkey}::kv_a', 'json') == b'{"a": 1}'
+    assert await redis.hget(f'{appkey}::kv_b', 'json') == b'{"b": 2}'
+    assert 0 < await redis.pttl(f'{appkey}::kv_a') <= 60 * 1000
+    assert await redis.pttl(f'{appkey}::kv_b') == -1
+
+    # Channels not matching the pattern are left alone
+    assert await redis.type(f'{appkey}::channel') == b'stream'
+
+    for key in ('kv_a', 'kv_b', 'channel'):
+        await redis.delete(f'{appkey}::{key}')
+    redis.close()
+
+
+def test_migrate():
+    asyncio.get_event_loop().run_until_complete(migrateCoroutine())
@@ -0,0 +1,106 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import os
+import time
+
+import pytest
+from cobras.client.connection import Connection
+from cobras.client.credentials import (
+    createCredentials,
+    getDefaultRoleForApp,
+    getDefaultSecretForApp,
+)
+from cobras.client.health_check import getDefaultHealthCheckUrl
+from cobras.server.loop_lag import LoopLag
+
+from .test_utils import makeRunner
+
+
+@pytest.fixture()
+def runner():
+    runner, appsConfigPath = makeRunner(debugMemory=False)
+    yield runner
+
+    runner.terminate()
+    os.unlink(appsConfigPath)
+
+
+async def blockingCoroutine():
+    # Stands for a slow json.dumps or stream sql filter
+    time.sleep(0.3)
+
+
+async def loopLagCoroutine(loopLag):
+    task = asyncio.ensure_future(loopLag.run())
+    await asyncio.sleep(0.1)
+
+    assert loopLag.slowCallbackCount == 0
+    assert loopLag.watchdog.is_alive()
+
+    await blockingCoroutine()
+    await asyncio.sleep(0.1)
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def test_loop_lag():
+    loopLag = LoopLag(intervalMs=10, slowCallbackMs=100)
+    asyncio.get_event_loop().run_until_complete(loopLagCoroutine(loopLag))
+
+    # The watchdog is stopped with the task
+    assert not loopLag.watchdog.is_alive()
+
+    # One report for the whole stall, with the blocking code in the stack
+    assert loopLag.slowCallbackCount == 1
+    slowCallback = loopLag.slowCallbacks[0]
+    assert slowCallback['task'] == 'loopLagCoroutine'
+    assert 'blockingCoroutine' in ''.join(slowCallback['stack'])
+    assert loopLag.getSlowCallbacks()[0]['stack'] == slowCallback['stack']
+    assert 'since' not in loopLag.getSlowCallbacks()[0]
+
+    # Once the loop resumed, the full duration of the stall is known
+    assert slowCallback['blocked_ms'] >= 250
+
+    stats = loopLag.getStats()
+    assert stats['slow_callbacks'] == 1
+    assert stats['loop_lag_max_ms'] >= 250
+    assert stats['loop_lag_p50_ms'] < stats['loop_lag_max_ms']
+
+    loopLag.reset()
+    assert loopLag.getStats()['loop_lag_max_ms'] == 0
+
+
+async def adminClientCoroutine(url, creds, loopLag):
+    connection = Connection(url, creds)
+    await connection.connect()
+
+    result = await connection.adminGetSlowCallbacks()
+    assert result == {'count': 0, 'slow_callbacks': []}
+
+    # The server runs in this loop
+    loopLag.slowCallbackThreshold = 0.1
+    await blockingCoroutine()
+    await asyncio.sleep(0.2)
+
+    result = await connection.adminGetSlowCallbacks()
+    assert result['count'] == 1
+    slowCallback = result['slow_callbacks'][0]
+
+    # Part of the stall can overlap the 100 ms sleep of the lag task
+    assert slowCallback['blocked_ms'] >= 150
+    assert 'blockingCoroutine' in ''.join(slowCallback['stack'])
+
+    await connection.close()
+
+
+def test_admin_get_slow_callbacks(runner):
+    url = getDefaultHealthCheckUrl(None, runner.port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        adminClientCoroutine(url, creds, runner.app['loop_lag'])
+    )
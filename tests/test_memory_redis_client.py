@@ -0,0 +1,114 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import uuid
+
+import pytest
+from cobras.server.memory_redis_client import ACTIVE_EXPIRE_LIMIT, MemoryRedisClient
+from cobras.server.redis_clients import makeRedisClient
+
+
+async def memoryCoroutine():
+    url = 'memory://' + uuid.uuid4().hex
+    redis = makeRedisClient(url, None, False)
+    assert isinstance(redis, MemoryRedisClient)
+    await redis.ping()
+
+    # Streams are trimmed to their max length
+    ids = [await redis.xadd('stream', 'json', str(i), 3) for i in range(5)]
+    assert ids == sorted(ids, key=lambda streamId: streamId.split(b'-'))
+
+    results = await redis.xrevrange('stream', '+', '-', 10)
+    assert [result[1][b'json'] for result in results] == [b'4', b'3', b'2']
+    assert results[0][0] == ids[-1]
+
+    results = await redis.xrevrange('stream', ids[3].decode(), ids[3].decode(), 1)
+    assert results[0][1][b'json'] == b'3'
+
+    # Blocking reads are woken up by writes from other clients
+    reader = MemoryRedisClient(url)
+    task = asyncio.ensure_future(reader.xread('stream', '$'))
+    await asyncio.sleep(0.01)
+    assert not task.done()
+
+    streamId = await redis.xadd('stream', 'json', 'new', 3)
+    results = await asyncio.wait_for(task, 1)
+    assert results[b'stream'] == [
+        (streamId, {b'json': b'new', b'sha1': results[b'stream'][0][1][b'sha1']})
+    ]
+
+    results = await reader.xread('stream', ids[2].decode())
+    assert len(results[b'stream']) == 3
+
+    # Strings, hashes and expirations
+    results = await redis.pipeline(
+        [('SET', 'string', 'value', b'EX', 10), ('HSET', 'hash', 'json', 'data')]
+    )
+    assert results == [b'OK', 1]
+    assert await redis.get('string') == b'value'
+    assert await redis.hget('hash', 'json') == b'data'
+    assert 0 < await redis.pttl('string') <= 10000
+    assert await redis.pttl('hash') == -1
+    assert await redis.type('stream') == b'stream'
+
+    results = await redis.pipeline([('PERSIST', 'string'), ('PERSIST', 'string')])
+    assert results == [1, 0]
+    assert await redis.pttl('string') == -1
+
+    results = await redis.pipeline([('PEXPIRE', 'hash', 1), ('GET', 'hash')])
+    assert results[0] == 1
+    assert isinstance(results[1], Exception)
+
+    await asyncio.sleep(0.01)
+    assert await redis.exists('hash') == 0
+    assert await redis.type('hash') == b'none'
+
+    cursor, keys = await redis.scan('0', 's*', 100)
+    assert sorted(keys) == [b'stream', b'string']
+
+    assert await redis.delete('stream') == 1
+    assert await redis.delete('stream') == 0
+
+    with pytest.raises(Exception):
+        await redis.hget('string', 'json')
+
+    # Each memory:// url has its own data
+    other = MemoryRedisClient('memory://' + uuid.uuid4().hex)
+    assert await other.get('string') is None
+
+
+def test_memory_redis_client():
+    asyncio.get_event_loop().run_until_complete(memoryCoroutine())
+
+
+async def activeExpireCoroutine():
+    redis = MemoryRedisClient('memory://' + uuid.uuid4().hex)
+    store = redis.store
+
+    # Never read again
+    for i in range(50):
+        await redis.pipeline(
+            [('SET', f'key_{i}', 'value'), ('PEXPIRE', f'key_{i}', 100)]
+        )
+    await redis.set('forever', 'value')
+
+    # A cancelled expiration leaves a stale deadline behind
+    await redis.pipeline([('PEXPIRE', 'forever', 100), ('PERSIST', 'forever')])
+
+    assert len(store.data) == 51
+    await asyncio.sleep(0.15)
+
+    # Each command frees a few of them
+    await redis.ping()
+    assert len(store.data) == 51 - ACTIVE_EXPIRE_LIMIT
+
+    for i in range(5):
+        await redis.ping()
+
+    assert list(store.data) == ['forever']
+    assert store.expirations == {}
+    assert store.deadlines == []
+
+
+def test_memory_redis_client_active_expire():
+    asyncio.get_event_loop().run_until_complete(activeExpireCoroutine())
@@ -0,0 +1,93 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import os
+import urllib.request
+
+import pytest
+from cobras.client.connection import Connection
+from cobras.client.credentials import (
+    createCredentials,
+    getDefaultRoleForApp,
+    getDefaultSecretForApp,
+)
+from cobras.client.health_check import getDefaultHealthCheckUrl
+from cobras.server.metrics import METRICS_CONTENT_TYPE, escapeLabelValue
+
+from .test_utils import makeRunner, makeUniqueString
+
+
+@pytest.fixture()
+def runner():
+    runner, appsConfigPath = makeRunner(debugMemory=False)
+    yield runner
+
+    runner.terminate()
+    os.unlink(appsConfigPath)
+
+
+def test_escape_label_value():
+    assert escapeLabelValue('sms_republished') == 'sms_republished'
+    assert escapeLabelValue('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+    assert escapeLabelValue(42) == '42'
+
+
+def fetchMetrics(port):
+    url = f'http://127.0.0.1:{port}/metrics/'
+    with urllib.request.urlopen(url) as response:
+        return response.status, response.headers, response.read().decode('utf8')
+
+
+async def metricsCoroutine(url, creds, port):
+    channel = makeUniqueString()
+
+    connection = Connection(url, creds)
+    await connection.connect()
+    await connection.publish(channel, {'foo': 'bar'})
+    await connection.close()
+
+    # The server runs in this loop, so the blocking request goes to a thread
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, fetchMetrics, port)
+
+
+def test_metrics(runner):
+    url = getDefaultHealthCheckUrl(None, runner.port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+    creds = createCredentials(role, secret)
+
+    status, headers, body = asyncio.get_event_loop().run_until_complete(
+        metricsCoroutine(url, creds, runner.port)
+    )
+    assert status == 200
+    assert headers['Content-Type'] == METRICS_CONTENT_TYPE
+
+    lines = body.splitlines()
+    assert f'cobra_published_messages_total{{role="{role}"}} 1' in lines
+    assert any(line.startswith('cobra_connections ') for line in lines)
+    assert any(line.startswith('cobra_uptime_seconds ') for line in lines)
+    assert any(line.startswith('cobra_loop_lag_p99_ms ') for line in lines)
+    assert any(line.startswith('cobra_action_latency_seconds{') for line in lines)
+
+    # Each metric is declared once
+    types = [line.split()[2] for line in lines if line.startswith('# TYPE ')]
+    assert len(types) == len(set(types))
+
+    # Every sample belongs to a declared metric
+    summaries = [line.split()[2] for line in lines if line.endswith(' summary')]
+    for line in lines:
+        if not line.startswith('#'):
+            name = line.split('{')[0].split(' ')[0]
+            for suffix in ('_sum', '_count'):
+                if name.endswith(suffix) and name[: -len(suffix)] in summaries:
+                    name = name[: -len(suffix)]
+            assert name in types
+
+    # The per channel top K values are not monotonic
+    assert '# TYPE cobra_channel_published_messages gauge' in lines
+    assert 'cobra_action_latency_seconds' in summaries
+    assert any(
+        line.startswith('cobra_action_latency_seconds_count{action="rtm/publish"} ')
+        for line in lines
+    )
@@ -0,0 +1,48 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+
+import pytest
+from cobras.server.pipelined_publisher import PipelinedPublisher
+
+
+class FakeRedis:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def pipeline(self, commands):
+        if self.fail:
+            raise ConnectionError('cannot connect to redis')
+
+        self.batches.append(commands)
+        return [f'{command}-id' for command in commands]
+
+
+async def batchCoroutine():
+    redis = FakeRedis()
+    publisher = PipelinedPublisher(redis, batchSize=2, lingerMs=10)
+
+    futures = [publisher.publish(f'cmd{i}') for i in range(5)]
+
+    # the first two batches are full and sent right away,
+    # the last job waits for the linger timer
+    results = await asyncio.gather(*futures)
+    assert results == [f'cmd{i}-id' for i in range(5)]
+    assert redis.batches == [['cmd0', 'cmd1'], ['cmd2', 'cmd3'], ['cmd4']]
+
+
+def test_batch_by_size_and_linger():
+    asyncio.get_event_loop().run_until_complete(batchCoroutine())
+
+
+async def errorCoroutine():
+    redis = FakeRedis(fail=True)
+    publisher = PipelinedPublisher(redis, batchSize=10, lingerMs=1)
+
+    with pytest.raises(ConnectionError):
+        await publisher.publish('cmd')
+
+
+def test_batch_error():
+    asyncio.get_event_loop().run_until_complete(errorCoroutine())
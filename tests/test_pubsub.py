@@ -6,13 +6,15 @@ import asyncio
 import os
 
 import pytest
-from cobras.client.connection import ActionException, Connection
+from cobras.client.connection import ActionException, ActionFlow, Connection
 from cobras.client.credentials import (
     createCredentials,
     getDefaultRoleForApp,
     getDefaultSecretForApp,
 )
 from cobras.client.health_check import getDefaultHealthCheckUrl
+from cobras.server.channel_readers import ChannelReader
+from cobras.server.redis_clients import makeRedisClient
 
 from .test_utils import makeRunner, makeUniqueString
 
@@ -61,6 +63,218 @@ async def clientCoroutine(connection):
     await connection.close()
 
 
+async def multiChannelsClientCoroutine(connection):
+    await connection.connect()
+
+    channels = [makeUniqueString() for i in range(4)]
+    data = {"foo": makeUniqueString()}
+
+    pdu = {"action": "rtm/publish", "body": {"channels": channels, "message": data}}
+    response = await connection.send(pdu)
+    assert response['body']['channels'] == channels
+    assert 'errors' not in response['body']
+
+    # the full publish pdu is stored in each channel
+    for channel in channels:
+        storedPdu = await connection.read(channel)
+        assert storedPdu['body']['message'] == data
+
+        await connection.delete(channel)
+
+    await connection.close()
+
+
+def test_publish_multiple_channels(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+    connection = Connection(url, creds)
+
+    asyncio.get_event_loop().run_until_complete(
+        multiChannelsClientCoroutine(connection)
+    )
+
+
+async def publishAckClientCoroutine(url, creds):
+    # No response for that publish
+    connection = Connection(url, creds)
+    await connection.connect()
+
+    channel = makeUniqueString()
+    data = {"foo": makeUniqueString()}
+    await connection.publish(channel, data, ack=False)
+
+    storedPdu = await connection.read(channel)
+    assert storedPdu['body']['message'] == data
+    assert connection.publishAckId is None
+
+    await connection.delete(channel)
+    await connection.close()
+
+    # Cumulative acks, every 3 messages or every 10ms
+    publishAck = {"mode": "cumulative", "count": 3, "interval_ms": 10}
+    connection = Connection(url, creds, publishAck)
+    await connection.connect()
+
+    for i in range(7):
+        pdu = {
+            "action": "rtm/publish",
+            "body": {"channel": channel, "message": {"iteration": i}},
+        }
+        await connection.sendWithoutResponse(pdu)
+
+    # the last ack covers the last publish
+    for i in range(100):
+        if connection.publishAckId == pdu['id']:
+            break
+        await asyncio.sleep(0.01)
+
+    assert connection.publishAckId == pdu['id']
+
+    await connection.delete(channel)
+    await connection.close()
+
+    # Invalid ack mode
+    connection = Connection(url, creds, {"mode": "sometimes"})
+    with pytest.raises(ActionException):
+        await connection.connect()
+
+
+def test_publish_ack(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(publishAckClientCoroutine(url, creds))
+
+
+async def publishPartialFailureClientCoroutine(url, creds, redisUrls):
+    good, bad = makeUniqueString(), makeUniqueString()
+
+    # The stream of the bad channel cannot be written to
+    redis = makeRedisClient(redisUrls, None, False)
+    await redis.set(f'_health::{bad}', 'not a stream')
+
+    connection = Connection(url, creds, {"mode": "none"})
+    await connection.connect()
+
+    responses = []
+    connection.handlePublishAck = responses.append
+
+    pdus = [
+        {"action": "rtm/publish", "body": {"channel": good, "message": {"foo": 0}}},
+        {
+            "action": "rtm/publish",
+            "body": {"channels": [good, bad], "message": {"foo": 1}, "ack": False},
+        },
+        {
+            "action": "rtm/publish_batch",
+            "body": {"messages": [{"channel": good, "message": {"foo": 2}}]},
+        },
+        {
+            "action": "rtm/publish_batch",
+            "body": {
+                "messages": [
+                    {"channel": good, "message": {"foo": 3}},
+                    {"channel": bad, "message": {"foo": 4}},
+                ]
+            },
+        },
+    ]
+    for pdu in pdus:
+        await connection.sendWithoutResponse(pdu)
+
+    for i in range(100):
+        if len(responses) == 2:
+            break
+        await asyncio.sleep(0.01)
+
+    # Only the partial failures are reported
+    assert [response['id'] for response in responses] == [pdus[1]['id'], pdus[3]['id']]
+    assert list(responses[0]['body']['errors']) == [bad]
+    assert 'errors' not in responses[1]['body']['results'][0]
+    assert list(responses[1]['body']['results'][1]['errors']) == [bad]
+
+    # publishBatch does not wait for a response in this mode
+    entries = [{"channel": good, "message": {"foo": 5}}]
+    assert await connection.publishBatch(entries) is None
+
+    storedPdu = await connection.read(good)
+    assert storedPdu['body']['message'] == {"foo": 5}
+
+    await connection.delete(good)
+    await redis.delete(f'_health::{bad}')
+    redis.close()
+    await connection.close()
+
+
+def test_publish_partial_failure(runner):
+    url = getDefaultHealthCheckUrl(None, runner.port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        publishPartialFailureClientCoroutine(url, creds, runner.redisUrls)
+    )
+
+
+async def publishBatchClientCoroutine(connection):
+    await connection.connect()
+
+    channels = [makeUniqueString() for i in range(3)]
+    entries = [
+        {"channel": channels[0], "message": {"foo": 0}},
+        {"channels": channels[1:], "message": {"foo": 1}},
+        {"channel": channels[0]},  # missing message
+    ]
+
+    results = await connection.publishBatch(entries)
+    assert len(results) == 3
+    assert list(results[0]['channels']) == channels[:1]
+    assert list(results[1]['channels']) == channels[1:]
+    assert 'error' in results[2]
+
+    # each entry is stored as a regular publish pdu
+    storedPdu = await connection.read(channels[0])
+    assert storedPdu['body']['message'] == {"foo": 0}
+
+    for channel in channels[1:]:
+        storedPdu = await connection.read(channel)
+        assert storedPdu['body']['message'] == {"foo": 1}
+
+    for channel in channels:
+        await connection.delete(channel)
+
+    # Empty batch
+    pdu = {"action": "rtm/publish_batch", "body": {"messages": []}}
+    with pytest.raises(ActionException):
+        await connection.send(pdu)
+
+    await connection.close()
+
+
+def test_publish_batch(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+    connection = Connection(url, creds)
+
+    asyncio.get_event_loop().run_until_complete(publishBatchClientCoroutine(connection))
+
+
 def test_publish(runner):
     port = runner.port
 
@@ -175,3 +389,377 @@ def test_unsubscribe(runner):
     connection = Connection(url, creds)
 
     asyncio.get_event_loop().run_until_complete(unsubscribeClientCoroutine(connection))
+
+
+class SharedReaderMessageHandlerClass:
+    def __init__(self, connection, args):
+        self.args = args
+        self.messages = []
+
+    async def on_init(self):
+        pass
+
+    async def handleMsg(self, messages, position):
+        self.messages.extend(messages)
+        return ActionFlow.STOP
+
+
+async def sharedReaderClientCoroutine(url, creds, app):
+    channel = makeUniqueString()
+
+    connections = [Connection(url, creds) for i in range(3)]
+    for connection in connections:
+        await connection.connect()
+
+    subscriptions = [
+        asyncio.ensure_future(
+            connection.subscribe(
+                channel,
+                None,
+                None,
+                SharedReaderMessageHandlerClass,
+                {},
+                subscriptionId=makeUniqueString(),
+            )
+        )
+        for connection in connections[:2]
+    ]
+
+    # wait until both subscriptions are registered with the reader
+    for i in range(100):
+        readers = list(app['channel_readers'].readers.values())
+        if len(readers) == 1 and len(readers[0].handlers) == 2:
+            break
+        await asyncio.sleep(0.01)
+
+    # one reader (and one redis connection) for both subscribers
+    assert len(readers) == 1
+    assert len(readers[0].handlers) == 2
+
+    data = {"foo": makeUniqueString()}
+    await connections[2].publish(channel, data)
+
+    handlers = await asyncio.gather(*subscriptions)
+    for handler in handlers:
+        assert handler.messages == [data]
+
+    # the reader goes away with its last subscriber
+    for i in range(100):
+        if len(app['channel_readers'].readers) == 0:
+            break
+        await asyncio.sleep(0.01)
+
+    assert len(app['channel_readers'].readers) == 0
+
+    for connection in connections:
+        await connection.close()
+
+
+def test_shared_channel_reader(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        sharedReaderClientCoroutine(url, creds, runner.app)
+    )
+
+
+class CountingMessageHandlerClass:
+    def __init__(self, connection, args):
+        self.args = args
+        self.messages = []
+
+    async def on_init(self):
+        pass
+
+    async def handleMsg(self, messages, position):
+        self.messages.extend(messages)
+        if len(self.messages) >= self.args['expected']:
+            return ActionFlow.STOP
+
+        return ActionFlow.CONTINUE
+
+
+async def lateJoinerClientCoroutine(url, creds, app):
+    channel = makeUniqueString()
+
+    connections = [Connection(url, creds) for i in range(3)]
+    for connection in connections:
+        await connection.connect()
+
+    data = [{"index": i} for i in range(4)]
+    for message in data[:3]:
+        await connections[2].publish(channel, message)
+
+    def subscribe(connection):
+        return asyncio.ensure_future(
+            connection.subscribe(
+                channel,
+                '0-0',
+                None,
+                CountingMessageHandlerClass,
+                {'expected': 4},
+                subscriptionId=makeUniqueString(),
+            )
+        )
+
+    first = subscribe(connections[0])
+    for i in range(100):
+        readers = list(app['channel_readers'].readers.values())
+        if readers and readers[0].handlers and readers[0].lastId != '0-0':
+            break
+        await asyncio.sleep(0.01)
+
+    # The reader of the first subscriber moved past 0-0, joining it
+    # would skip the history
+    second = subscribe(connections[1])
+    for i in range(100):
+        if len(app['channel_readers'].readers) == 2:
+            break
+        await asyncio.sleep(0.01)
+
+    assert len(app['channel_readers'].readers) == 2
+
+    await connections[2].publish(channel, data[3])
+
+    handlers = await asyncio.gather(first, second)
+    for handler in handlers:
+        assert handler.messages == data
+
+    for connection in connections:
+        await connection.close()
+
+
+def test_late_joiner_channel_reader(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        lateJoinerClientCoroutine(url, creds, runner.app)
+    )
+
+
+class DispatchHandler:
+    def __init__(self, received, waitFor=None, indexKey=None):
+        self.received = received
+        self.waitFor = waitFor
+        self.indexKey = indexKey
+        self.skipped = []
+
+    def log(self, msg):
+        pass
+
+    def getIndexKey(self):
+        return self.indexKey
+
+    def handleSkippedMsg(self, payloadSize):
+        self.skipped.append(payloadSize)
+
+    async def handleMsg(self, msg, position, payloadSize):
+        # A subscriber with a full websocket buffer
+        if self.waitFor is not None:
+            await self.waitFor.wait()
+
+        self.received.set()
+        return True
+
+
+class OverflowHandler(DispatchHandler):
+    def __init__(self, received, waitFor=None):
+        super().__init__(received, waitFor)
+        self.overflows = []
+
+    def handleOverflow(self, position, missedCount):
+        self.overflows.append((position, missedCount))
+
+
+async def dispatchCoroutine():
+    reader = ChannelReader(None, None, 'stream', '$', lambda reader: None, 2)
+
+    # A subscriber with a full websocket buffer, first in line
+    stalled = asyncio.Event()
+    slow = OverflowHandler(asyncio.Event(), waitFor=stalled)
+    fast = DispatchHandler(asyncio.Event())
+
+    for handler in (slow, fast):
+        reader.registerHandler(handler, asyncio.get_event_loop().create_future())
+
+    reader.dispatch({}, '1-0', 2)
+    await asyncio.wait_for(fast.received.wait(), timeout=1)
+    assert not slow.received.is_set()
+
+    # The slow handler is stuck on 1-0, 2 more messages fill its queue.
+    # 1-0 to 4-0 are lost
+    for i in range(2, 6):
+        reader.dispatch({}, f'{i}-0', 2)
+        await asyncio.sleep(0)
+
+    assert reader.handlers[fast].lastId == '5-0'
+
+    # The reader was never blocked, the slow subscriber was dropped
+    assert slow not in reader.handlers
+    assert slow.overflows == [('$', 4)]
+    assert reader.overflowCount == 1
+    assert reader.handlers[fast].queue.qsize() == 0
+
+
+def test_dispatch_slow_handler():
+    asyncio.get_event_loop().run_until_complete(dispatchCoroutine())
+
+
+async def dispatchSkippedCoroutine():
+    reader = ChannelReader(None, None, 'stream', '$', lambda reader: None)
+
+    handlers = {
+        game: DispatchHandler(asyncio.Event(), indexKey=(('game',), game))
+        for game in ('ody', 'miso')
+    }
+    for handler in handlers.values():
+        reader.registerHandler(handler, asyncio.get_event_loop().create_future())
+
+    msg = {'body': {'message': {'game': 'ody'}}}
+    reader.dispatch(msg, '1-0', 42)
+    await asyncio.wait_for(handlers['ody'].received.wait(), timeout=1)
+
+    # The handler left out by the index is still told about the message
+    assert handlers['ody'].skipped == []
+    assert not handlers['miso'].received.is_set()
+    assert handlers['miso'].skipped == [42]
+
+
+def test_dispatch_skipped_handler():
+    asyncio.get_event_loop().run_until_complete(dispatchSkippedCoroutine())
+
+
+async def filterIndexClientCoroutine(url, creds, app):
+    channel = makeUniqueString()
+
+    connections = [Connection(url, creds) for i in range(3)]
+    for connection in connections:
+        await connection.connect()
+
+    subscriptions = [
+        asyncio.ensure_future(
+            connection.subscribe(
+                channel,
+                None,
+                f"SELECT * FROM `{channel}` WHERE game = '{game}'",
+                SharedReaderMessageHandlerClass,
+                {},
+                subscriptionId=makeUniqueString(),
+            )
+        )
+        for connection, game in zip(connections, ('ody', 'miso'))
+    ]
+
+    for i in range(100):
+        readers = list(app['channel_readers'].readers.values())
+        if len(readers) == 1 and len(readers[0].handlers) == 2:
+            break
+        await asyncio.sleep(0.01)
+
+    # both filters are indexed by their game predicate
+    assert len(readers[0].index.indexed[('game',)]) == 2
+
+    for game in ('miso', 'ody'):
+        await connections[2].publish(channel, {"game": game})
+
+    handlers = await asyncio.gather(*subscriptions)
+    assert handlers[0].messages == [{"game": "ody"}]
+    assert handlers[1].messages == [{"game": "miso"}]
+
+    for connection in connections:
+        await connection.close()
+
+
+def test_filter_index(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        filterIndexClientCoroutine(url, creds, runner.app)
+    )
+
+
+class AggregateMessageHandlerClass:
+    def __init__(self, connection, args):
+        self.args = args
+        self.counts = {}
+
+    async def on_init(self):
+        pass
+
+    async def handleMsg(self, rows, position):
+        for row in rows:
+            game = row['game']
+            self.counts[game] = self.counts.get(game, 0) + row['count']
+
+        if sum(self.counts.values()) == self.args['expected']:
+            return ActionFlow.STOP
+
+        return ActionFlow.CONTINUE
+
+
+async def aggregateClientCoroutine(url, creds, app):
+    channel = makeUniqueString()
+
+    connections = [Connection(url, creds) for i in range(2)]
+    for connection in connections:
+        await connection.connect()
+
+    sqlFilter = f"""SELECT device.game AS game, count(*) AS count FROM `{channel}`
+                    WHERE level > 1 GROUP BY device.game WINDOW TUMBLING(100ms)"""
+    subscription = asyncio.ensure_future(
+        connections[0].subscribe(
+            channel,
+            None,
+            sqlFilter,
+            AggregateMessageHandlerClass,
+            {'expected': 3},
+            subscriptionId=makeUniqueString(),
+        )
+    )
+
+    for i in range(100):
+        if len(app['channel_readers'].readers) == 1:
+            break
+        await asyncio.sleep(0.01)
+
+    for game, level in (('ody', 2), ('ody', 3), ('miso', 2), ('miso', 1)):
+        data = {"device": {"game": game}, "level": level}
+        await connections[1].publish(channel, data)
+
+    handler = await subscription
+    assert handler.counts == {'ody': 2, 'miso': 1}
+
+    for connection in connections:
+        await connection.close()
+
+
+def test_aggregate(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(
+        aggregateClientCoroutine(url, creds, runner.app)
+    )
@@ -0,0 +1,82 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+
+from cobras.common.apps_config import PULSAR_APPKEY, AppsConfig
+from cobras.server.connection_state import ConnectionState
+from cobras.server.pulsar import handleConsumerMessage, handleProducerMessage
+from cobras.server.redis_clients import RedisClients
+from cobras.server.stats import ServerStats
+
+TOPIC = 'persistent/tenant/namespace/topic'
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.acks = asyncio.Queue()
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+    async def recv(self):
+        return await self.acks.get()
+
+
+async def pulsarCoroutine(app):
+    consumerWs = FakeWebSocket()
+    consumer = asyncio.ensure_future(
+        handleConsumerMessage(
+            ConnectionState(PULSAR_APPKEY, 'consumer'),
+            consumerWs,
+            app,
+            f'/ws/v2/consumer/{TOPIC}/subscription',
+        )
+    )
+    await asyncio.sleep(0.01)
+
+    producerWs = FakeWebSocket()
+    pdu = {'payload': 'cGF5bG9hZA==', 'context': '1'}
+    await handleProducerMessage(
+        ConnectionState(PULSAR_APPKEY, 'producer'),
+        producerWs,
+        app,
+        pdu,
+        json.dumps(pdu),
+        f'/ws/v2/producer/{TOPIC}',
+    )
+    assert producerWs.sent[0]['result'] == 'ok'
+
+    for i in range(100):
+        if consumerWs.sent:
+            break
+        await asyncio.sleep(0.01)
+
+    assert consumerWs.sent[0]['payload'] == pdu['payload']
+    assert consumerWs.sent[0]['messageId'] == producerWs.sent[0]['messageId']
+
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+
+
+def test_pulsar_app_redis_urls():
+    path = tempfile.mktemp()
+    appsConfig = AppsConfig(path)
+    appsConfig.generateDefaultConfig()
+    os.unlink(path)
+
+    # The producer and the consumer use the redis backend of the pulsar app
+    appsConfig.apps = appsConfig.data['apps']
+    appsConfig.apps[PULSAR_APPKEY]['redis_urls'] = 'memory://' + uuid.uuid4().hex
+    redisClients = RedisClients('memory://' + uuid.uuid4().hex, None, False, appsConfig)
+
+    app = {
+        'redis_clients': redisClients,
+        'channel_max_length': 100,
+        'stats': ServerStats(None, '_stats'),
+    }
+    asyncio.get_event_loop().run_until_complete(pulsarCoroutine(app))
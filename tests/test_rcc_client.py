@@ -0,0 +1,112 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import uuid
+
+import pytest
+
+from cobras.server.rcc_client import RedisClientRcc
+from rcc.hash_slot import getHashSlot
+
+CLUSTER_SLOTS = [
+    [0, 8191, [b'10.0.0.1', 7000, b'id1'], [b'10.0.0.3', 7000, b'id3']],
+    [8192, 16383, [b'10.0.0.2', 7000, b'id2']],
+]
+
+
+async def slotMapCoroutine():
+    # A unique url, so that the slot map is not shared with other tests
+    url = f'redis://{uuid.uuid4().hex[:8]}:7000'
+    redis = RedisClientRcc(url, None, False)
+
+    commands = []
+
+    async def send(*args, **kwargs):
+        commands.append(args[0])
+
+        if args[0] == 'INFO':
+            return {'cluster_enabled': '1'}
+        if args == ('CLUSTER', 'SLOTS'):
+            return CLUSTER_SLOTS
+
+    redis.redis.send = send
+
+    for i in range(100):
+        key = f'channel_{i}'
+        host = await redis.getHostForKey(key)
+
+        if getHashSlot(key) < 8192:
+            assert host == '10.0.0.1:7000'
+        else:
+            assert host == '10.0.0.2:7000'
+
+    # The cluster mode and the slot map are only queried once
+    assert commands == ['INFO', 'CLUSTER']
+
+    # rcc routes the commands with the same map
+    assert redis.redis.urls[0] == 'redis://10.0.0.1:7000'
+    assert redis.redis.urls[16383] == 'redis://10.0.0.2:7000'
+
+    # Shared with the other clients of that cluster
+    other = RedisClientRcc(url, None, False)
+    other.redis.send = send
+    assert await other.getHostForKey('channel_0') != 'unknown-host'
+    assert len(commands) == 2
+
+    # Refreshed after redirections
+    redis.slotMap.invalidate()
+    await redis.getHostForKey('channel_0')
+    assert commands == ['INFO', 'CLUSTER', 'CLUSTER']
+
+
+def test_slot_map():
+    asyncio.get_event_loop().run_until_complete(slotMapCoroutine())
+
+
+async def cancelledPipelineCoroutine():
+    redis = RedisClientRcc('redis://localhost', None, False)
+    key = 'test_rcc_client_' + uuid.uuid4().hex[:8]
+
+    # Cancelled after the command was written, before its reply was read
+    task = asyncio.ensure_future(redis.pipeline([('BLPOP', key, 1)]))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # The reply of BLPOP is not read by the next command
+    assert await asyncio.wait_for(redis.pipeline([('PING',)]), 0.5) == [b'PONG']
+    redis.close()
+
+
+def test_cancelled_pipeline():
+    asyncio.get_event_loop().run_until_complete(cancelledPipelineCoroutine())
+
+
+class BrokenConnection:
+    def __init__(self):
+        self.closed = False
+
+    async def send(self, *args):
+        pass
+
+    async def readResponse(self):
+        raise ConnectionResetError('connection reset by peer')
+
+    def close(self):
+        self.closed = True
+
+
+async def sendAskingCoroutine():
+    redis = RedisClientRcc('redis://localhost', None, False)
+    connection = BrokenConnection()
+    redis.redis.pool.get = lambda url: connection
+
+    # The error is the result of that command, as in pipeline
+    result = await redis.sendAsking('redis://10.0.0.1:7000', ('GET', 'key'))
+    assert isinstance(result, ConnectionResetError)
+    assert connection.closed
+
+
+def test_send_asking_error():
+    asyncio.get_event_loop().run_until_complete(sendAskingCoroutine())
@@ -0,0 +1,61 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+
+from cobras.server.read_cache import ReadCache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.reads = 0
+
+    async def read(self, key):
+        self.reads += 1
+        await asyncio.sleep(0.01)
+        return self.data.get(key)
+
+
+async def singleFlightCoroutine():
+    redis = FakeRedis()
+    redis.data['a'] = 'foo'
+    cache = ReadCache(maxSize=2)
+
+    def loader(key):
+        return lambda: redis.read(key)
+
+    # Concurrent misses share one redis read
+    values = await asyncio.gather(*[cache.get('a', 60, loader('a')) for i in range(10)])
+    assert values == ['foo'] * 10
+    assert redis.reads == 1
+
+    # Hit
+    assert await cache.get('a', 60, loader('a')) == 'foo'
+    assert redis.reads == 1
+
+    # Expired entries are read again
+    assert await cache.get('b', 0, loader('b')) is None
+    assert await cache.get('b', 0, loader('b')) is None
+    assert redis.reads == 3
+
+    # LRU eviction
+    await cache.get('c', 60, loader('c'))
+    await cache.get('d', 60, loader('d'))
+    assert list(cache.entries) == ['c', 'd']
+
+    # A value invalidated while being read is not cached
+    task = asyncio.ensure_future(cache.get('a', 60, loader('a')))
+    await asyncio.sleep(0)
+    cache.invalidate('a')
+    redis.data['a'] = 'bar'
+    assert await task == 'bar'
+    assert 'a' not in cache.entries
+
+    stats = cache.getStats()
+    assert stats['read_cache_hits'] == 1
+    assert stats['read_cache_coalesced'] == 9
+    assert stats['read_cache_evictions'] > 0
+
+
+def test_single_flight():
+    asyncio.get_event_loop().run_until_complete(singleFlightCoroutine())
@@ -11,6 +11,8 @@ from cobras.client.credentials import (
     getDefaultSecretForApp,
 )
 from cobras.client.health_check import getDefaultHealthCheckUrl
+from cobras.common.apps_config import HEALTH_APPKEY
+from cobras.server.handlers.kv_store import kvMigrate
 
 from .test_utils import makeRunner, makeUniqueString
 
@@ -39,6 +41,15 @@ def redisDownRunner():
     os.unlink(appsConfigPath)
 
 
+@pytest.fixture()
+def memoryRunner():
+    runner, appsConfigPath = makeRunner(debugMemory=False, redisUrls='memory://')
+    yield runner
+
+    runner.terminate()
+    os.unlink(appsConfigPath)
+
+
 async def clientCoroutine(connection):
     await connection.connect()
 
@@ -75,6 +86,20 @@ def test_read_write_delete(runner):
     asyncio.get_event_loop().run_until_complete(clientCoroutine(connection))
 
 
+def test_read_write_delete_memory(memoryRunner):
+    '''Same as test_read_write_delete, without redis'''
+    port = memoryRunner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+    connection = Connection(url, creds)
+
+    asyncio.get_event_loop().run_until_complete(clientCoroutine(connection))
+
+
 async def redisDownClientCoroutine(connection):
     await connection.connect()
 
@@ -105,3 +130,167 @@ def test_read_write_delete_redis_down(redisDownRunner):
     connection = Connection(url, creds)
 
     asyncio.get_event_loop().run_until_complete(redisDownClientCoroutine(connection))
+
+
+async def kvBackendsClientCoroutine(connection, app):
+    await connection.connect()
+
+    appConfig = app['apps_config'].apps[HEALTH_APPKEY]
+    redis = app['redis_clients'].makeRedisClient()
+
+    for backend in ('stream', 'hash', 'string'):
+        appConfig['kv_backend'] = backend
+
+        channel = makeUniqueString()
+        key = f'{HEALTH_APPKEY}::{channel}'
+        data = {"foo": makeUniqueString()}
+
+        await connection.write(channel, data, ttl=60)
+        assert await connection.read(channel) == data
+
+        assert await redis.type(key) == backend.encode()
+        assert 0 < await redis.pttl(key) <= 60 * 1000
+
+        # A write without ttl makes the key persistent, except on the
+        # stream backend where it is a single XADD
+        await connection.write(channel, data)
+        if backend == 'stream':
+            assert 0 < await redis.pttl(key) <= 60 * 1000
+        else:
+            assert await redis.pttl(key) == -1
+
+        await connection.delete(channel)
+        assert await connection.read(channel) is None
+
+    # Invalid ttl
+    with pytest.raises(ActionException):
+        await connection.write(channel, data, ttl='forever')
+
+    # Migrate a stream key to the string backend
+    appConfig['kv_backend'] = 'stream'
+    await connection.write(channel, data)
+
+    appConfig['kv_backend'] = 'string'
+    assert await kvMigrate(redis, key, 'string')
+    assert not await kvMigrate(redis, key, 'string')
+    assert await connection.read(channel) == data
+
+    await connection.delete(channel)
+    del appConfig['kv_backend']
+
+    redis.close()
+    await connection.close()
+
+
+def test_kv_backends(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+    connection = Connection(url, creds)
+
+    asyncio.get_event_loop().run_until_complete(
+        kvBackendsClientCoroutine(connection, runner.app)
+    )
+
+
+async def multiKeysClientCoroutine(connection, app):
+    await connection.connect()
+
+    appConfig = app['apps_config'].apps[HEALTH_APPKEY]
+
+    for backend in ('stream', 'hash', 'string'):
+        appConfig['kv_backend'] = backend
+
+        messages = {makeUniqueString(): {"foo": i} for i in range(10)}
+        channels = list(messages)
+        missingChannel = makeUniqueString()
+
+        assert await connection.mwrite(messages, ttl=60) == {}
+
+        data = await connection.mread(channels + [missingChannel])
+        assert data == dict(messages, **{missingChannel: None})
+
+        assert await connection.mdelete(channels) == {}
+        data = await connection.mread(channels)
+        assert data == {channel: None for channel in channels}
+
+    # A corrupted value is reported, the other reads still succeed
+    corruptedChannel = makeUniqueString()
+    redis = app['redis_clients'].getRedisClient(HEALTH_APPKEY)
+    await redis.set(f'{HEALTH_APPKEY}::{corruptedChannel}', '{"foo": ')
+
+    await connection.mwrite({channels[0]: {"foo": 0}})
+    pdu = {"action": "rtm/mread", "body": {"channels": [channels[0], corruptedChannel]}}
+    data = await connection.send(pdu)
+    assert data['body']['messages'] == {channels[0]: {"foo": 0}}
+    assert list(data['body']['errors']) == [corruptedChannel]
+
+    await connection.mdelete([channels[0], corruptedChannel])
+    del appConfig['kv_backend']
+
+    # Invalid requests
+    for action in ('rtm/mread', 'rtm/mwrite', 'rtm/mdelete'):
+        pdu = {"action": action, "body": {}}
+        with pytest.raises(ActionException):
+            await connection.send(pdu)
+
+    await connection.close()
+
+
+def test_multi_keys(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+    connection = Connection(url, creds)
+
+    asyncio.get_event_loop().run_until_complete(
+        multiKeysClientCoroutine(connection, runner.app)
+    )
+
+
+async def readCacheClientCoroutine(connection, app):
+    await connection.connect()
+
+    appConfig = app['apps_config'].apps[HEALTH_APPKEY]
+    appConfig['read_cache_ttl_ms'] = 60 * 1000
+    readCache = app['read_cache']
+
+    channel = makeUniqueString()
+    for i in range(3):
+        data = {"foo": i}
+        await connection.write(channel, data)
+
+        # the write invalidated the cached value
+        assert await connection.read(channel) == data
+        assert await connection.read(channel) == data
+
+    assert readCache.getStats()['read_cache_hits'] >= 3
+
+    await connection.delete(channel)
+    assert await connection.read(channel) is None
+
+    del appConfig['read_cache_ttl_ms']
+    await connection.close()
+
+
+def test_read_cache(runner):
+    port = runner.port
+
+    url = getDefaultHealthCheckUrl(None, port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+
+    creds = createCredentials(role, secret)
+    connection = Connection(url, creds)
+
+    asyncio.get_event_loop().run_until_complete(
+        readCacheClientCoroutine(connection, runner.app)
+    )
@@ -0,0 +1,72 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import uuid
+
+import pytest
+from cobras.server.redis_drivers import (
+    REDIS_DRIVER_AIOREDIS,
+    REDIS_DRIVERS,
+    RedisDriverClient,
+    makeDriverClient,
+)
+
+
+async def driverCoroutine(driver):
+    redis = makeDriverClient('redis://localhost', None, False, driver)
+    await redis.ping()
+
+    stream = f'test_redis_drivers_{driver}_{uuid.uuid4().hex[:8]}'
+
+    # Stream commands
+    streamId = await redis.xadd(stream, 'json', '{"a": 1}', 10)
+    assert await redis.exists(stream) == 1
+
+    results = await redis.xrevrange(stream, '+', '-', 1)
+    assert results == [
+        (streamId, {b'json': b'{"a": 1}', b'sha1': results[0][1][b'sha1']})
+    ]
+
+    results = await redis.xread(stream, '0')
+    assert results[stream.encode()][0][0] == streamId
+
+    # Errors are returned in place in pipelines
+    key = stream + '_string'
+    results = await redis.pipeline(
+        [('SET', key, 'value'), ('HGET', stream, 'json'), ('GET', key)]
+    )
+    assert results[0] == b'OK'
+    assert isinstance(results[1], Exception)
+    assert results[2] == b'value'
+
+    assert await redis.delete(stream) == 1
+    assert await redis.delete(key) == 1
+
+    redis.close()
+
+
+@pytest.mark.parametrize('driver', REDIS_DRIVERS)
+def test_redis_driver(driver):
+    # aioredis is an optional dependency
+    if driver == REDIS_DRIVER_AIOREDIS:
+        pytest.importorskip('aioredis')
+
+    asyncio.get_event_loop().run_until_complete(driverCoroutine(driver))
+
+
+def test_cluster_support():
+    with pytest.raises(ValueError):
+        makeDriverClient('redis://localhost', None, True, 'aioredis')
+
+    with pytest.raises(ValueError):
+        makeDriverClient('redis://localhost', None, False, 'hiredis')
+
+
+def test_incomplete_driver():
+    class IncompleteClient(RedisDriverClient):
+        async def execute(self, *args):
+            pass
+
+    # Missing methods are reported when the client is created
+    with pytest.raises(TypeError):
+        IncompleteClient('redis://localhost', None)
@@ -0,0 +1,89 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+
+import hiredis
+import pytest
+from cobras.server.redis_pool import RedisClientPool
+
+
+class FakeRedis:
+    def __init__(self):
+        self.closed = False
+        self.pings = 0
+
+    async def ping(self):
+        self.pings += 1
+        return b'PONG'
+
+    def close(self):
+        self.closed = True
+
+
+async def poolCoroutine():
+    clients = []
+
+    def makeRedisClient():
+        redis = FakeRedis()
+        clients.append(redis)
+        return redis
+
+    pool = RedisClientPool(makeRedisClient, size=2)
+
+    async def job():
+        async with pool.client() as redis:
+            await asyncio.sleep(0.01)
+            return redis
+
+    # 5 concurrent jobs share 2 connections
+    redises = await asyncio.gather(*[job() for i in range(5)])
+    assert len(clients) == 2
+    assert set(redises) == set(clients)
+
+    stats = pool.getStats()
+    assert stats['connections'] == 2
+    assert stats['idle'] == 2
+    assert stats['wait_count'] == 3
+    assert stats['max_wait_ms'] > 0
+    assert pool.getStats()['max_wait_ms'] == 0
+
+    # A failing client is closed and replaced
+    with pytest.raises(ConnectionError):
+        async with pool.client() as redis:
+            raise ConnectionError('cannot connect to redis')
+
+    assert redis.closed
+    assert pool.getStats()['connections'] == 1
+
+    # So is a cancelled one
+    async def cancelledJob():
+        async with pool.client() as redis:
+            await asyncio.sleep(1)
+            return redis
+
+    task = asyncio.ensure_future(cancelledJob())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert pool.getStats()['connections'] == 0
+    assert pool.getStats()['errors'] == 2
+
+    # An error replied by redis does not affect the connection
+    with pytest.raises(hiredis.ReplyError):
+        async with pool.client() as redis:
+            raise hiredis.ReplyError('WRONGTYPE Operation against a key')
+
+    assert not redis.closed
+    assert pool.getStats()['connections'] == 1
+    assert pool.getStats()['errors'] == 2
+
+    # Clients idle for too long are checked before being re-used
+    pool.healthCheckInterval = 0
+    async with pool.client() as redis:
+        assert redis.pings == 1
+
+
+def test_pool():
+    asyncio.get_event_loop().run_until_complete(poolCoroutine())
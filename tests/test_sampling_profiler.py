@@ -0,0 +1,167 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import os
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from cobras.client.connection import ActionException, Connection
+from cobras.client.credentials import (
+    createCredentials,
+    getDefaultRoleForApp,
+    getDefaultSecretForApp,
+)
+from cobras.client.health_check import getDefaultHealthCheckUrl
+from cobras.common.sampling_profiler import SamplingProfiler, profile
+
+from .test_utils import makeRunner
+
+
+@pytest.fixture()
+def runner():
+    runner, appsConfigPath = makeRunner(debugMemory=False)
+    yield runner
+
+    runner.terminate()
+    os.unlink(appsConfigPath)
+
+
+def busyFunction():
+    time.sleep(0.01)
+
+
+async def busyCoroutine(duration):
+    start = time.time()
+    while time.time() - start < duration:
+        busyFunction()
+        await asyncio.sleep(0)
+
+
+async def profileCoroutine(mode, top=5):
+    busy = asyncio.ensure_future(busyCoroutine(0.5))
+    result = await profile(0.3, mode, top=top, intervalMs=1)
+    await busy
+    return result
+
+
+def test_sampler():
+    result = asyncio.get_event_loop().run_until_complete(
+        profileCoroutine('sampler', top=1000)
+    )
+    assert result['samples'] > 0
+
+    # Collapsed stacks, the outermost frame first
+    lines = result['stacks'].splitlines()
+    counts = [int(line.rsplit(' ', 1)[1]) for line in lines]
+    assert sum(counts) == result['samples']
+
+    busyStacks = [line for line in lines if 'busyFunction' in line]
+    assert busyStacks
+    assert busyStacks[0].index('busyCoroutine') < busyStacks[0].index('busyFunction')
+
+    # The test spends most of the profile in busyCoroutine
+    busySamples = sum(
+        count for line, count in zip(lines, counts) if 'busyCoroutine' in line
+    )
+    assert busySamples > result['samples'] / 2
+
+    functions = {
+        function['function'].split(' ')[0]: function for function in result['functions']
+    }
+    assert functions['busyCoroutine']['total_samples'] == busySamples
+
+    # Sorted by total samples, without the event loop frames
+    totals = [function['total_samples'] for function in result['functions']]
+    assert totals == sorted(totals, reverse=True)
+    assert '_run_once' not in functions
+    assert 'select' not in functions
+
+
+def test_top_functions():
+    profiler = SamplingProfiler(threadId=0)
+    profiler.stacks.update({'main;run_once;b': 2, 'main;run_once;a': 2, 'main;c': 1})
+    profiler.eventLoopFrames.add('run_once')
+
+    functions = profiler.getTopFunctions(10)
+    assert [function['function'] for function in functions] == ['main', 'a', 'b', 'c']
+    assert functions[0] == {'function': 'main', 'self_samples': 0, 'total_samples': 5}
+
+    functions = profiler.getTopFunctions(2, skipEventLoop=False)
+    assert [function['function'] for function in functions] == ['main', 'run_once']
+
+
+def test_cprofile():
+    result = asyncio.get_event_loop().run_until_complete(profileCoroutine('cprofile'))
+    assert result['stacks'] == ''
+
+    functions = result['functions']
+    assert len(functions) == 5
+    assert functions[0]['total_ms'] >= functions[-1]['total_ms']
+
+
+async def concurrentProfilesCoroutine():
+    first = asyncio.ensure_future(profile(0.1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ValueError):
+        await profile(0.1)
+
+    await first
+
+    with pytest.raises(ValueError):
+        await profile(0.1, mode='perf')
+
+
+def test_concurrent_profiles():
+    asyncio.get_event_loop().run_until_complete(concurrentProfilesCoroutine())
+
+
+async def adminClientCoroutine(url, creds):
+    connection = Connection(url, creds)
+    await connection.connect()
+
+    result = await connection.adminProfile(duration=0.2, top=3)
+    assert result['mode'] == 'sampler'
+    assert result['samples'] > 0
+    assert len(result['functions']) <= 3
+
+    with pytest.raises(ActionException):
+        await connection.adminProfile(duration=3600)
+
+    await connection.close()
+
+
+def test_admin_profile(runner):
+    url = getDefaultHealthCheckUrl(None, runner.port)
+    role = getDefaultRoleForApp('health')
+    secret = getDefaultSecretForApp('health')
+    creds = createCredentials(role, secret)
+
+    asyncio.get_event_loop().run_until_complete(adminClientCoroutine(url, creds))
+
+
+def fetch(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.read().decode('utf8')
+    except urllib.error.HTTPError as e:
+        return e.code, ''
+
+
+def test_http_profile(runner):
+    url = f'http://127.0.0.1:{runner.port}/profile/'
+    loop = asyncio.get_event_loop()
+
+    # The server runs in this loop, so the blocking requests go to a thread
+    status, body = loop.run_until_complete(
+        loop.run_in_executor(None, fetch, url + '?duration=0.2')
+    )
+    assert status == 200
+    assert body.splitlines()
+
+    status, _ = loop.run_until_complete(
+        loop.run_in_executor(None, fetch, url + '?duration=soon')
+    )
+    assert status == 400
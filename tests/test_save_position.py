@@ -65,7 +65,9 @@ class MessageHandlerClass:
         return ActionFlow.SAVE_POSITION
 
 
-async def startSubscriber(url, credentials, channel, resumeFromLastPositionId):
+async def startSubscriber(
+    url, credentials, channel, resumeFromLastPositionId, serverSide
+):
     # fetch last position first
     position = '$'
     stream_sql = None
@@ -73,8 +75,22 @@ async def startSubscriber(url, credentials, channel, resumeFromLastPositionId):
 
     args = {"ids": set()}
 
-    subscriberTask = asyncio.ensure_future(
-        subscribeClient(
+    if serverSide:
+        # The server saves the position of the durable subscription
+        subscribe = subscribeClient(
+            url,
+            credentials,
+            channel,
+            position,
+            stream_sql,
+            MessageHandlerClass,
+            args,
+            waitTime,
+            subscriptionId=resumeFromLastPositionId,
+            resume=True,
+        )
+    else:
+        subscribe = subscribeClient(
             url,
             credentials,
             channel,
@@ -86,7 +102,8 @@ async def startSubscriber(url, credentials, channel, resumeFromLastPositionId):
             resumeFromLastPosition=True,
             resumeFromLastPositionId=resumeFromLastPositionId,
         )
-    )
+
+    subscriberTask = asyncio.ensure_future(subscribe)
 
     return subscriberTask
 
@@ -109,10 +126,10 @@ async def disconnectSubscriptionConnection(connection):
 
 
 async def clientCoroutine(
-    connection, channel, url, credentials, resumeFromLastPositionId
+    connection, channel, url, credentials, resumeFromLastPositionId, serverSide
 ):
     subscriberTask = await startSubscriber(
-        url, credentials, channel, resumeFromLastPositionId
+        url, credentials, channel, resumeFromLastPositionId, serverSide
     )
     await connection.connect()
 
@@ -144,7 +161,8 @@ async def clientCoroutine(
     assert len(messageHandler.args['ids']) == 100
 
 
-def test_save_position(runner):
+@pytest.mark.parametrize('serverSide', [False, True])
+def test_save_position(runner, serverSide):
     '''Starts a server, then run a health check'''
     port = runner.port
 
@@ -161,5 +179,7 @@ def test_save_position(runner):
     resumeFromLastPositionId = 'last_position_id::' + uniqueId
 
     asyncio.get_event_loop().run_until_complete(
-        clientCoroutine(connection, channel, url, creds, resumeFromLastPositionId)
+        clientCoroutine(
+            connection, channel, url, creds, resumeFromLastPositionId, serverSide
+        )
     )
@@ -0,0 +1,102 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import asyncio
+import uuid
+
+import pytest
+from cobras.server.redis_clients import makeRedisClient
+from cobras.server.sharded_redis_client import (
+    ShardedRedisClient,
+    makeHashRing,
+    planMoves,
+)
+
+# Two names for the same redis server, seen as two nodes by the ring
+URLS = ['redis://localhost:6379', 'redis://127.0.0.1:6379']
+
+# Nothing is listening there
+UNREACHABLE_URL = 'redis://127.0.0.1:9'
+
+
+def test_plan_moves():
+    urls = ['redis://a', 'redis://b', 'redis://c']
+    newUrls = urls + ['redis://d']
+
+    ring = makeHashRing(urls)
+    keysByUrl = {url: [] for url in urls}
+    for i in range(1000):
+        key = f'appkey::channel_{i}'
+        keysByUrl[ring.get_node(key)].append(key)
+
+    moves = planMoves(keysByUrl, newUrls)
+
+    # Keys only move to the new node, and most keys stay in place
+    assert moves
+    assert all(destination == 'redis://d' for _, destination in moves)
+    moved = sum(len(keys) for keys in moves.values())
+    assert 0 < moved < 500
+
+    assert not planMoves(keysByUrl, urls)
+
+
+def test_make_redis_client():
+    redis = makeRedisClient(';'.join(URLS), None, False)
+    assert isinstance(redis, ShardedRedisClient)
+
+    redis = makeRedisClient(URLS[0], None, False)
+    assert not isinstance(redis, ShardedRedisClient)
+
+
+async def shardedCoroutine():
+    redis = ShardedRedisClient(URLS, None)
+    await redis.ping()
+
+    prefix = 'test_sharded_' + uuid.uuid4().hex[:8]
+    keys = [f'{prefix}::channel_{i}' for i in range(20)]
+
+    # Keys are spread over both nodes
+    assert {redis.getUrlForKey(key) for key in keys} == set(URLS)
+
+    streamId = await redis.xadd(keys[0], 'json', '{}', 10)
+    assert await redis.xrevrange(keys[0], '+', '-', 1)
+    assert await redis.delete(keys[0]) == 1
+    assert streamId
+
+    commands = [('SET', key, key) for key in keys]
+    results = await redis.pipeline(commands)
+    assert results == [b'OK'] * len(keys)
+
+    # Each node is scanned with its own cursor. Both urls are the same
+    # server, so every key is found twice.
+    cursor = '0'
+    found = []
+    while True:
+        cursor, scanned = await redis.scan(cursor, f'{prefix}::*', 5)
+        found.extend(key.decode() for key in scanned)
+        if cursor == b'0':
+            break
+
+    assert sorted(found) == sorted(keys * 2)
+
+    for key in keys:
+        assert await redis.get(key) == key.encode()
+        await redis.delete(key)
+
+    # Commands sent to an unreachable node fail, the others succeed
+    redis = ShardedRedisClient([URLS[0], UNREACHABLE_URL], None)
+    results = await redis.pipeline(commands)
+
+    for key, result in zip(keys, results):
+        if redis.getUrlForKey(key) == UNREACHABLE_URL:
+            assert isinstance(result, Exception)
+        else:
+            assert result == b'OK'
+            await redis.delete(key)
+
+    redis = ShardedRedisClient([UNREACHABLE_URL], None)
+    with pytest.raises(Exception):
+        await redis.pipeline(commands)
+
+
+def test_sharded_redis_client():
+    asyncio.get_event_loop().run_until_complete(shardedCoroutine())
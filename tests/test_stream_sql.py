@@ -1,6 +1,14 @@
 '''Copyright (c) 2018-2019 Machine Zone, Inc. All rights reserved.'''
 
-from cobras.server.stream_sql import match_stream_sql_filter
+import pytest
+from cobras.server.stream_sql import (
+    InvalidStreamSQLError,
+    StreamSqlAggregator,
+    StreamSqlFilter,
+    StreamSqlIndex,
+    getStreamSqlFilter,
+    match_stream_sql_filter,
+)
 
 
 def test_answer():
@@ -326,3 +334,106 @@ def test_select_field_with_empty_string_value():
     hit = {'data': {"scene_name": ""}}
 
     assert {"data.scene_name": ""} == match_stream_sql_filter(sql_filter, hit)
+
+
+def test_compiled_filter_matches_interpreter():
+    sql_filters = [
+        "SELECT * FROM blah WHERE device.game LIKE '_iso' OR data.count > 3",
+        "SELECT * FROM blah WHERE data.count != 4 AND data.count < 10",
+        "SELECT a.b.c.d AS d, device FROM blah WHERE device.game = 'miso'",
+        "SELECT a.b, missing.field AS m FROM blah",
+    ]
+    msgs = [
+        {'device': {'game': 'miso'}, 'data': {'count': 1}, 'a': {'b': None}},
+        {'device': {'game': 'ody'}, 'data': {'count': 4}, 'a': {'b': {'c': {}}}},
+        {'device': {'game': 'iso'}, 'data': {'count': 0}, 'a': {'b': {'c': 'x'}}},
+    ]
+
+    for sql_filter in sql_filters:
+        f = StreamSqlFilter(sql_filter)
+        for msg in msgs:
+            assert f.match(msg) == f.interpret(msg)
+
+
+def test_compiled_filter_cache():
+    sql_filter = "SELECT * FROM blah WHERE device.game = 'miso'"
+    assert getStreamSqlFilter(sql_filter) is getStreamSqlFilter(sql_filter)
+
+
+def test_stream_sql_index():
+    filters = {
+        'miso': "SELECT * FROM blah WHERE device.game = 'miso' AND data.count > 3",
+        'ody': "SELECT * FROM blah WHERE device.game = 'ody'",
+        'or': "SELECT * FROM blah WHERE device.game = 'miso' OR data.count > 3",
+        'deep': "SELECT * FROM blah WHERE a.b.c = 1",
+    }
+
+    index = StreamSqlIndex()
+    for name, sql_filter in filters.items():
+        index.add(name, StreamSqlFilter(sql_filter).getIndexKey())
+
+    assert index.keys['or'] is None
+
+    msg = {'device': {'game': 'miso'}, 'data': {'count': 10}, 'a': {'b': {'c': 1}}}
+    assert sorted(index.getCandidates(msg)) == ['deep', 'miso', 'or']
+    assert sorted(index.getCandidates([msg])) == ['deep', 'miso', 'or']
+
+    msg = {'device': {'game': {'unhashable': True}}, 'a': {'b': {}}}
+    assert index.getCandidates(msg) == ['or']
+
+    # the filters are the ones dealing with invalid messages
+    assert len(index.getCandidates('invalid')) == len(filters)
+    assert sorted(index.getCandidates({'a': 'b'})) == ['deep', 'or']
+
+    for name in filters:
+        index.remove(name)
+
+    assert len(index) == 0
+    assert index.indexed == {}
+
+
+def test_aggregate():
+    sql_filter = """SELECT device.game AS game, count(*), sum(data.size) AS size
+                    FROM `blah` WHERE data.size > 1
+                    GROUP BY device.game WINDOW TUMBLING(5s)"""
+    f = StreamSqlFilter(sql_filter)
+    assert f.window == 5
+    assert f.channel == 'blah'
+
+    msgs = [
+        {'device': {'game': 'ody'}, 'data': {'size': 3}},
+        {'device': {'game': 'ody'}, 'data': {'size': 2}},
+        {'device': {'game': 'miso'}, 'data': {'size': 5}},
+        {'device': {'game': 'miso'}, 'data': {'size': 1}},
+        {'data': {'size': 4}},
+    ]
+
+    aggregator = StreamSqlAggregator(f)
+    for msg in msgs:
+        output = f.match(msg)
+        if output:
+            aggregator.add(output)
+
+    assert aggregator.flush() == [
+        {'game': 'ody', 'count(*)': 2, 'size': 5},
+        {'game': 'miso', 'count(*)': 1, 'size': 5},
+        {'game': None, 'count(*)': 1, 'size': 4},
+    ]
+    assert aggregator.flush() == []
+
+
+def test_aggregate_invalid():
+    sql_filters = [
+        "SELECT count(*) FROM blah",  # no window
+        "SELECT * FROM blah WINDOW TUMBLING(1s)",  # no aggregates
+        "SELECT a, count(*) FROM blah WINDOW TUMBLING(1s)",  # a not grouped
+        "SELECT avg(a) FROM blah WINDOW TUMBLING(1s)",
+        "SELECT sum(*) FROM blah WINDOW TUMBLING(1s)",
+    ]
+
+    for sql_filter in sql_filters:
+        with pytest.raises(InvalidStreamSQLError):
+            StreamSqlFilter(sql_filter)
+
+    f = StreamSqlFilter("SELECT count(*) FROM blah WINDOW TUMBLING(250ms)")
+    assert f.window == 0.25
@@ -0,0 +1,77 @@
+'''Copyright (c) 2020 Machine Zone, Inc. All rights reserved.'''
+
+import random
+
+from cobras.common.top_k import OTHER_KEY, TopK
+from cobras.server.stats import ServerStats
+
+
+def test_top_k():
+    topK = TopK(3)
+    for i in range(10):
+        topK.update('a', 100)
+    topK.update('b', 5000)
+    topK.update('b', 5)
+    topK.update('c', 1)
+    topK.update('a', 1)
+
+    assert topK.top() == {'a': 11, 'b': 2, 'c': 1}
+    assert topK.top('bytes') == {'b': 5005, 'a': 1001, 'c': 1}
+    assert topK['a'] == 11
+    assert topK['z'] == 0
+
+
+def test_top_k_period():
+    topK = TopK(1)
+    topK.update('a', 10)
+    topK.update('b', 20)
+    topK.endPeriod()
+    topK.update('b', 30)
+
+    assert topK.top('bytes') == {'b': 50, OTHER_KEY: 10}
+    assert topK.top('bytes', period=True) == {'b': 30}
+    assert topK.top('count', period=True) == {'b': 1}
+
+
+def test_top_k_bounded_memory():
+    random.seed(42)
+    topK = TopK(5, capacity=50)
+
+    # A few heavy hitters, lost among many channels seen a couple of times
+    heavy = {f'heavy_{i}': 1000 * (i + 1) for i in range(5)}
+    events = [key for key, count in heavy.items() for _ in range(count)]
+    events += [f'channel_{i}' for i in range(20000) for _ in range(2)]
+    random.shuffle(events)
+
+    for key in events:
+        topK.update(key, 10)
+
+    assert len(topK) == 50
+    assert len(topK.heap) == 50
+
+    top = topK.top()
+    assert set(top) == set(heavy) | {OTHER_KEY}
+    assert sum(top.values()) == len(events)
+    assert sum(topK.top('bytes').values()) == 10 * len(events)
+
+    # Counts are over estimated, by less than a 1/capacity of the total
+    for key, count in heavy.items():
+        assert count <= top[key] <= count + len(events) / 50
+
+
+def test_stats_channel_top_k():
+    stats = ServerStats(None, '_stats', channelStatsTopK=2)
+
+    for i in range(1000):
+        stats.updateChannelPublished(f'channel_{i}', 10)
+    for i in range(100):
+        stats.updateChannelPublished('busy', 100)
+        stats.updateChannelPublished('busier', 200)
+
+    top = stats.publishedByChannel.top('bytes')
+    assert list(top) == ['busier', 'busy', OTHER_KEY]
+    assert sum(top.values()) == 40000
+
+    # Over estimated by at most the total divided by the 20 tracked channels
+    assert 20000 <= top['busier'] <= 22000
+    assert 10000 <= top['busy'] <= 12000
@@ -34,7 +34,8 @@ def makeRunner(
         if redisCluster:
             redisUrls = 'redis://localhost:11000'
         else:
-            redisUrls = 'redis://localhost'
+            # memory:// runs the server tests without redis
+            redisUrls = os.getenv('COBRA_TEST_REDIS_URLS', 'redis://localhost')
 
     appsConfigPath = tempfile.mktemp()
     appsConfig = AppsConfig(appsConfigPath)
@@ -0,0 +1,176 @@
+"""Compare the redis drivers on the publish, subscribe and kv workloads
+
+python tools/bench_redis_drivers.py [redis_url] [operations] [concurrency]
+
+Runs against a local redis by default. For each driver, prints the
+throughput and the p50 / p99 latencies of each workload as soon as the
+driver is done. Drivers which are not installed are skipped:
+
+* publish: concurrent XADDs sharing one client, like the publish handlers
+* subscribe: time between an XADD and its delivery to a blocking XREAD
+* kv: concurrent pipelined XADD writes and XREVRANGE reads on the same keys
+
+The memory:// backend is included as a baseline without redis round trips.
+"""
+
+import asyncio
+import sys
+import time
+import uuid
+
+import tabulate
+
+from cobras.server.memory_redis_client import MemoryRedisClient
+from cobras.server.redis_drivers import REDIS_DRIVERS, makeDriverClient
+
+url = sys.argv[1] if len(sys.argv) > 1 else 'redis://localhost'
+operations = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+MAX_LEN = 1000
+DATA = '{"action": "rtm/publish", "body": {"channel": "bench", "message": {}}}'
+
+
+def makeClient(driver):
+    if driver == 'memory':
+        return MemoryRedisClient('memory://bench')
+
+    return makeDriverClient(url, None, False, driver)
+
+
+def percentile(latencies, p):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+async def runConcurrently(job):
+    latencies = []
+
+    async def worker(count):
+        for i in range(count):
+            start = time.perf_counter()
+            await job(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[worker(operations // concurrency) for _ in range(concurrency)]
+    )
+    return latencies, time.perf_counter() - start
+
+
+async def benchPublish(driver, stream):
+    redis = makeClient(driver)
+
+    async def job(i):
+        await redis.xadd(stream, 'json', DATA, MAX_LEN)
+
+    latencies, duration = await runConcurrently(job)
+    redis.close()
+    return latencies, duration
+
+
+async def benchSubscribe(driver, stream):
+    publisher = makeClient(driver)
+    subscriber = makeClient(driver)
+    latencies = []
+
+    # Make sure the stream exists, so that we can read from its last id
+    lastId = (await publisher.xadd(stream, 'json', DATA, MAX_LEN)).decode()
+
+    async def subscribe():
+        nonlocal lastId
+        while len(latencies) < operations:
+            results = await subscriber.xread(stream, lastId)
+            now = time.perf_counter()
+            for position, msg in results[stream.encode()]:
+                lastId = position.decode()
+                latencies.append(now - float(msg[b'json']))
+
+    task = asyncio.ensure_future(subscribe())
+
+    start = time.perf_counter()
+    for i in range(operations):
+        await publisher.xadd(stream, 'json', str(time.perf_counter()), MAX_LEN)
+        # The memory backend never blocks, let the subscriber keep up
+        await asyncio.sleep(0)
+
+    await task
+    duration = time.perf_counter() - start
+
+    publisher.close()
+    subscriber.close()
+    return latencies, duration
+
+
+async def benchKv(driver, stream):
+    redis = makeClient(driver)
+    keys = [f'{stream}_{i}' for i in range(concurrency)]
+
+    async def job(i):
+        key = keys[i % len(keys)]
+        if i % 2 == 0:
+            command = redis.makeXaddCommand(key, 'json', DATA, 1)
+            await redis.pipeline([command])
+        else:
+            await redis.xrevrange(key, '+', '-', 1)
+
+    latencies, duration = await runConcurrently(job)
+
+    for key in keys:
+        await redis.delete(key)
+
+    redis.close()
+    return latencies, duration
+
+
+WORKLOADS = [('publish', benchPublish), ('subscribe', benchSubscribe), ('kv', benchKv)]
+
+
+async def isAvailable(driver):
+    '''Optional drivers such as aioredis may not be installed'''
+    redis = makeClient(driver)
+    try:
+        await redis.ping()
+    except ImportError as e:
+        print(f'{driver}: skipped, {e}')
+        return False
+    finally:
+        redis.close()
+
+    return True
+
+
+async def main():
+    print(f'{operations} operations, {concurrency} concurrent clients')
+
+    for driver in REDIS_DRIVERS + ('memory',):
+        if not await isAvailable(driver):
+            continue
+
+        rows = [['driver', 'workload', 'ops/s', 'p50 (ms)', 'p99 (ms)']]
+
+        for name, bench in WORKLOADS:
+            stream = f'bench_redis_drivers_{uuid.uuid4().hex[:8]}'
+            latencies, duration = await bench(driver, stream)
+
+            rows.append(
+                [
+                    driver,
+                    name,
+                    round(len(latencies) / duration),
+                    round(1000 * percentile(latencies, 0.5), 3),
+                    round(1000 * percentile(latencies, 0.99), 3),
+                ]
+            )
+
+            cleanup = makeClient(driver)
+            await cleanup.delete(stream)
+            cleanup.close()
+
+        # Each driver as soon as it is done, the slowest ones take a while
+        print()
+        print(tabulate.tabulate(rows, tablefmt="simple", headers="firstrow"))
+
+
+asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,132 @@
+"""Compare the cost per message of the server stats counters
+
+python tools/bench_stats.py [messages]
+
+The previous implementation (four defaultdict increments per message, and
+new dicts every period) is reproduced here, and compared with the
+CounterRegistry and TopK used by ServerStats, for the role and for the
+channel counters. Most messages go to a few busy channels, the others to
+channels seen too rarely to stay in the top K, which are evicted.
+A period ends every 1000 messages. The cost of the benchmark loop itself
+is subtracted, best of 5 runs.
+"""
+
+import collections
+import random
+import sys
+import timeit
+
+from cobras.server.stats import ServerStats
+
+messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+ROLES = ['_sub', '_pub', 'health', 'admin']
+MESSAGES_PER_PERIOD = 1000
+REPEAT = 5
+
+# 1 message in 8 goes to one of 100000 quiet channels
+random.seed(42)
+CHANNELS_MASK = 0xFFFF
+CHANNELS = [
+    f'quiet_{random.randrange(100000)}' if i % 8 == 0 else f'busy_{i % 50}'
+    for i in range(CHANNELS_MASK + 1)
+]
+
+
+class DictCounters:
+    def __init__(self):
+        self.publishedCount = collections.defaultdict(int)
+        self.publishedBytes = collections.defaultdict(int)
+        self.resetCounterByPeriod()
+
+    def resetCounterByPeriod(self):
+        # Only two of the twelve dicts are used by this benchmark
+        self.publishedCountByPeriod = collections.defaultdict(int)
+        self.publishedBytesByPeriod = collections.defaultdict(int)
+        for _ in range(10):
+            collections.defaultdict(int)
+
+    def updatePublished(self, key, val):
+        self.publishedCount[key] += 1
+        self.publishedBytes[key] += val
+
+        self.publishedCountByPeriod[key] += 1
+        self.publishedBytesByPeriod[key] += val
+
+
+def benchLoop():
+    for i in range(messages):
+        ROLES[i & 3]
+        if i % MESSAGES_PER_PERIOD == 0:
+            pass
+
+
+def benchChannelLoop():
+    for i in range(messages):
+        CHANNELS[i & CHANNELS_MASK]
+        if i % MESSAGES_PER_PERIOD == 0:
+            pass
+
+
+def benchDict():
+    counters = DictCounters()
+    updatePublished = counters.updatePublished
+    for i in range(messages):
+        updatePublished(ROLES[i & 3], 100)
+        if i % MESSAGES_PER_PERIOD == 0:
+            counters.resetCounterByPeriod()
+
+
+def benchServerStats():
+    stats = ServerStats(None, '_stats')
+    updatePublished = stats.updatePublished
+    for i in range(messages):
+        updatePublished(ROLES[i & 3], 100)
+        if i % MESSAGES_PER_PERIOD == 0:
+            stats.counters.endPeriod()
+
+
+def benchChannelDict():
+    # Unbounded, one entry per channel ever seen
+    counters = DictCounters()
+    updatePublished = counters.updatePublished
+    for i in range(messages):
+        updatePublished(CHANNELS[i & CHANNELS_MASK], 100)
+        if i % MESSAGES_PER_PERIOD == 0:
+            counters.resetCounterByPeriod()
+
+
+def benchChannelServerStats():
+    stats = ServerStats(None, '_stats')
+    updateChannelPublished = stats.updateChannelPublished
+    for i in range(messages):
+        updateChannelPublished(CHANNELS[i & CHANNELS_MASK], 100)
+        if i % MESSAGES_PER_PERIOD == 0:
+            stats.publishedByChannel.endPeriod()
+
+
+def bestOf(bench):
+    return min(timeit.repeat(bench, number=1, repeat=REPEAT))
+
+
+for loop, benches in [
+    (
+        benchLoop,
+        [
+            ('role before: defaultdicts', benchDict),
+            ('role after: ServerStats', benchServerStats),
+        ],
+    ),
+    (
+        benchChannelLoop,
+        [
+            ('channel before: defaultdicts', benchChannelDict),
+            ('channel after: TopK', benchChannelServerStats),
+        ],
+    ),
+]:
+    baseline = bestOf(loop)
+
+    for name, bench in benches:
+        duration = bestOf(bench) - baseline
+        print(f'{name:30} {1e9 * duration / messages:.0f} ns per message')
@@ -0,0 +1,64 @@
+"""Compare the compiled stream sql filters with the original interpreter
+
+python tools/bench_stream_sql.py [iterations]
+"""
+
+import sys
+import timeit
+
+from cobras.server.stream_sql import StreamSqlFilter
+
+FILTERS = [
+    "SELECT * FROM `blah` WHERE device.game = 'miso'",
+    "SELECT * FROM `blah` WHERE device.game LIKE '_iso'",
+    """SELECT * FROM `blah` WHERE data.file_count = 16
+                          AND data.payload_KB = 5637
+                          AND data.essential = true""",
+    "SELECT * FROM `blah` WHERE data.stats.fps.min > 30",
+    """SELECT device.app_version AS app_version, data.file_count
+       FROM `blah` WHERE data.file_count > 16""",
+]
+
+MSGS = [
+    {
+        'device': {'game': 'miso', 'app_version': '4.3.2'},
+        'data': {
+            'essential': True,
+            'file_count': 16,
+            'payload_KB': 5637,
+            'stats': {'fps': {'min': 45}},
+        },
+    },
+    {
+        'device': {'game': 'ody', 'app_version': '4.3.1'},
+        'data': {
+            'essential': False,
+            'file_count': 17,
+            'payload_KB': 10,
+            'stats': {'fps': {'min': 12}},
+        },
+    },
+]
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+for sql in FILTERS:
+    streamSqlFilter = StreamSqlFilter(sql)
+
+    for msg in MSGS:
+        assert streamSqlFilter.match(msg) == streamSqlFilter.interpret(msg)
+
+    def interpret():
+        for msg in MSGS:
+            streamSqlFilter.interpret(msg)
+
+    def match():
+        for msg in MSGS:
+            streamSqlFilter.match(msg)
+
+    interpreted = timeit.timeit(interpret, number=iterations)
+    compiled = timeit.timeit(match, number=iterations)
+
+    print(' '.join(sql.split()))
+    print(f'  interpreted {interpreted:.3f}s compiled {compiled:.3f}s', end=' ')
+    print(f'speedup x{interpreted / compiled:.1f}')